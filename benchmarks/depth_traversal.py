@@ -0,0 +1,104 @@
+"""
+Compare the recursive (depth-first) traversal, utils.track_entity, with
+the breadth-first traversal, utils.track_provenance, for DEPTH=n on two
+synthetic graphs:
+
+    diamonds   entity e<i> was generated by activity a<i>, which used
+               e<i+1>, and e<i> was also derived from e<i+1>; the
+               recursion follows wasDerivedFrom first, i.e. the
+               shorter path
+    shortcuts  chain of wasDerivedFrom relations e<i> -> e<i+1>, with
+               an additional shortcut e<i> -> e<i+2>, stored after the
+               chain relation, so depth-first search finds the longer
+               path first
+
+The recursive traversal visits each node only once, at the distance it
+was found first, so it misses nodes in the shortcut graph, while the
+breadth-first traversal finds all nodes within DEPTH relations.
+
+Usage (from the repository root, with tests/local.py as for runtests.py):
+    python benchmarks/depth_traversal.py [number of layers] [depth]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.test_settings')
+
+
+def make_diamonds(num):
+    from prov_vo.models import Entity, Activity, Used, WasGeneratedBy, WasDerivedFrom
+
+    Entity.objects.bulk_create([Entity(id="d:e%d" % i) for i in range(num + 1)])
+    Activity.objects.bulk_create([Activity(id="d:a%d" % i) for i in range(num)])
+    WasGeneratedBy.objects.bulk_create([
+        WasGeneratedBy(entity_id="d:e%d" % i, activity_id="d:a%d" % i) for i in range(num)
+    ])
+    Used.objects.bulk_create([
+        Used(activity_id="d:a%d" % i, entity_id="d:e%d" % (i + 1)) for i in range(num)
+    ])
+    WasDerivedFrom.objects.bulk_create([
+        WasDerivedFrom(generatedEntity_id="d:e%d" % i, usedEntity_id="d:e%d" % (i + 1)) for i in range(num)
+    ])
+    return "d:e0"
+
+
+def make_shortcuts(num):
+    from prov_vo.models import Entity, WasDerivedFrom
+
+    Entity.objects.bulk_create([Entity(id="s:e%d" % i) for i in range(num + 2)])
+    relations = []
+    for i in range(num):
+        relations.append(WasDerivedFrom(generatedEntity_id="s:e%d" % i, usedEntity_id="s:e%d" % (i + 1)))
+        relations.append(WasDerivedFrom(generatedEntity_id="s:e%d" % i, usedEntity_id="s:e%d" % (i + 2)))
+    WasDerivedFrom.objects.bulk_create(relations)
+    return "s:e0"
+
+
+def get_empty_prov():
+    keys = ['activity', 'activityFlow', 'entity', 'collection', 'agent',
+        'used', 'wasGeneratedBy', 'wasAssociatedWith', 'wasAttributedTo',
+        'hadMember', 'wasDerivedFrom', 'wasInfluencedBy', 'hadStep', 'wasInformedBy',
+        'parameter', 'parameterDescription', 'activityDescription', 'entityDescription',
+        'usedDescription', 'wasGeneratedByDescription']
+    return dict((key, {}) for key in keys)
+
+
+def measure(name, track, start_id, depth):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from prov_vo.models import Entity
+
+    entity = Entity.objects.get(id=start_id)
+    prov = get_empty_prov()
+    prov['entity'][entity.id] = entity
+    with CaptureQueriesContext(connection) as context:
+        start = time.time()
+        prov = track(entity, prov, depth)
+        duration = time.time() - start
+    print "  %-15s %8.3f s  %6d queries  %6d entities  %6d activities" % (
+        name, duration, len(context.captured_queries), len(prov['entity']), len(prov['activity']))
+
+
+if __name__ == '__main__':
+    import django
+    from django.db import connection
+    django.setup()
+    from prov_vo import utils
+
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    depth = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    # the recursion needs a few stack frames per relation
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 20 * depth))
+
+    connection.creation.create_test_db(verbosity=0)
+    traversals = [
+        ("recursive", lambda entity, prov, depth: utils.track_entity(entity, prov, depth)),
+        ("breadth-first", lambda entity, prov, depth: utils.track_provenance(prov, [entity.id], countdown=depth)),
+    ]
+    for name, make_graph in [("diamonds", make_diamonds), ("shortcuts", make_shortcuts)]:
+        start_id = make_graph(num)
+        print "%s graph with %d layers, DEPTH=%d" % (name, num, depth)
+        for traversal, track in traversals:
+            measure(traversal, track, start_id, depth)
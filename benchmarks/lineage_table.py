@@ -0,0 +1,114 @@
+"""
+Compare the cost of maintaining the lineage table (prov_vo/lineage.py)
+with the speedup of the provenance search, on a synthetic pipeline of
+layers: in each layer, activity a<l>_<j> used the entities e<l+1>_<j>
+and e<l+1>_<j+1> of the next layer and generated e<l>_<j>.
+
+Measured are
+    - the complete rebuild (prov_lineage command),
+    - saving nodes and relations with and without the lineage table,
+      i.e. the incremental update in the signals: each step adds an
+      entity used by an activity of the last layer (an ancestor of
+      many nodes) and an activity using an entity of the last layer
+      (a descendant of one node),
+    - deleting a single relation,
+    - the search for DEPTH=ALL and DEPTH=n from the top entity, with
+      the lineage table, the recursive query (DEPTH=ALL only) and the
+      level-by-level traversal.
+
+Usage (from the repository root, with tests/local.py as for runtests.py):
+    python benchmarks/lineage_table.py [number of layers] [width] [depth]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.test_settings')
+
+
+def make_pipeline(layers, width):
+    from prov_vo.models import Entity, Activity, Used, WasGeneratedBy
+
+    Entity.objects.bulk_create([
+        Entity(id="p:e%d_%d" % (l, j), name="Entity %d %d" % (l, j))
+        for l in range(layers + 1) for j in range(width + 1)
+    ])
+    Activity.objects.bulk_create([
+        Activity(id="p:a%d_%d" % (l, j), name="Activity %d %d" % (l, j))
+        for l in range(layers) for j in range(width)
+    ])
+    WasGeneratedBy.objects.bulk_create([
+        WasGeneratedBy(entity_id="p:e%d_%d" % (l, j), activity_id="p:a%d_%d" % (l, j))
+        for l in range(layers) for j in range(width)
+    ])
+    Used.objects.bulk_create([
+        Used(activity_id="p:a%d_%d" % (l, j), entity_id="p:e%d_%d" % (l + 1, j + k))
+        for l in range(layers) for j in range(width) for k in range(2)
+    ])
+    return "p:e0_0"
+
+
+def set_lineage_table(enabled):
+    from django.conf import settings
+    settings.PROV_VO_CONFIG['lineage_table'] = enabled
+
+
+def measure(name, func, repeat=1):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connection) as context:
+        start = time.time()
+        for i in range(repeat):
+            result = func(i)
+        duration = (time.time() - start) / repeat
+    print "  %-38s %9.2f ms  %6.1f queries" % (name, duration * 1000, len(context.captured_queries) / float(repeat))
+    return result
+
+
+def add_layer(layers, width, suffix):
+    # a new layer of entities used by the activities of the bottom layer
+    from prov_vo.models import Entity, Activity, Used
+
+    def add(i):
+        activity = Activity.objects.create(id="p:x%s_%d" % (suffix, i))
+        entity = Entity.objects.create(id="p:y%s_%d" % (suffix, i))
+        Used.objects.create(activity_id="p:a%d_%d" % (layers - 1, i % width), entity=entity)
+        Used.objects.create(activity=activity, entity_id="p:e%d_%d" % (layers, i % width))
+    return add
+
+
+if __name__ == '__main__':
+    import django
+    from django.db import connection
+    django.setup()
+    from prov_vo import lineage, rows, cte
+    from prov_vo.models import Lineage, Used
+
+    layers = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    depth = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    connection.creation.create_test_db(verbosity=0)
+    start_id = make_pipeline(layers, width)
+    print "pipeline of %d layers with %d activities each" % (layers, width)
+
+    print "maintenance"
+    measure("rebuild", lambda i: lineage.rebuild_lineage())
+    print "  %d rows in the lineage table" % Lineage.objects.count()
+    set_lineage_table(False)
+    measure("save relations, without table", add_layer(layers, width, 'a'), repeat=10)
+    set_lineage_table(True)
+    measure("save relations, with table", add_layer(layers, width, 'b'), repeat=10)
+    relation = Used.objects.filter(activity_id="p:a%d_0" % (layers // 2)).first()
+    measure("delete relation, with table", lambda i: relation.delete())
+
+    print "search from %s" % start_id
+    set_lineage_table(True)
+    measure("DEPTH=ALL lineage table", lambda i: lineage.track_provenance_ids([start_id], countdown=-1))
+    measure("DEPTH=%d lineage table" % depth, lambda i: lineage.track_provenance_ids([start_id], countdown=depth))
+    set_lineage_table(False)
+    if cte.supports_recursive_cte():
+        measure("DEPTH=ALL recursive query", lambda i: cte.get_provenance_ids_cte([start_id]))
+    measure("DEPTH=ALL level by level", lambda i: rows.track_provenance_ids([start_id], countdown=-1))
+    measure("DEPTH=%d level by level" % depth, lambda i: rows.track_provenance_ids([start_id], countdown=depth))
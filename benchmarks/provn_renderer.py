@@ -0,0 +1,95 @@
+"""
+Compare the PROV-N renderer with the former implementation (string
+concatenation, new statement renderer for each statement) on a
+synthetic document.
+
+Usage (from the repository root):
+    python benchmarks/provn_renderer.py [number of statements]
+
+The time of the former renderer grows quadratically with the number of
+statements (several minutes for the default of 100000).
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import django
+from django.conf import settings
+
+settings.configure()
+django.setup()
+
+from prov_vo.renderers import (
+    PROVNRenderer, join_chunks, ActivityPROVNRenderer, EntityPROVNRenderer,
+    UsedPROVNRenderer, WasGeneratedByPROVNRenderer, WasDerivedFromPROVNRenderer
+)
+
+
+class FormerPROVNRenderer(object):
+    # document assembly as done before, for the sections used here
+
+    def render(self, data):
+        string = "document\n"
+        for p_id, p in data['prefix'].iteritems():
+            string += "prefix %s <%s>\n" % (p_id, p)
+        string += "\n"
+
+        for a_id, a in data['activity'].iteritems():
+            string += ActivityPROVNRenderer().render(a) + "\n"
+        for e_id, e in data['entity'].iteritems():
+            string += EntityPROVNRenderer().render(e) + "\n"
+        for u_id, u in data['used'].iteritems():
+            string += UsedPROVNRenderer().render(u) + "\n"
+        for w_id, w in data['wasGeneratedBy'].iteritems():
+            string += WasGeneratedByPROVNRenderer().render(w) + "\n"
+        for w_id, w in data['wasDerivedFrom'].iteritems():
+            string += WasDerivedFromPROVNRenderer().render(w) + "\n"
+
+        string += "endDocument"
+        return string
+
+
+def make_data(num):
+    # num statements, distributed over five sections
+    n = num // 5
+    return {
+        'prefix': {'ex': "http://example.org/", 'voprov': "http://www.ivoa.net/documents/ProvenanceDM/ns/voprov/"},
+        'activity': dict(("ex:a%d" % i, {
+            'voprov:id': "ex:a%d" % i, 'voprov:name': "Activity %d" % i,
+            'voprov:startTime': "2017-01-01T00:00:00", 'voprov:type': "reduction"
+        }) for i in range(n)),
+        'entity': dict(("ex:e%d" % i, {
+            'voprov:id': "ex:e%d" % i, 'voprov:name': "Entity %d" % i, 'voprov:type': "voprov:dataSet"
+        }) for i in range(n)),
+        'used': dict(("_:%d" % i, {
+            'voprov:id': "_:%d" % i, 'voprov:activity': "ex:a%d" % i, 'voprov:entity': "ex:e%d" % i,
+            'voprov:role': "input"
+        }) for i in range(n)),
+        'wasGeneratedBy': dict(("_:%d" % i, {
+            'voprov:id': "_:%d" % i, 'voprov:activity': "ex:a%d" % i, 'voprov:entity': "ex:e%d" % i
+        }) for i in range(n)),
+        'wasDerivedFrom': dict(("_:%d" % i, {
+            'voprov:id': "_:%d" % i, 'voprov:generatedEntity': "ex:e%d" % i, 'voprov:usedEntity': "ex:e%d" % (i + 1)
+        }) for i in range(n)),
+    }
+
+
+def measure(name, render, num):
+    data = make_data(num)
+    start = time.time()
+    result = render(data)
+    duration = time.time() - start
+    print "%-30s %8.3f s  %10d characters" % (name, duration, len(result))
+    return result
+
+
+if __name__ == '__main__':
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print "Rendering %d PROV-N statements" % num
+    former = measure("former renderer", FormerPROVNRenderer().render, num)
+    current = measure("PROVNRenderer.render", PROVNRenderer().render, num)
+    streamed = measure("PROVNRenderer (chunks)",
+        lambda data: "".join(join_chunks(PROVNRenderer().iter_lines(data.get), 65536)), num)
+    assert former == current == streamed
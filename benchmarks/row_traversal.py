@@ -0,0 +1,103 @@
+"""
+Compare the provenance traversal with model instances (views.find_provenance)
+and with values() rows (rows.track_provenance_rows), including the IVOA
+serialization, for DEPTH=ALL on a synthetic derivation chain: each
+entity was generated by an activity that used the next entity.
+
+Usage (from the repository root, with tests/local.py as for runtests.py):
+    python benchmarks/row_traversal.py [number of entities]
+
+Each mode runs in its own process on a fresh in-memory test database,
+so that the increase of the peak resident memory can be compared.
+"""
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.test_settings')
+
+MODES = ['instances', 'rows']
+
+
+def make_chain(num):
+    from prov_vo.models import Entity, EntityDescription, Activity, Used, WasGeneratedBy
+
+    EntityDescription.objects.create(id="ex:desc", name="Synthetic entity")
+    Entity.objects.bulk_create([
+        Entity(id="ex:e%d" % i, name="Entity %d" % i, type="voprov:dataSet", description_id="ex:desc")
+        for i in range(num)
+    ])
+    Activity.objects.bulk_create([
+        Activity(id="ex:a%d" % i, name="Activity %d" % i, type="reduction") for i in range(num - 1)
+    ])
+    WasGeneratedBy.objects.bulk_create([
+        WasGeneratedBy(entity_id="ex:e%d" % i, activity_id="ex:a%d" % i) for i in range(num - 1)
+    ])
+    Used.objects.bulk_create([
+        Used(activity_id="ex:a%d" % i, entity_id="ex:e%d" % (i + 1), role="input") for i in range(num - 1)
+    ])
+
+
+def get_empty_prov():
+    keys = ['activity', 'activityFlow', 'entity', 'collection', 'agent',
+        'used', 'wasGeneratedBy', 'wasAssociatedWith', 'wasAttributedTo',
+        'hadMember', 'wasDerivedFrom', 'wasInfluencedBy', 'hadStep', 'wasInformedBy',
+        'parameter', 'parameterDescription', 'activityDescription', 'entityDescription',
+        'usedDescription', 'wasGeneratedByDescription']
+    prov = dict((key, {}) for key in keys)
+    prov['prefix'] = {'ex': "http://example.org/"}
+    return prov
+
+
+def track_instances(prov):
+    from prov_vo.models import Entity
+    from prov_vo.views import find_provenance
+
+    entity = Entity.objects.select_related('description').get(id="ex:e0")
+    prov['entity'][entity.id] = entity
+    prov = find_provenance(prov, [entity.id], [], [], -1)
+    for key in ['entity', 'activity', 'used', 'wasGeneratedBy', 'parameter']:
+        for o in prov[key].itervalues():
+            if o.description:
+                prov[key + 'Description'][o.description.id] = o.description
+    return prov
+
+
+def track_rows(prov):
+    from prov_vo import rows
+    return rows.track_provenance_rows(prov, ["ex:e0"], -1)
+
+
+def run(mode, num):
+    import django
+    from django.db import connection
+    django.setup()
+    from prov_vo.serializers import VOProvenanceSerializer
+
+    connection.creation.create_test_db(verbosity=0)
+    make_chain(num)
+
+    track = track_instances if mode == 'instances' else track_rows
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    prov = track(get_empty_prov())
+    tracked = time.time()
+    data = VOProvenanceSerializer(prov).data
+    end = time.time()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print "%-10s traversal %7.3f s  serialization %7.3f s  total %7.3f s  peak RSS +%7.1f MB  (%d entities)" % (
+        mode, tracked - start, end - tracked, end - start, (rss_after - rss_before) / 1024.0, len(data['entity']))
+
+
+if __name__ == '__main__':
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    if len(sys.argv) > 2:
+        run(sys.argv[2], num)
+    else:
+        print "DEPTH=ALL for a chain of %d entities and %d activities" % (num, num - 1)
+        for mode in MODES:
+            subprocess.check_call([sys.executable, os.path.abspath(__file__), str(num), mode])
@@ -0,0 +1 @@
+default_app_config = 'prov_vo.apps.ProvVoConfig'
@@ -5,3 +5,7 @@ from django.apps import AppConfig
 
 class ProvVoConfig(AppConfig):
     name = 'prov_vo'
+
+    def ready(self):
+        # connect signal receivers (cache invalidation)
+        from . import signals
@@ -0,0 +1,410 @@
+"""
+Bulk loading of provenance records from PROV-JSON documents as written
+by PROVJSONRenderer for MODEL=IVOA, used by the prov_load command and
+the provload view.
+
+The document is read incrementally, one record at a time, and the
+records are written with bulk_create in batches, each batch in its own
+transaction. Foreign keys must point to objects that exist when a batch
+is written, but the renderer writes the descriptions after the nodes
+and the activityFlows after the relations. So the document is read in
+three passes (LOAD_PASSES): first the descriptions, then the nodes and
+finally the parameters and relations. Entities that are the collection
+of a hadMember relation are loaded as Collection. Input that cannot be
+read again (e.g. a request body) is copied to a temporary file first.
+
+Records whose id already exists (in the database or earlier in the
+input) are skipped, relations are compared by their field values
+instead (their ids are not kept). Records referencing ids that are
+neither in the database nor in the input are skipped as unresolved.
+"""
+import codecs
+import json
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db import transaction, DEFAULT_DB_ALIAS
+
+from .models import ActivityFlow
+from .serializers import get_compiled_serializer, VOCollectionSerializer
+from .utils import chunks, bulk_create_objects, InvalidDataError, RELATION_MODELS
+from .rows import ROW_SERIALIZERS
+from .signals import invalidate_after_bulk_change
+
+# serializer for each section of the document, defines its attributes
+LOAD_SERIALIZERS = dict(ROW_SERIALIZERS, collection=VOCollectionSerializer)
+
+# sections read in each pass over the input, in the order of writing
+LOAD_PASSES = [
+    ['parameterDescription', 'activityDescription', 'entityDescription'],
+    ['usedDescription', 'wasGeneratedByDescription',
+        'activity', 'activityFlow', 'entity', 'collection', 'agent'],
+    ['parameter', 'used', 'wasGeneratedBy', 'wasAssociatedWith', 'wasAttributedTo',
+        'hadMember', 'wasDerivedFrom', 'wasInformedBy', 'hadStep'],
+]
+
+# The renderer writes collections to the entity section; the ids of
+# the collections are taken from these relations in the first pass
+COLLECTION_SECTION = 'hadMember'
+COLLECTION_ATTRIBUTES = ['voprov:collection', 'collection']
+
+# relations get new ids, the ids in the document are ignored
+RELATION_KEYS = [key for key in RELATION_MODELS if key != 'parameter']
+
+# number of unresolved records listed in the statistics
+MAX_UNRESOLVED_EXAMPLES = 10
+
+
+class DocumentReader(object):
+    """
+    Incremental reader for PROV-JSON documents, i.e. a JSON object of
+    sections, each of them a JSON object of records. Only one record
+    and one chunk of the input are kept in memory.
+    """
+
+    def __init__(self, fileobj, chunk_size=65536):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.buf = u''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def read_more(self):
+        # append the next chunk to the unread part of the buffer
+        if self.eof:
+            return False
+        data = self.fileobj.read(self.chunk_size)
+        if not data:
+            self.eof = True
+        if isinstance(data, bytes):
+            data = self.text_decoder.decode(data, final=self.eof)
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return bool(data) or not self.eof
+
+    def peek(self):
+        # next non-whitespace character, without consuming it
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.read_more():
+                raise InvalidDataError("Bad request: unexpected end of the PROV-JSON document.")
+
+    def expect(self, chars):
+        char = self.peek()
+        if char not in chars:
+            raise InvalidDataError("Bad request: expected '%s' in the PROV-JSON document, found '%s'." % ("' or '".join(chars), char))
+        self.pos += 1
+        return char
+
+    def decode(self):
+        # decode the next JSON value; one that ends with the buffer
+        # (e.g. a number) may continue in the next chunk
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if self.read_more():
+                    continue
+                raise InvalidDataError("Bad request: the PROV-JSON document is not valid JSON.")
+            if end == len(self.buf) and self.read_more():
+                continue
+            self.pos = end
+            return value
+
+    def iter_keys(self):
+        """
+        Yield the keys of a JSON object, the caller must read the value
+        of each key before the next one is requested.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.decode()
+            if not isinstance(key, basestring):
+                raise InvalidDataError("Bad request: invalid key in the PROV-JSON document.")
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+    def iter_records(self, sections):
+        # yield (section, id, record) for the records of the given sections
+        for section in self.iter_keys():
+            if section == 'prefix':
+                self.decode()
+                continue
+            if section not in LOAD_SERIALIZERS:
+                raise InvalidDataError("Bad request: unknown section '%s' in the PROV-JSON document." % section)
+            for record_id in self.iter_keys():
+                record = self.decode()
+                if section in sections:
+                    if not isinstance(record, dict):
+                        raise InvalidDataError("Bad request: the record %s in section %s is not a JSON object." % (record_id, section))
+                    yield section, record_id, record
+
+
+def get_attribute_fields(section):
+    """
+    Return the model of the section and a dictionary document attribute
+    -> model field, derived from the serializer of the section. The
+    attributes of relations (and their descriptions) may have the
+    'voprov:' prefix added by VOProvenanceSerializer.restructure_relations.
+    """
+    serializer_class = LOAD_SERIALIZERS[section]
+    model = serializer_class.Meta.model
+    fields = {}
+    for attrs, key, field_name, converter in get_compiled_serializer(serializer_class).fields:
+        field = model._meta.get_field(attrs[0])
+        fields[field_name] = field
+        if ':' not in field_name:
+            fields['voprov:' + field_name] = field
+    return model, fields
+
+
+def get_base_model(model):
+    # the model of the table with the ids, e.g. Entity for Collection
+    parents = model._meta.get_parent_list()
+    return parents[-1] if parents else model
+
+
+def is_seekable(fileobj):
+    try:
+        fileobj.seek(fileobj.tell())
+    except (AttributeError, IOError, OSError, ValueError):
+        return False
+    return True
+
+
+def spool(fileobj, chunk_size=65536):
+    # copy a (non-seekable) stream to a temporary file, for reading it several times
+    spooled = tempfile.TemporaryFile()
+    shutil.copyfileobj(fileobj, spooled, chunk_size)
+    spooled.seek(0)
+    return spooled
+
+
+class ProvLoader(object):
+    """
+    Load PROV-JSON documents into the database, see the module docstring.
+    The loader keeps the ids known to exist (and those known to be
+    missing) per model, so that references are resolved with one id__in
+    query per batch and target model. progress is called with the
+    loader after each batch.
+    """
+
+    def __init__(self, batch_size=1000, using=DEFAULT_DB_ALIAS, progress=None):
+        self.batch_size = batch_size
+        self.using = using
+        self.progress = progress
+
+        self.fields = {}
+        for section in LOAD_SERIALIZERS:
+            self.fields[section] = get_attribute_fields(section)
+
+        self.pending = OrderedDict((section, []) for passes in LOAD_PASSES for section in passes)
+        self.num_pending = 0
+        # ids per model known to exist, or to be missing
+        self.known = {}
+        self.missing = {}
+        # ids (relations: field values) read so far, per table
+        self.seen = {}
+
+        self.collection_ids = set()
+        # ids of the created activityFlows, for invalidating the caches
+        self.activity_flow_ids = []
+
+        self.stats = OrderedDict((section, {'read': 0, 'created': 0, 'duplicates': 0, 'unresolved': 0})
+            for section in self.pending)
+        self.unresolved = []
+        self.start_time = None
+
+    def load(self, fileobj):
+        """
+        Load one PROV-JSON document from the given file object; streams
+        that cannot be read several times are copied to a temporary file
+        first. Returns the statistics per section.
+        """
+        if self.start_time is None:
+            self.start_time = time.time()
+        if not is_seekable(fileobj):
+            fileobj = spool(fileobj)
+        start = fileobj.tell()
+
+        for num, sections in enumerate(LOAD_PASSES):
+            fileobj.seek(start)
+            scanned = [COLLECTION_SECTION] if num == 0 else []
+            for section, record_id, record in DocumentReader(fileobj).iter_records(sections + scanned):
+                if section in scanned:
+                    self.add_collection_id(record)
+                else:
+                    self.add(section, record_id, record)
+            # all records of this pass must be written before the next one
+            self.flush()
+
+        self.invalidate_caches()
+        return self.stats
+
+    def add_collection_id(self, record):
+        for attribute in COLLECTION_ATTRIBUTES:
+            if record.get(attribute) is not None:
+                self.collection_ids.add(record[attribute])
+
+    def make_object(self, section, record_id, record):
+        model, fields = self.fields[section]
+        values = {}
+        for attribute, value in record.iteritems():
+            try:
+                field = fields[attribute]
+            except KeyError:
+                raise InvalidDataError("Bad request: unknown attribute '%s' in section %s." % (attribute, section))
+            if value is None:
+                continue
+            try:
+                values[field.attname] = field.to_python(value)
+            except ValidationError as e:
+                raise InvalidDataError("Bad request: invalid value for %s of %s %s: %s" % (attribute, section, record_id, '; '.join(e.messages)))
+        # keys of descriptions may have a namespace added, as for relations,
+        # so their voprov:id is preferred
+        if section not in RELATION_KEYS and 'id' not in values:
+            values['id'] = record_id
+        # the primary key of Collection and ActivityFlow is the link to the parent
+        if model._meta.parents and 'id' in values:
+            values[model._meta.pk.attname] = values['id']
+        return model(**values)
+
+    def get_dedup_key(self, section, obj):
+        # key identifying duplicates: the id, or all field values of relations
+        if section in RELATION_KEYS:
+            return tuple(getattr(obj, f.attname) for f in obj._meta.concrete_fields if not f.primary_key)
+        return obj.pk
+
+    def add(self, section, record_id, record):
+        if section == 'entity' and record_id in self.collection_ids:
+            section = 'collection'
+        self.stats[section]['read'] += 1
+        obj = self.make_object(section, record_id, record)
+
+        seen = self.seen.setdefault(get_base_model(type(obj)), set())
+        key = self.get_dedup_key(section, obj)
+        if key in seen:
+            self.stats[section]['duplicates'] += 1
+            return
+        seen.add(key)
+
+        self.pending[section].append(obj)
+        self.num_pending += 1
+        if self.num_pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        # write all pending records in one transaction
+        with transaction.atomic(using=self.using):
+            for section, objs in self.pending.iteritems():
+                if objs:
+                    self.write(section, objs)
+                    self.pending[section] = []
+        self.num_pending = 0
+        if self.progress is not None:
+            self.progress(self)
+
+    def write(self, section, objs):
+        model = type(objs[0])
+        objs = self.remove_existing(section, objs)
+        if objs:
+            objs = self.remove_unresolved(section, objs)
+        if not objs:
+            return
+
+        bulk_create_objects(model, objs, using=self.using)
+
+        self.stats[section]['created'] += len(objs)
+        if section not in RELATION_KEYS:
+            ids = [obj.pk for obj in objs]
+            for m in [model] + model._meta.get_parent_list():
+                self.known.setdefault(m, set()).update(ids)
+                # referenced before, e.g. in an earlier document
+                self.missing.get(m, set()).difference_update(ids)
+            if model is ActivityFlow:
+                self.activity_flow_ids.extend(ids)
+
+    def remove_existing(self, section, objs):
+        # skip records that are already stored in the database
+        model = type(objs[0])
+        base_model = get_base_model(model)
+        manager = base_model.objects.using(self.using)
+        existing = set()
+        if section in RELATION_KEYS:
+            fields = [f.attname for f in model._meta.concrete_fields if not f.primary_key]
+            near = fields[0]
+            near_ids = set(getattr(obj, near) for obj in objs)
+            near_ids.discard(None)
+            for chunk in chunks(near_ids):
+                existing.update(manager.filter(**{near + '__in': chunk}).values_list(*fields))
+        else:
+            for chunk in chunks(obj.pk for obj in objs):
+                existing.update(manager.filter(pk__in=chunk).values_list('pk', flat=True))
+
+        if not existing:
+            return objs
+        if section not in RELATION_KEYS:
+            self.known.setdefault(base_model, set()).update(existing)
+            self.missing.get(base_model, set()).difference_update(existing)
+        self.stats[section]['duplicates'] += sum(1 for obj in objs if self.get_dedup_key(section, obj) in existing)
+        return [obj for obj in objs if self.get_dedup_key(section, obj) not in existing]
+
+    def remove_unresolved(self, section, objs):
+        # skip records referencing objects that do not exist
+        model = type(objs[0])
+        foreign_keys = [f for f in model._meta.concrete_fields if f.many_to_one]
+        for field in foreign_keys:
+            self.resolve(field.related_model, set(getattr(obj, field.attname) for obj in objs))
+
+        resolved = []
+        for obj in objs:
+            missing = [f for f in foreign_keys if getattr(obj, f.attname) in self.missing.get(f.related_model, ())]
+            if missing:
+                # not a duplicate if read again once the reference exists
+                self.seen[get_base_model(model)].discard(self.get_dedup_key(section, obj))
+                self.stats[section]['unresolved'] += 1
+                if len(self.unresolved) < MAX_UNRESOLVED_EXAMPLES:
+                    self.unresolved.append((section, obj.pk, [(f.name, getattr(obj, f.attname)) for f in missing]))
+            else:
+                resolved.append(obj)
+        return resolved
+
+    def resolve(self, model, ids):
+        # look up the ids that are neither known nor missing yet
+        known = self.known.setdefault(model, set())
+        missing = self.missing.setdefault(model, set())
+        ids = [i for i in ids if i is not None and i not in known and i not in missing]
+        if not ids:
+            return
+        found = set()
+        for chunk in chunks(ids):
+            found.update(model.objects.using(self.using).filter(pk__in=chunk).values_list('pk', flat=True))
+        known.update(found)
+        missing.update(i for i in ids if i not in found)
+
+    def invalidate_caches(self):
+        # bulk_create sends no signals
+        if any(s['created'] for s in self.stats.itervalues()):
+            invalidate_after_bulk_change(self.activity_flow_ids)
+
+    def get_totals(self):
+        totals = {'read': 0, 'created': 0, 'duplicates': 0, 'unresolved': 0}
+        for counts in self.stats.itervalues():
+            for key in totals:
+                totals[key] += counts[key]
+        totals['seconds'] = time.time() - self.start_time if self.start_time else 0.0
+        return totals
@@ -0,0 +1,188 @@
+"""
+Process-wide cache of the complete provenance (DEPTH=ALL) of single
+start nodes, enabled with PROV_VO_CONFIG['closure_cache_size'].
+
+For each start node, direction and flags, the ids of all nodes and
+relations of its closure are stored. Since the closure of several start
+nodes is the union of their single closures, a request for several ids
+only needs to traverse the graph from the start nodes that are not
+cached yet. The cache is cleared whenever a provenance object is saved
+or deleted (see signals.py); call closure_cache.clear() after bulk
+changes.
+
+The cache only sees the changes made in its own process. Changes made
+by other processes (further server processes, prov_load) are noticed
+through the provenance generation of the response cache (see
+responsecache.py), if this is shared by the processes (e.g. memcached
+or a database cache): the cache is cleared when the generation differs
+from the one it was filled for. Without a shared response cache,
+PROV_VO_CONFIG['closure_cache_timeout'] limits the age of the cached
+closures (in seconds).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from .utils import get_config
+from . import responsecache
+
+NODE_KINDS = ['entity', 'activity', 'agent']
+
+
+def get_closure_size(closure):
+    # number of node and relation ids in a closure
+    node_ids, relation_ids = closure
+    return sum(len(ids) for ids in node_ids.itervalues())\
+        + sum(len(ids) for ids in relation_ids.itervalues())
+
+
+class ClosureCache(object):
+    """
+    Least-recently-used cache of (kind, id, direction, flags) -> closure,
+    where a closure is a tuple of node ids (frozensets per node kind) and
+    relation ids (frozensets per relation key). The size is the total
+    number of ids, its maximum is taken from
+    PROV_VO_CONFIG['closure_cache_size'] (0 or not set: switched off).
+    Closures larger than this are not stored at all.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # increased by clear(), closures found before are not stored
+        self.generation = 0
+        # the shared generation (see responsecache.py) and the time of
+        # the last clear(), for noticing changes by other processes
+        self.shared_generation = None
+        self.cleared_at = time.time()
+        self.lock = threading.Lock()
+
+    def get_maxsize(self):
+        return get_config('closure_cache_size', 0)
+
+    def get(self, key):
+        with self.lock:
+            try:
+                closure = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            # move to the end, as most recently used
+            self.entries[key] = closure
+            self.hits += 1
+            return closure
+
+    def set(self, key, node_ids, relation_ids, generation):
+        maxsize = self.get_maxsize()
+        closure = (
+            dict((kind, frozenset(ids)) for kind, ids in node_ids.iteritems()),
+            dict((k, frozenset(ids)) for k, ids in relation_ids.iteritems())
+        )
+        size = get_closure_size(closure)
+        if size > maxsize:
+            return
+        with self.lock:
+            if generation != self.generation:
+                # the data was changed while the closure was searched
+                return
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= get_closure_size(old)
+            self.entries[key] = closure
+            self.size += size
+            while self.size > maxsize:
+                old_key, old = self.entries.popitem(last=False)
+                self.size -= get_closure_size(old)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.generation += 1
+            self.cleared_at = time.time()
+
+    def sync(self, shared_generation):
+        """
+        Clear the cache if the data may have been changed by another
+        process: if the shared generation differs from the one of the
+        last call, or the entries are older than the timeout.
+        """
+        timeout = get_config('closure_cache_timeout', None)
+        expired = timeout is not None and time.time() - self.cleared_at > timeout
+        if shared_generation != self.shared_generation or expired:
+            self.clear()
+            self.shared_generation = shared_generation
+
+    def stats(self):
+        # counters for monitoring the cache
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'size': self.size,
+                'maxsize': self.get_maxsize(),
+            }
+
+
+closure_cache = ClosureCache()
+
+
+def closure_cache_enabled():
+    return bool(get_config('closure_cache_size', 0))
+
+
+def get_closure_ids(entity_ids, activity_ids, agent_ids, track_ids,
+        direction='BACK', members_flag=False, steps_flag=False, agent_flag=False):
+    """
+    Return the ids of all nodes and relations in the complete provenance
+    of the given start nodes (as returned by track_ids), as union of the
+    closures of the single start nodes. Closures that are not cached yet
+    are found with track_ids(entity_ids, activity_ids, agent_ids), called
+    for one start node at a time, and stored in the cache. If more than
+    PROV_VO_CONFIG['closure_cache_max_misses'] start nodes are missing
+    (e.g. for a batch request), track_ids is called once for all of them
+    instead, and their closures are not stored.
+    """
+    closure_cache.sync(responsecache.get_shared_generation())
+    node_ids = dict((kind, set()) for kind in NODE_KINDS)
+    relation_ids = {}
+
+    def add_closure(closure):
+        for k, found in closure[0].iteritems():
+            node_ids[k].update(found)
+        for k, found in closure[1].iteritems():
+            relation_ids.setdefault(k, set()).update(found)
+
+    missing = []
+    for kind, ids in zip(NODE_KINDS, [entity_ids, activity_ids, agent_ids]):
+        for node_id in ids:
+            key = (kind, node_id, direction, members_flag, steps_flag, agent_flag)
+            closure = closure_cache.get(key)
+            if closure is None:
+                missing.append(key)
+            else:
+                add_closure(closure)
+
+    if len(missing) > get_config('closure_cache_max_misses', 10):
+        # one traversal from all missing start nodes together
+        start_ids = dict((k, []) for k in NODE_KINDS)
+        for key in missing:
+            start_ids[key[0]].append(key[1])
+        add_closure(track_ids(start_ids['entity'], start_ids['activity'], start_ids['agent']))
+        return node_ids, relation_ids
+
+    for key in missing:
+        generation = closure_cache.generation
+        start_ids = dict((k, []) for k in NODE_KINDS)
+        start_ids[key[0]] = [key[1]]
+        closure = track_ids(start_ids['entity'], start_ids['activity'], start_ids['agent'])
+        closure_cache.set(key, closure[0], closure[1], generation)
+        add_closure(closure)
+
+    return node_ids, relation_ids
@@ -0,0 +1,141 @@
+"""
+Content encoding of provdal and allprov responses, negotiated from the
+Accept-Encoding header of the request: gzip, deflate and, if the
+zstandard package is installed, zstd. Of the encodings with the highest
+quality value, the first in ENCODINGS is used.
+
+Enabled by default, switched off with PROV_VO_CONFIG['response_compression']
+= False. Bodies smaller than PROV_VO_CONFIG['compression_min_size']
+(default 200 bytes) are not compressed. Streaming responses are
+compressed chunk by chunk. The response cache (responsecache.py) stores
+the encoded bodies, so cached responses are neither rendered nor
+compressed again.
+"""
+import zlib
+
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string, compress_sequence
+
+from .utils import get_config
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+IDENTITY = 'identity'
+
+# supported encodings, in the order of preference
+ENCODINGS = ['zstd', 'gzip', 'deflate']
+
+
+def get_available_encodings():
+    if zstandard is None:
+        return [encoding for encoding in ENCODINGS if encoding != 'zstd']
+    return ENCODINGS
+
+
+def compression_enabled():
+    return get_config('response_compression', True)
+
+
+def parse_accept_encoding(header):
+    # return a dictionary of content coding and quality value
+    qvalues = {}
+    for item in header.split(','):
+        params = item.split(';')
+        coding = params[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[coding] = q
+    return qvalues
+
+
+def get_encoding(request):
+    """
+    Return the content coding for the response to request: one of
+    ENCODINGS (those that are available), or IDENTITY if the client
+    accepts none of them or compression is disabled.
+    """
+    if not compression_enabled():
+        return IDENTITY
+    qvalues = parse_accept_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    best, best_q = IDENTITY, 0.0
+    for encoding in get_available_encodings():
+        q = qvalues.get(encoding, qvalues.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(content, encoding):
+    # return the encoded bytes of content
+    if encoding == 'gzip':
+        return compress_string(content)
+    elif encoding == 'deflate':
+        return zlib.compress(content)
+    elif encoding == 'zstd':
+        return zstandard.ZstdCompressor().compress(content)
+    return content
+
+
+def decompress(content, encoding):
+    # return the original bytes of encoded content
+    if encoding == 'gzip':
+        return zlib.decompress(content, 16 + zlib.MAX_WBITS)
+    elif encoding == 'deflate':
+        return zlib.decompress(content)
+    elif encoding == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(content)
+    return content
+
+
+def compress_chunks(chunks, encoding):
+    # encode a sequence of byte strings, yielding the encoded chunks
+    if encoding == 'gzip':
+        for data in compress_sequence(chunks):
+            yield data
+    elif encoding in ['deflate', 'zstd']:
+        if encoding == 'deflate':
+            compressor = zlib.compressobj()
+        else:
+            compressor = zstandard.ZstdCompressor().compressobj()
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    else:
+        for chunk in chunks:
+            yield chunk
+
+
+def encode_response(response, encoding):
+    """
+    Compress the content of a successful response with encoding (as
+    returned by get_encoding) and set the headers. Small bodies are not
+    compressed.
+    """
+    if compression_enabled():
+        patch_vary_headers(response, ('Accept-Encoding',))
+    if encoding == IDENTITY or response.status_code != 200 or response.has_header('Content-Encoding'):
+        return response
+
+    if response.streaming:
+        response.streaming_content = compress_chunks(response.streaming_content, encoding)
+        del response['Content-Length']
+    else:
+        if len(response.content) < get_config('compression_min_size', 200):
+            return response
+        response.content = compress(response.content, encoding)
+        response['Content-Length'] = str(len(response.content))
+    response['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,184 @@
+"""
+Provenance tracking in the database with one recursive common table
+expression (WITH RECURSIVE), used for DEPTH=ALL instead of the
+level-by-level traversal in utils.track_provenance.
+"""
+from django.db import connection
+
+from .utils import get_traversal_steps, fill_provenance, CHUNK_SIZE, RELATION_MODELS
+
+NODE_KINDS = ['entity', 'activity', 'agent']
+
+
+def supports_recursive_cte(connection=connection):
+    """
+    Check, if the database backend can evaluate the recursive query;
+    SQLite supports WITH RECURSIVE since version 3.8.3.
+    """
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 8, 3)
+    return False
+
+
+def supports_step_terms(connection=connection):
+    """
+    Check, if the recursive query may contain one recursive SELECT per
+    traversal step (SQLite 3.34.0 and later). PostgreSQL allows only one
+    reference to the recursive table.
+    """
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 34, 0)
+    return False
+
+
+def get_edges_sql(steps, qn):
+    # Construct one subquery with all relations that may be followed,
+    # in the form (rel_key, rel_id, near_kind, near_id, far_kind, far_id)
+    edges = []
+    for kind in NODE_KINDS:
+        for step in steps[kind]:
+            opts = step.model._meta
+            edges.append(
+                "SELECT '%s' AS rel_key, %s AS rel_id, '%s' AS near_kind, %s AS near_id, '%s' AS far_kind, %s AS far_id FROM %s" % (
+                    step.key, qn(opts.pk.column),
+                    kind, qn(opts.get_field(step.near).column),
+                    step.far_kind, qn(opts.get_field(step.far).column),
+                    qn(opts.db_table)
+                )
+            )
+    return "(%s)" % " UNION ALL ".join(edges)
+
+
+def get_step_terms_sql(steps, qn):
+    # Construct one recursive SELECT per step, each joining the relation
+    # table directly, so that its index on the near column can be used
+    terms = []
+    for kind in NODE_KINDS:
+        for step in steps[kind]:
+            opts = step.model._meta
+            table = qn(opts.db_table)
+            near = "%s.%s" % (table, qn(opts.get_field(step.near).column))
+            far = "%s.%s" % (table, qn(opts.get_field(step.far).column))
+            terms.append(
+                "SELECT CAST('%s' AS VARCHAR(16)), CAST(%s AS VARCHAR(128))\n"
+                "    FROM nodes n JOIN %s ON n.kind = '%s' AND %s = n.id\n"
+                "    WHERE %s IS NOT NULL" % (
+                    step.far_kind, far, table, kind, near, far
+                )
+            )
+    return "\n    UNION\n    ".join(terms)
+
+
+def get_closure_sql(steps, start_nodes, qn, step_terms=False):
+    """
+    Construct the recursive query for finding all nodes reachable from
+    the start nodes (list of (kind, id) tuples), as well as all relations
+    and parameters attached to these nodes. Each returned row is either
+    (node kind, node id), (relation key, relation id) or ('parameter', id).
+    With step_terms, the recursion has one SELECT per traversal step
+    (see supports_step_terms) instead of one join with the union of all
+    relations, which the database would have to read completely.
+    Returns the sql string and its parameters.
+    """
+    # kind and id columns get the same types in both parts of the
+    # recursive union (required by PostgreSQL)
+    start = []
+    params = []
+    for kind, node_id in start_nodes:
+        start.append("SELECT CAST('%s' AS VARCHAR(16)), CAST(%%s AS VARCHAR(128))" % kind)
+        params.append(node_id)
+
+    edges = get_edges_sql(steps, qn)
+    parameter = qn('prov_vo_parameter')
+
+    if step_terms:
+        recursion = get_step_terms_sql(steps, qn)
+    else:
+        recursion = """SELECT CAST(e.far_kind AS VARCHAR(16)), CAST(e.far_id AS VARCHAR(128))
+    FROM nodes n JOIN %s e ON e.near_kind = n.kind AND e.near_id = n.id
+    WHERE e.far_id IS NOT NULL""" % edges
+
+    sql = """WITH RECURSIVE nodes(kind, id) AS (
+    %(start)s
+    UNION
+    %(recursion)s
+)
+SELECT n.kind, n.id FROM nodes n
+UNION ALL
+SELECT e.rel_key, CAST(e.rel_id AS VARCHAR(128))
+FROM nodes n JOIN %(edges)s e ON e.near_kind = n.kind AND e.near_id = n.id
+UNION ALL
+SELECT 'parameter', %(parameter)s.%(param_id)s
+FROM nodes n JOIN %(parameter)s ON n.kind = 'activity' AND %(parameter)s.%(param_activity)s = n.id""" % {
+        'start': "\n    UNION\n    ".join(start),
+        'recursion': recursion,
+        'edges': edges,
+        'parameter': parameter,
+        'param_id': qn('id'),
+        'param_activity': qn('activity_id'),
+    }
+
+    return sql, params
+
+
+def track_provenance_cte(prov, entity_ids=(), activity_ids=(), agent_ids=(),
+        direction='BACK', members_flag=False, steps_flag=False, agent_flag=False):
+    """
+    Find the complete provenance (i.e. DEPTH=ALL) of the given start nodes
+    with one recursive query and load the resulting nodes and relations
+    into prov. The start nodes must already be stored in prov.
+    Gives the same result as utils.track_provenance with countdown=-1.
+    """
+    node_ids, relation_ids = get_provenance_ids_cte(entity_ids, activity_ids, agent_ids,
+        direction=direction,
+        members_flag=members_flag,
+        steps_flag=steps_flag,
+        agent_flag=agent_flag)
+
+    return fill_provenance(prov, node_ids, relation_ids)
+
+
+def get_provenance_ids_cte(entity_ids=(), activity_ids=(), agent_ids=(),
+        direction='BACK', members_flag=False, steps_flag=False, agent_flag=False):
+    """
+    Return the ids of all nodes (dictionary of sets per node kind) and
+    relations (dictionary of sets per relation key) in the complete
+    provenance of the given start nodes, found with one recursive query.
+    The relation ids are returned as primary key values of their models
+    (the query returns them as strings), like for the other traversals.
+    """
+    steps = get_traversal_steps(direction=direction,
+        members_flag=members_flag,
+        steps_flag=steps_flag,
+        agent_flag=agent_flag)
+
+    node_ids = dict((kind, set()) for kind in NODE_KINDS)
+    relation_ids = {}
+
+    start_nodes = [('entity', i) for i in entity_ids]\
+        + [('activity', i) for i in activity_ids]\
+        + [('agent', i) for i in agent_ids]
+    if not start_nodes:
+        return node_ids, relation_ids
+
+    sql, params = get_closure_sql(steps, start_nodes, connection.ops.quote_name,
+        step_terms=supports_step_terms(connection))
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        for key, obj_id in cursor.fetchall():
+            if key in node_ids:
+                node_ids[key].add(obj_id)
+            else:
+                obj_id = RELATION_MODELS[key]._meta.pk.to_python(obj_id)
+                relation_ids.setdefault(key, set()).add(obj_id)
+
+    return node_ids, relation_ids
+
+
+def can_track_provenance_cte(num_start_nodes, connection=connection):
+    # Each start node is one query parameter, so stay below the
+    # parameter limit of the database backends
+    return num_start_nodes <= CHUNK_SIZE and supports_recursive_cte(connection)
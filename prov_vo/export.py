@@ -0,0 +1,179 @@
+"""
+Export of the complete database as one provenance document, used by
+the allprov view and the prov_dump command.
+
+Instead of loading every table into a prov dictionary, each table is
+read in chunks of EXPORT_CHUNK_SIZE objects, ordered by primary key
+(one "pk > last pk ORDER BY pk LIMIT n" query per chunk, read with
+iterator()), and each chunk is serialized with the methods of the
+W3C/VO provenance serializers and passed on to the renderer. So only
+one chunk is held in memory at a time, and no query stays open while
+the document is written.
+
+Some sections combine several tables (e.g. in the W3C serialization,
+collections and parameters are entities), see EXPORT_SECTIONS.
+Activities and entities that are stored as activityFlow or collection
+are exported only once, with the table of the subclass.
+"""
+from collections import OrderedDict
+
+from django.db import DEFAULT_DB_ALIAS
+
+from .models import (
+    Activity,
+    ActivityFlow,
+    ActivityDescription,
+    Entity,
+    Collection,
+    EntityDescription,
+    Agent,
+    ParameterDescription,
+    UsedDescription,
+    WasGeneratedByDescription,
+)
+from .serializers import W3CProvenanceSerializer, VOProvenanceSerializer
+from .utils import get_config, select_description, RELATION_MODELS
+
+EXPORT_CHUNK_SIZE = 1000
+
+# model of each table and the subclass table whose rows are exported there instead
+EXPORT_TABLES = dict(
+    [(key, (model, None)) for key, model in RELATION_MODELS.items()],
+    activity=(Activity, 'activityflow'),
+    activityFlow=(ActivityFlow, None),
+    activityDescription=(ActivityDescription, None),
+    entity=(Entity, 'collection'),
+    collection=(Collection, None),
+    entityDescription=(EntityDescription, None),
+    agent=(Agent, None),
+    parameterDescription=(ParameterDescription, None),
+    usedDescription=(UsedDescription, None),
+    wasGeneratedByDescription=(WasGeneratedByDescription, None),
+)
+
+# objects loaded together with the objects of a table, besides their
+# descriptions (the W3C serialization of parameters includes activity.id)
+EXPORT_RELATED = {'parameter': ['activity']}
+
+# tables serialized into each section of the document, as (table, key in
+# the prov dictionary) pairs, if they differ from the section itself;
+# with MODEL=IVOA, collections are written as entities, as by provdal
+EXPORT_SECTIONS = {
+    'W3C': {
+        'activity': [('activity', 'activity'), ('activityFlow', 'activityFlow')],
+        'entity': [('entity', 'entity'), ('collection', 'collection'), ('parameter', 'parameter')],
+        'used': [('used', 'used'), ('parameter', 'parameter')],
+        'wasInfluencedBy': [('hadStep', 'hadStep')],
+    },
+    'IVOA': {
+        'entity': [('entity', 'entity'), ('collection', 'entity')],
+        'collection': [],
+    },
+}
+
+PROVENANCE_SERIALIZERS = {
+    'W3C': W3CProvenanceSerializer,
+    'IVOA': VOProvenanceSerializer,
+}
+
+
+def get_export_prefix():
+    # the namespaces of the exported document, with the ones from the settings
+    prefix = {
+        "voprov": "http://www.ivoa.net/documents/ProvenanceDM/voprov/",
+        "org": "http://www.ivoa.net/documents/ProvenanceDM/voprov/org/",
+        "vo": "http://www.ivoa.net/documents/ProvenanceDM/voprov/vo",
+        "prov": "http://www.w3.org/ns/prov#",  # defined by default
+        "xsd": "http://www.w3.org/2000/10/XMLSchema#"  # defined by default
+    }
+    prefix.update(get_config('namespaces', {}))
+    return prefix
+
+
+def iter_table(key, chunk_size=None, using=DEFAULT_DB_ALIAS):
+    """
+    Yield the objects of a table (a key of EXPORT_TABLES) in lists of at
+    most chunk_size objects (default: PROV_VO_CONFIG['export_chunk_size']
+    or EXPORT_CHUNK_SIZE), ordered by primary key, with their
+    descriptions and EXPORT_RELATED objects.
+    """
+    if chunk_size is None:
+        chunk_size = get_config('export_chunk_size', EXPORT_CHUNK_SIZE)
+    model, subclass = EXPORT_TABLES[key]
+    queryset = select_description(model.objects.using(using).order_by('pk'))
+    if key in EXPORT_RELATED:
+        queryset = queryset.select_related(*EXPORT_RELATED[key])
+    if subclass:
+        queryset = queryset.filter(**{subclass + '__isnull': True})
+
+    last_pk = None
+    while True:
+        page = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(page[:chunk_size].iterator())
+        if chunk:
+            yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1].pk
+
+
+class ExportSection(object):
+    """
+    One section of the exported document: iterating over it serializes
+    the objects of its tables chunk by chunk, with the method of the
+    provenance serializer for this section. It provides iteritems and
+    itervalues, like the serialized sections given to the renderers.
+    """
+
+    def __init__(self, serializer, name, tables, chunk_size=None, using=DEFAULT_DB_ALIAS):
+        self.serializer = serializer
+        self.name = name
+        self.tables = tables
+        self.chunk_size = chunk_size
+        self.using = using
+
+    def iteritems(self):
+        method = getattr(self.serializer, 'get_' + self.name)
+        num_param = 0
+        for table, key in self.tables:
+            for chunk in iter_table(table, self.chunk_size, self.using):
+                objs = OrderedDict((obj.pk, obj) for obj in chunk)
+                if self.name == 'used' and key == 'parameter':
+                    # the used-relationships of the parameters are numbered
+                    # throughout the document
+                    data = self.serializer.get_parameter_used(objs, start=num_param)
+                    num_param += len(objs)
+                else:
+                    data = method(self.get_prov(key, objs))
+                for item in sorted(data.iteritems()):
+                    yield item
+
+    def itervalues(self):
+        for key, value in self.iteritems():
+            yield value
+
+    def get_prov(self, key, objs):
+        # a prov dictionary with only the given objects
+        prov = dict((k, {}) for k in EXPORT_TABLES)
+        prov[key] = objs
+        return prov
+
+
+def get_export_sections(model='W3C', chunk_size=None, using=DEFAULT_DB_ALIAS):
+    """
+    Return the sections of the complete provenance document in database
+    using, serialized according to model (W3C or IVOA), as ordered
+    dictionary of section name and ExportSection (or the dictionary of
+    the prefixes), in the same order as the fields of the provenance
+    serializer.
+    """
+    prefix = get_export_prefix()
+    serializer = PROVENANCE_SERIALIZERS[model]()
+    sections = OrderedDict()
+    for name in serializer.fields.keys():
+        if name == 'prefix':
+            sections[name] = prefix
+        else:
+            tables = EXPORT_SECTIONS[model].get(name, [(name, name)])
+            sections[name] = ExportSection(serializer, name, tables, chunk_size, using)
+    return sections
@@ -0,0 +1,292 @@
+"""
+Graph of the complete database in the d3 GRAPH-JSON format, for the
+graph overview page (graph/graphjson):
+
+    {"nodes": [{"name": ..., "type": ...}, ...],
+     "links": [{"source": node index, "target": ..., "value": ..., "type": ...}, ...]}
+
+The nodes are the activities, entities and agents (in this order, each
+ordered by id), the links are the relations of FULLGRAPH_LINKS. Only the
+columns needed are read, with values_list, in chunks of
+EXPORT_CHUNK_SIZE rows ordered by primary key, so the number of queries
+depends on the number of rows per chunk, not on the number of
+relations, and the JSON is written while the tables are read. Only the
+mapping from node ids to indices is held in memory.
+
+For large graphs, nodes can be aggregated:
+
+    collapse=collections   members of a collection are merged into the
+                           collection node (recursively)
+    cluster=type           activities of the same type are merged into
+                           one node, named after the type
+
+and downsampled:
+
+    sample=<fraction>      only keep this fraction of the nodes
+    max_nodes=<n>          keep about n nodes
+
+Nodes are sampled by a hash of their id, so the same nodes are kept by
+each request. Links are kept if both nodes are kept. Aggregated nodes
+get a "count" of the nodes they contain, and links between the same
+nodes are merged, with the sum of their values and a "count".
+"""
+import json
+import zlib
+
+from django.db import DEFAULT_DB_ALIAS
+
+from .models import (
+    Activity,
+    Entity,
+    Agent,
+    Used,
+    WasGeneratedBy,
+    WasAssociatedWith,
+    WasAttributedTo,
+    HadMember,
+    WasDerivedFrom,
+    WasInformedBy,
+    HadStep,
+)
+from .export import EXPORT_CHUNK_SIZE
+from .utils import get_config, InvalidDataError
+
+# node type -> model
+FULLGRAPH_NODES = [
+    ('activity', Activity),
+    ('entity', Entity),
+    ('agent', Agent),
+]
+
+# link type -> model, node types and fields of source and target, value
+FULLGRAPH_LINKS = [
+    ('used', Used, ('activity', 'activity'), ('entity', 'entity'), 0.5),
+    ('wasGeneratedBy', WasGeneratedBy, ('entity', 'entity'), ('activity', 'activity'), 0.5),
+    ('wasAssociatedWith', WasAssociatedWith, ('activity', 'activity'), ('agent', 'agent'), 0.2),
+    ('wasAttributedTo', WasAttributedTo, ('entity', 'entity'), ('agent', 'agent'), 0.2),
+    ('hadMember', HadMember, ('entity', 'collection'), ('entity', 'entity'), 0.2),
+    ('wasDerivedFrom', WasDerivedFrom, ('entity', 'generatedEntity'), ('entity', 'usedEntity'), 0.2),
+    ('wasInformedBy', WasInformedBy, ('activity', 'informed'), ('activity', 'informant'), 0.2),
+    ('hadStep', HadStep, ('activity', 'activityFlow'), ('activity', 'activity'), 0.2),
+]
+
+COLLAPSE_OPTIONS = ['collections']
+CLUSTER_OPTIONS = ['type']
+
+
+def iter_values(model, fields, chunk_size=None, using=DEFAULT_DB_ALIAS):
+    """
+    Yield the given fields of all rows of a model as tuples, preceded by
+    the primary key, reading chunk_size rows per query.
+    """
+    if chunk_size is None:
+        chunk_size = get_config('export_chunk_size', EXPORT_CHUNK_SIZE)
+    queryset = model.objects.using(using).order_by('pk').values_list('pk', *fields)
+    last_pk = None
+    while True:
+        page = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(page[:chunk_size])
+        for row in chunk:
+            yield row
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1][0]
+
+
+def get_sample_fraction(sample=None, max_nodes=None, using=DEFAULT_DB_ALIAS):
+    # the fraction of nodes to keep, or None for all nodes
+    if max_nodes is not None:
+        total = sum(model.objects.using(using).count() for key, model in FULLGRAPH_NODES)
+        if total > max_nodes:
+            sample = min(sample or 1.0, float(max_nodes) / total)
+    if sample is not None and sample >= 1.0:
+        return None
+    return sample
+
+
+def in_sample(group, fraction):
+    # deterministic choice of a node by the hash of its key
+    key = (u'%s:%s' % group).encode('utf-8')
+    return (zlib.crc32(key) & 0xffffffff) < fraction * 0x100000000
+
+
+class FullGraph(object):
+    """
+    The graph of the complete database, written by iter_json. Each node
+    row is assigned to a group, (node type, id) of the node itself or
+    of the collection or activity type it is merged into, and each group
+    that is kept becomes one node of the graph.
+    """
+
+    def __init__(self, collapse=None, cluster=None, sample=None, max_nodes=None,
+                 chunk_size=None, using=DEFAULT_DB_ALIAS):
+        self.collapse = collapse
+        self.cluster = cluster
+        self.sample = sample
+        self.max_nodes = max_nodes
+        self.chunk_size = chunk_size
+        self.using = using
+
+    @property
+    def aggregated(self):
+        return bool(self.collapse or self.cluster)
+
+    def get_collections(self):
+        # entity id -> id of the outermost collection it belongs to
+        parent = {}
+        for pk, collection_id, entity_id in iter_values(HadMember, ['collection_id', 'entity_id'],
+                self.chunk_size, self.using):
+            if collection_id is not None and entity_id is not None:
+                parent.setdefault(entity_id, collection_id)
+
+        roots = {}
+        for entity_id in parent:
+            root = entity_id
+            seen = set([root])
+            while root in parent and parent[root] not in seen:
+                root = parent[root]
+                seen.add(root)
+            roots[entity_id] = root
+        return roots
+
+    def iter_node_rows(self):
+        # (node type, id, name, group) of all nodes
+        collections = self.get_collections() if self.collapse == 'collections' else {}
+        for node_type, model in FULLGRAPH_NODES:
+            fields = ['name', 'type'] if node_type == 'activity' else ['name']
+            for row in iter_values(model, fields, self.chunk_size, self.using):
+                node_id, name = row[0], row[1]
+                if node_type == 'entity' and node_id in collections:
+                    group = (node_type, collections[node_id])
+                elif node_type == 'activity' and self.cluster == 'type' and row[2] is not None:
+                    group = ('activity type', row[2])
+                    name = row[2]
+                else:
+                    group = (node_type, node_id)
+                yield node_type, node_id, name, group
+
+    def iter_nodes(self):
+        """
+        Yield the node dictionaries in the order of their index, filling
+        self.index (node type -> node id -> index).
+        """
+        fraction = get_sample_fraction(self.sample, self.max_nodes, self.using)
+        self.index = dict((node_type, {}) for node_type, model in FULLGRAPH_NODES)
+        groups = {}
+        nodes = []
+        num_nodes = 0
+        for node_type, node_id, name, group in self.iter_node_rows():
+            if self.aggregated and group in groups:
+                num = groups[group]
+            elif fraction is not None and not in_sample(group, fraction):
+                num = None
+            else:
+                num = num_nodes
+                num_nodes += 1
+                node = {"name": name, "type": node_type}
+                if self.aggregated:
+                    node["count"] = 0
+                    nodes.append(node)
+                else:
+                    yield node
+            if self.aggregated:
+                groups[group] = num
+                if num is not None:
+                    nodes[num]["count"] += 1
+                    if group == (node_type, node_id):
+                        # a collection may be read after its members
+                        nodes[num]["name"] = name
+            self.index[node_type][node_id] = num
+
+        for node in nodes:
+            yield node
+
+    def iter_links(self):
+        # the link dictionaries, after iter_nodes is done
+        merged = {}
+        for link_type, model, source, target, value in FULLGRAPH_LINKS:
+            source_index = self.index[source[0]]
+            target_index = self.index[target[0]]
+            rows = iter_values(model, [source[1] + '_id', target[1] + '_id'],
+                self.chunk_size, self.using)
+            for pk, source_id, target_id in rows:
+                s = source_index.get(source_id)
+                t = target_index.get(target_id)
+                if s is None or t is None:
+                    continue
+                if not self.aggregated:
+                    yield {"source": s, "target": t, "value": value, "type": link_type}
+                elif s != t:
+                    link = merged.get((s, t, link_type))
+                    if link is None:
+                        merged[(s, t, link_type)] = {
+                            "source": s, "target": t, "value": value, "type": link_type, "count": 1
+                        }
+                    else:
+                        link["value"] += value
+                        link["count"] += 1
+
+        for key in sorted(merged):
+            yield merged[key]
+
+    def iter_json(self):
+        # the graph as JSON, in chunks of text
+        yield '{"nodes": ['
+        for items in self.iter_separated(self.iter_nodes()):
+            yield items
+        yield '], "links": ['
+        for items in self.iter_separated(self.iter_links()):
+            yield items
+        yield ']}'
+
+    def iter_separated(self, items):
+        # items encoded as JSON and joined by commas, in chunks
+        chunk_size = self.chunk_size or get_config('export_chunk_size', EXPORT_CHUNK_SIZE)
+        chunk = []
+        separator = ''
+        for item in items:
+            chunk.append(json.dumps(item))
+            if len(chunk) >= chunk_size:
+                yield separator + ', '.join(chunk)
+                chunk = []
+                separator = ', '
+        if chunk:
+            yield separator + ', '.join(chunk)
+
+
+def get_fullgraph_options(params):
+    """
+    Return the options of FullGraph from the query parameters of the
+    graph/graphjson request, raising InvalidDataError for invalid values.
+    """
+    options = {}
+    collapse = params.get('collapse')
+    if collapse:
+        if collapse not in COLLAPSE_OPTIONS:
+            raise InvalidDataError("Invalid value for collapse: %s. Allowed values are: %s" % (collapse, ', '.join(COLLAPSE_OPTIONS)))
+        options['collapse'] = collapse
+
+    cluster = params.get('cluster')
+    if cluster:
+        if cluster not in CLUSTER_OPTIONS:
+            raise InvalidDataError("Invalid value for cluster: %s. Allowed values are: %s" % (cluster, ', '.join(CLUSTER_OPTIONS)))
+        options['cluster'] = cluster
+
+    sample = params.get('sample')
+    if sample:
+        try:
+            options['sample'] = float(sample)
+        except ValueError:
+            options['sample'] = 0.0
+        if not 0.0 < options['sample'] <= 1.0:
+            raise InvalidDataError("Invalid value for sample: %s. It must be a number between 0 and 1." % sample)
+
+    max_nodes = params.get('max_nodes')
+    if max_nodes:
+        try:
+            options['max_nodes'] = int(max_nodes)
+        except ValueError:
+            options['max_nodes'] = 0
+        if options['max_nodes'] < 1:
+            raise InvalidDataError("Invalid value for max_nodes: %s. It must be a positive integer." % max_nodes)
+    return options
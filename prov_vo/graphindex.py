@@ -0,0 +1,364 @@
+"""
+Optional in-memory index of the complete provenance graph.
+
+All relation tables are loaded once into compact integer arrays
+(compressed sparse rows, CSR), with one adjacency per relation field, i.e.
+forward and backward adjacency for each relation type. Node ids are
+interned to integers per node kind. Traversals are then done in memory,
+only the resulting nodes and relations are loaded from the database
+(utils.fill_provenance).
+
+The index is enabled with PROV_VO_CONFIG['graph_index'] = True. It is
+kept up to date by the post_save/post_delete signals (see signals.py);
+bulk_create and queryset updates/deletes do not send these signals, so
+call reset_graph_index() after such bulk changes.
+
+Changes by other processes are noticed as for the closure cache (see
+closurecache.py): the index is loaded again when the provenance
+generation of a shared response cache differs from the one it is up to
+date with, or when it is older than PROV_VO_CONFIG['graph_index_timeout']
+seconds.
+"""
+import sys
+import threading
+import time
+from array import array
+
+from django.db.models import AutoField
+
+from .utils import get_config, get_traversal_steps, RELATION_MODELS, NODE_MODELS
+from . import responsecache
+
+NODE_KINDS = ['entity', 'activity', 'agent']
+
+
+def get_node_kind(model):
+    # node kind of a model, also for subclasses (Collection, ActivityFlow)
+    for kind in NODE_KINDS:
+        if issubclass(model, NODE_MODELS[kind]):
+            return kind
+    return None
+
+
+def get_relation_fields(model):
+    # foreign keys of a relation model that link to nodes, with their node kind
+    fields = []
+    for field in model._meta.fields:
+        if field.is_relation:
+            kind = get_node_kind(field.related_model)
+            if kind is not None:
+                fields.append((field.name, kind))
+    return fields
+
+
+def build_csr(column, size):
+    """
+    Group the row positions of a column of node numbers by node (counting
+    sort). Returns (offsets, positions): the rows linked to node n are
+    positions[offsets[n]:offsets[n+1]]. Rows with -1 (null) are skipped.
+    """
+    offsets = array('l', [0]) * (size + 1)
+    for n in column:
+        if n >= 0:
+            offsets[n + 1] += 1
+    for n in range(size):
+        offsets[n + 1] += offsets[n]
+
+    positions = array('l', [0]) * offsets[size]
+    fill = offsets[:size]
+    for p, n in enumerate(column):
+        if n >= 0:
+            positions[fill[n]] = p
+            fill[n] += 1
+
+    return offsets, positions
+
+
+def get_size(obj):
+    # memory size of arrays, lists and dictionaries (including the
+    # string/integer elements of lists, keys of dicts and elements of sets)
+    if isinstance(obj, array):
+        return sys.getsizeof(obj)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += sys.getsizeof(key) + (get_size(value) if isinstance(value, (set, list, dict)) else 0)
+    elif isinstance(obj, (list, set)):
+        size += sum(sys.getsizeof(e) for e in obj)
+    return size
+
+
+class RelationIndex(object):
+    """
+    Rows of one relation table: relation ids and one column of node
+    numbers per foreign key, with CSR adjacency per foreign key.
+    Changes after loading are kept in a small overlay (added, deleted).
+    """
+
+    def __init__(self, fields, integer_ids=True):
+        self.fields = [name for name, kind in fields]
+        self.kinds = [kind for name, kind in fields]
+        self.ids = array('l') if integer_ids else []
+        self.columns = [array('l') for f in self.fields]
+        self.offsets = [array('l', [0]) for f in self.fields]
+        self.positions = [array('l') for f in self.fields]
+        self.deleted = set()
+        self.added = {}
+        self.added_by = [{} for f in self.fields]
+
+    def append(self, rel_id, nodes):
+        self.ids.append(rel_id)
+        for column, n in zip(self.columns, nodes):
+            column.append(n)
+
+    def build(self, sizes):
+        # build the adjacency for all columns; sizes: number of nodes per kind
+        for i, column in enumerate(self.columns):
+            self.offsets[i], self.positions[i] = build_csr(column, sizes[self.kinds[i]])
+
+    def lookup(self, field, node):
+        # yield (relation id, node numbers) of all relations linked to node via field
+        i = self.fields.index(field)
+        offsets = self.offsets[i]
+        if node < len(offsets) - 1:
+            for p in self.positions[i][offsets[node]:offsets[node + 1]]:
+                rel_id = self.ids[p]
+                if rel_id not in self.deleted:
+                    yield rel_id, tuple(column[p] for column in self.columns)
+        for rel_id in self.added_by[i].get(node, ()):
+            yield rel_id, self.added[rel_id]
+
+    def add(self, rel_id, nodes):
+        # add a new relation or replace an existing one
+        self.remove(rel_id)
+        self.added[rel_id] = nodes
+        for i, n in enumerate(nodes):
+            if n >= 0:
+                self.added_by[i].setdefault(n, set()).add(rel_id)
+
+    def remove(self, rel_id):
+        self.deleted.add(rel_id)
+        nodes = self.added.pop(rel_id, None)
+        if nodes is not None:
+            for i, n in enumerate(nodes):
+                if n >= 0:
+                    self.added_by[i][n].discard(rel_id)
+
+    def memory_footprint(self):
+        size = get_size(self.ids)
+        size += sum(get_size(a) for a in self.columns + self.offsets + self.positions)
+        size += get_size(self.deleted) + get_size(self.added) + sum(get_size(d) for d in self.added_by)
+        return size
+
+
+class ProvGraphIndex(object):
+    """
+    In-memory index of all nodes and relations of the provenance graph.
+    Use load() to read everything from the database and track() for
+    traversals; track gives the same result as utils.track_provenance.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.node_ids = dict((kind, []) for kind in NODE_KINDS)
+        self.node_numbers = dict((kind, {}) for kind in NODE_KINDS)
+        self.relations = {}
+        # the shared generation the index is up to date with, see get_graph_index
+        self.generation = None
+        self.loaded_at = time.time()
+
+    def intern(self, kind, node_id):
+        # return the number of a node, new nodes get the next free number
+        if node_id is None:
+            return -1
+        numbers = self.node_numbers[kind]
+        try:
+            return numbers[node_id]
+        except KeyError:
+            numbers[node_id] = len(self.node_ids[kind])
+            self.node_ids[kind].append(node_id)
+            return numbers[node_id]
+
+    def load(self):
+        with self.lock:
+            for kind in NODE_KINDS:
+                for node_id in NODE_MODELS[kind].objects.values_list('id', flat=True).iterator():
+                    self.intern(kind, node_id)
+
+            for key, model in RELATION_MODELS.iteritems():
+                fields = get_relation_fields(model)
+                relation = RelationIndex(fields, isinstance(model._meta.pk, AutoField))
+                names = [name for name, kind in fields]
+                for row in model.objects.values_list('id', *names).iterator():
+                    relation.append(row[0], tuple(
+                        self.intern(kind, node_id) for (name, kind), node_id in zip(fields, row[1:])
+                    ))
+                self.relations[key] = relation
+
+            sizes = dict((kind, len(self.node_ids[kind])) for kind in NODE_KINDS)
+            for relation in self.relations.itervalues():
+                relation.build(sizes)
+        return self
+
+    def track(self, entity_ids=(), activity_ids=(), agent_ids=(), countdown=-1,
+            direction='BACK', members_flag=False, steps_flag=False, agent_flag=False):
+        """
+        Breadth-first traversal in memory, with the same parameters as
+        utils.track_provenance. Returns the ids of all nodes (dictionary
+        of sets per node kind) and relations (dictionary of sets per
+        relation key, including 'parameter'), including the start nodes.
+        """
+        steps = get_traversal_steps(direction=direction,
+            members_flag=members_flag,
+            steps_flag=steps_flag,
+            agent_flag=agent_flag)
+
+        with self.lock:
+            visited = dict((kind, set()) for kind in NODE_KINDS)
+            for kind, ids in zip(NODE_KINDS, [entity_ids, activity_ids, agent_ids]):
+                visited[kind].update(self.intern(kind, i) for i in ids)
+
+            frontier = dict((kind, set(visited[kind])) for kind in NODE_KINDS)
+            if not agent_flag:
+                frontier['agent'] = set()
+            relation_ids = dict((key, set()) for key in RELATION_MODELS)
+
+            while countdown != 0 and any(frontier.values()):
+                countdown -= 1
+                found = dict((kind, set()) for kind in NODE_KINDS)
+
+                # parameters of the activities that are followed further
+                parameter = self.relations['parameter']
+                for n in frontier['activity']:
+                    relation_ids['parameter'].update(p_id for p_id, nodes in parameter.lookup('activity', n))
+
+                for kind in NODE_KINDS:
+                    for step in steps[kind]:
+                        relation = self.relations[step.key]
+                        far = relation.fields.index(step.far)
+                        ids = relation_ids[step.key]
+                        seen = visited[step.far_kind]
+                        for n in frontier[kind]:
+                            for rel_id, nodes in relation.lookup(step.near, n):
+                                ids.add(rel_id)
+                                if nodes[far] >= 0 and nodes[far] not in seen:
+                                    found[step.far_kind].add(nodes[far])
+
+                for kind in NODE_KINDS:
+                    visited[kind].update(found[kind])
+
+                # do not follow agents further, unless flag is set
+                if not agent_flag:
+                    found['agent'] = set()
+                frontier = found
+
+            node_ids = dict(
+                (kind, set(self.node_ids[kind][n] for n in visited[kind])) for kind in NODE_KINDS
+            )
+        return node_ids, relation_ids
+
+    def save_object(self, instance):
+        # update the index for a saved node, relation or parameter
+        with self.lock:
+            kind = get_node_kind(type(instance))
+            if kind is not None:
+                self.intern(kind, instance.id)
+                return
+            for key, model in RELATION_MODELS.iteritems():
+                if isinstance(instance, model):
+                    relation = self.relations[key]
+                    nodes = tuple(
+                        self.intern(kind, getattr(instance, name + '_id'))
+                        for name, kind in zip(relation.fields, relation.kinds)
+                    )
+                    relation.add(instance.id, nodes)
+                    return
+
+    def delete_object(self, instance):
+        # update the index for a deleted node, relation or parameter
+        with self.lock:
+            kind = get_node_kind(type(instance))
+            if kind is not None:
+                number = self.node_numbers[kind].get(instance.id)
+                if number is not None:
+                    self.unlink_node(kind, number)
+                return
+            for key, model in RELATION_MODELS.iteritems():
+                if isinstance(instance, model):
+                    self.relations[key].remove(instance.id)
+                    return
+
+    def unlink_node(self, kind, number):
+        # the foreign keys of relations to a deleted node are set to null
+        # by the database (without signals), so do the same here
+        for relation in self.relations.itervalues():
+            for i, field in enumerate(relation.fields):
+                if relation.kinds[i] != kind:
+                    continue
+                for rel_id, nodes in list(relation.lookup(field, number)):
+                    nodes = list(nodes)
+                    nodes[i] = -1
+                    relation.add(rel_id, tuple(nodes))
+
+    def memory_footprint(self):
+        """
+        Return the approximate memory usage of the index in bytes, per
+        component ('nodes' and one entry per relation key) and in total.
+        """
+        with self.lock:
+            footprint = {
+                'nodes': sum(get_size(self.node_ids[kind]) + get_size(self.node_numbers[kind])
+                    for kind in NODE_KINDS)
+            }
+            for key, relation in self.relations.iteritems():
+                footprint[key] = relation.memory_footprint()
+            footprint['total'] = sum(footprint.values())
+        return footprint
+
+
+# The index is loaded on first use and shared by all requests of the process
+graph_index = None
+graph_index_lock = threading.Lock()
+
+
+def get_graph_index():
+    # return the loaded index, load it first if necessary or if the data
+    # was changed by another process
+    global graph_index
+    generation = responsecache.get_shared_generation()
+    timeout = get_config('graph_index_timeout', None)
+    with graph_index_lock:
+        if graph_index is not None and (graph_index.generation != generation
+                or timeout is not None and time.time() - graph_index.loaded_at > timeout):
+            graph_index = None
+        if graph_index is None:
+            graph_index = ProvGraphIndex().load()
+            graph_index.generation = generation
+        return graph_index
+
+
+def loaded_graph_index():
+    # return the index, if it was already loaded (None otherwise)
+    return graph_index
+
+
+def advance_graph_index(generation):
+    """
+    The data was changed in this process, the index was updated by the
+    signals and the shared generation increased to the given one: keep
+    the index, unless another process changed the data as well.
+    """
+    index = graph_index
+    if index is not None and generation is not None and index.generation == generation - 1:
+        index.generation = generation
+
+
+def reset_graph_index():
+    # drop the index, it is loaded again on next use
+    global graph_index
+    with graph_index_lock:
+        graph_index = None
+
+
+def graph_index_enabled():
+    return get_config('graph_index', False)
@@ -0,0 +1,219 @@
+"""
+Compact GRAPH-JSON (provdal with RESPONSEFORMAT=GRAPH-JSON&COMPACT=TRUE)
+for large provenance graphs, built directly from the traversal result
+(model instances or values() rows) instead of the serialized record.
+
+The nodes are numbered in the order of NODE_TYPES and of their ids, the
+graph is written as columnar arrays:
+
+    {"nodeTypes": [...], "linkTypes": [...],
+     "nodes": {"id": [...], "name": [...], "type": [type codes]},
+     "links": {"source": [node index], "target": [...], "type": [...]}}
+
+where the type codes are indices in nodeTypes and linkTypes. Links
+point in the same direction as in the d3 GRAPH-JSON format.
+
+With LAYOUT=LAYERED, the node coordinates of a layered (Sankey-like)
+layout are added as "layout": {"x": [...], "y": [...], "layer": [...]},
+with x and y between 0 and 1. Layouts are cached by the structure of
+the graph in PROV_VO_CONFIG['layout_cache'] (a cache alias, default:
+the response cache, if any).
+"""
+import hashlib
+import json
+from collections import defaultdict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from .utils import get_config
+
+NODE_TYPES = ['activity', 'activityFlow', 'entity', 'collection', 'agent']
+
+# relation key -> fields of the source and target node of the link
+LINK_ENDS = [
+    ('used', 'activity', 'entity'),
+    ('wasGeneratedBy', 'entity', 'activity'),
+    ('wasAssociatedWith', 'agent', 'activity'),
+    ('wasAttributedTo', 'agent', 'entity'),
+    ('hadMember', 'collection', 'entity'),
+    ('wasDerivedFrom', 'generatedEntity', 'usedEntity'),
+    ('hadStep', 'activityFlow', 'activity'),
+    ('wasInformedBy', 'informed', 'informant'),
+]
+LINK_TYPES = [key for key, source, target in LINK_ENDS]
+
+LAYOUTS = ['LAYERED']
+LAYOUT_KEY = 'prov_vo:layout:%s'
+
+# number of sweeps for ordering the nodes within the layers
+LAYOUT_SWEEPS = 4
+
+
+def get_value(obj, field):
+    # a field of a model instance or values() row
+    if isinstance(obj, dict):
+        return obj.get(field)
+    return getattr(obj, field)
+
+
+def get_reference(obj, field):
+    # the id referenced by a foreign key of a model instance or values() row
+    if isinstance(obj, dict):
+        return obj.get(field)
+    return getattr(obj, field + '_id')
+
+
+def get_compact_graph(prov, layout=None):
+    """
+    Return the compact graph of a prov dictionary (as filled by the
+    traversal), with the coordinates of the given layout (one of
+    LAYOUTS) if layout is set. Links to nodes that are not in prov are
+    left out.
+    """
+    ids = []
+    names = []
+    types = []
+    index = {}
+    for code, key in enumerate(NODE_TYPES):
+        for node_id in sorted(prov.get(key, {})):
+            if node_id in index:
+                continue
+            index[node_id] = len(ids)
+            ids.append(node_id)
+            names.append(get_value(prov[key][node_id], 'name'))
+            types.append(code)
+
+    sources = []
+    targets = []
+    link_types = []
+    for code, (key, source_field, target_field) in enumerate(LINK_ENDS):
+        relations = prov.get(key, {})
+        for rel_id in sorted(relations):
+            relation = relations[rel_id]
+            source = index.get(get_reference(relation, source_field))
+            target = index.get(get_reference(relation, target_field))
+            if source is None or target is None:
+                continue
+            sources.append(source)
+            targets.append(target)
+            link_types.append(code)
+
+    graph = {
+        'nodeTypes': NODE_TYPES,
+        'linkTypes': LINK_TYPES,
+        'nodes': {'id': ids, 'name': names, 'type': types},
+        'links': {'source': sources, 'target': targets, 'type': link_types},
+    }
+    if layout:
+        graph['layout'] = get_cached_layout(len(ids), sources, targets)
+    return graph
+
+
+def get_layout_cache():
+    alias = get_config('layout_cache', get_config('response_cache', None))
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def get_cached_layout(num_nodes, sources, targets):
+    # the layout only depends on the structure of the graph
+    cache = get_layout_cache()
+    if cache is None:
+        return get_layered_layout(num_nodes, sources, targets)
+
+    digest = hashlib.md5(json.dumps([num_nodes, sources, targets])).hexdigest()
+    key = LAYOUT_KEY % digest
+    layout = cache.get(key)
+    if layout is None:
+        layout = get_layered_layout(num_nodes, sources, targets)
+        cache.set(key, layout, get_config('response_cache_timeout', DEFAULT_TIMEOUT))
+    return layout
+
+
+def get_layers(num_nodes, sources, targets):
+    """
+    Assign each node to a layer, such that each link goes from a lower
+    to a higher layer (longest path from the nodes without incoming
+    links). Cycles are broken at the first node (by index) that is not
+    placed yet.
+    """
+    successors = defaultdict(list)
+    indegree = [0] * num_nodes
+    for source, target in zip(sources, targets):
+        if source != target:
+            successors[source].append(target)
+            indegree[target] += 1
+
+    layers = [0] * num_nodes
+    placed = [False] * num_nodes
+    queue = [i for i in range(num_nodes) if indegree[i] == 0]
+    next_unplaced = 0
+    while True:
+        while queue:
+            node = queue.pop()
+            if placed[node]:
+                continue
+            placed[node] = True
+            for target in successors[node]:
+                if not placed[target]:
+                    layers[target] = max(layers[target], layers[node] + 1)
+                    indegree[target] -= 1
+                    if indegree[target] == 0:
+                        queue.append(target)
+        # remaining nodes are part of cycles
+        while next_unplaced < num_nodes and placed[next_unplaced]:
+            next_unplaced += 1
+        if next_unplaced == num_nodes:
+            return layers
+        queue.append(next_unplaced)
+
+
+def get_layered_layout(num_nodes, sources, targets):
+    """
+    Layered layout of a directed graph: the x coordinate is given by the
+    layer (get_layers), the nodes within a layer are ordered by the mean
+    position of their neighbours in the previous layer (barycenter
+    heuristic, alternately from left and right), to reduce crossings.
+    """
+    layers = get_layers(num_nodes, sources, targets)
+    num_layers = max(layers) + 1 if layers else 0
+
+    predecessors = defaultdict(list)
+    successors = defaultdict(list)
+    for source, target in zip(sources, targets):
+        if layers[source] < layers[target]:
+            predecessors[target].append(source)
+            successors[source].append(target)
+
+    columns = [[] for i in range(num_layers)]
+    for node in range(num_nodes):
+        columns[layers[node]].append(node)
+    position = [0.0] * num_nodes
+    for column in columns:
+        for pos, node in enumerate(column):
+            position[node] = float(pos)
+
+    for sweep in range(LAYOUT_SWEEPS):
+        if sweep % 2 == 0:
+            order, neighbours = range(1, num_layers), predecessors
+        else:
+            order, neighbours = range(num_layers - 2, -1, -1), successors
+        for layer in order:
+            column = columns[layer]
+            keys = {}
+            for node in column:
+                near = neighbours[node]
+                keys[node] = sum(position[n] for n in near) / len(near) if near else position[node]
+            column.sort(key=lambda node: (keys[node], position[node]))
+            for pos, node in enumerate(column):
+                position[node] = float(pos)
+
+    x = [0.0] * num_nodes
+    y = [0.0] * num_nodes
+    for layer, column in enumerate(columns):
+        for pos, node in enumerate(column):
+            x[node] = round(float(layer) / max(num_layers - 1, 1), 4)
+            y[node] = round((pos + 0.5) / len(column), 4)
+    return {'x': x, 'y': y, 'layer': layers}
@@ -0,0 +1,229 @@
+"""
+Level-of-detail graph of the complete database (graph/summary): each
+collection with its members (hadMember) and each activity flow with its
+steps (hadStep) is collapsed into one super-node, so that the graph of
+a data release starts with a few nodes that can be expanded on demand.
+
+    graph/summary               the top-level graph
+    graph/summary?node=<id>     the members of one super-node
+
+Both return
+
+    {"node": <id or null>,
+     "nodes": [{"id": ..., "name": ..., "type": ...}, ...],
+     "links": [{"source": <id>, "target": <id>, "type": ..., "count": n}, ...]}
+
+where super-nodes have "members" (the number of direct members) and
+"count" (the number of all nodes inside, also of nested super-nodes).
+The links of an expansion connect the members of the super-node with
+each other and with the nodes of the graph they are shown in, i.e. the
+outermost collapsed node around the other end, below the super-nodes
+that are expanded (the super-node and the ones around it). Relations
+between the same nodes are merged into one link with a count, relations
+inside a collapsed node are left out.
+
+A node is placed in the first collection or activity flow (by id of the
+relation) it is a member of; memberships that would form a cycle are
+ignored.
+
+All summaries are computed together, in one pass over the tables (see
+fullgraph.iter_values), and stored in the response cache (see
+responsecache.py) for the current provenance generation, so that
+further requests, for the top-level graph or any super-node, are
+answered from the cache. Call the prov_summarize command after loading
+data to compute them in advance. Without a response cache, the
+summaries are computed for each request.
+"""
+import hashlib
+import json
+from collections import defaultdict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import DEFAULT_DB_ALIAS
+from django.http import HttpResponse
+
+from .models import HadMember, HadStep, ActivityFlow, Collection
+from .fullgraph import FULLGRAPH_NODES, FULLGRAPH_LINKS, iter_values
+from .utils import get_config, InvalidDataError
+from . import responsecache, compression
+
+SUMMARY_INDEX_KEY = 'prov_vo:summary:%s'
+
+# relation that makes a node a member of a super-node -> model, node
+# type, fields of the super-node and the member, type of the super-node
+MEMBERSHIPS = [
+    ('hadMember', HadMember, 'entity', 'collection', 'entity', 'collection'),
+    ('hadStep', HadStep, 'activity', 'activityFlow', 'activity', 'activityFlow'),
+]
+MEMBERSHIP_KEYS = [key for key, model, node_type, parent, child, super_type in MEMBERSHIPS]
+
+# node type of the subclass tables
+NODE_SUBTYPES = [
+    ('activity', ActivityFlow, 'activityFlow'),
+    ('entity', Collection, 'collection'),
+]
+
+
+def get_summary_digest(node_id=None):
+    # the response cache key of a summary
+    return hashlib.md5(json.dumps(['summary', node_id])).hexdigest()
+
+
+class GraphSummary(object):
+    """
+    The hierarchy of super-nodes and the summaries built from it. Nodes
+    are identified by (node type, id), with node types as in
+    FULLGRAPH_NODES.
+    """
+
+    def __init__(self, chunk_size=None, using=DEFAULT_DB_ALIAS):
+        self.chunk_size = chunk_size
+        self.using = using
+
+    def load(self):
+        # read the nodes and the memberships
+        self.nodes = {}
+        self.order = []
+        for node_type, model in FULLGRAPH_NODES:
+            for node_id, name in iter_values(model, ['name'], self.chunk_size, self.using):
+                key = (node_type, node_id)
+                self.nodes[key] = [name, node_type]
+                self.order.append(key)
+        for node_type, model, subtype in NODE_SUBTYPES:
+            for row in iter_values(model, [], self.chunk_size, self.using):
+                self.nodes[(node_type, row[0])][1] = subtype
+
+        self.parent = {}
+        self.children = defaultdict(list)
+        for key, model, node_type, parent_field, child_field, super_type in MEMBERSHIPS:
+            rows = iter_values(model, [parent_field + '_id', child_field + '_id'],
+                self.chunk_size, self.using)
+            for pk, parent_id, child_id in rows:
+                parent, child = (node_type, parent_id), (node_type, child_id)
+                if child in self.parent or parent not in self.nodes or child not in self.nodes:
+                    continue
+                if child in self.get_chain(parent):
+                    continue
+                self.parent[child] = parent
+        for key in self.order:
+            if key in self.parent:
+                self.children[self.parent[key]].append(key)
+
+        # number of nodes inside each super-node, deepest first
+        self.size = {}
+        for key in sorted(self.children, key=lambda k: -len(self.get_chain(k))):
+            self.size[key] = sum(1 + self.size.get(child, 0) for child in self.children[key])
+
+    def get_chain(self, key):
+        # the node and the super-nodes around it, outermost first
+        chain = [key]
+        while chain[-1] in self.parent:
+            chain.append(self.parent[chain[-1]])
+        chain.reverse()
+        return chain
+
+    def iter_links(self):
+        # (source, target, type) of the relations between nodes
+        for link_type, model, source, target, value in FULLGRAPH_LINKS:
+            if link_type in MEMBERSHIP_KEYS:
+                continue
+            rows = iter_values(model, [source[1] + '_id', target[1] + '_id'],
+                self.chunk_size, self.using)
+            for pk, source_id, target_id in rows:
+                s, t = (source[0], source_id), (target[0], target_id)
+                if s in self.nodes and t in self.nodes:
+                    yield s, t, link_type
+
+    def get_node(self, key):
+        name, node_type = self.nodes[key]
+        node = {"id": key[1], "name": name, "type": node_type}
+        if key in self.children:
+            node["members"] = len(self.children[key])
+            node["count"] = self.size[key]
+        return node
+
+    def get_summaries(self):
+        """
+        Return the summaries as dictionary of super-node id (None for
+        the top-level graph) and graph dictionary.
+        """
+        self.load()
+        roots = [key for key in self.order if key not in self.parent]
+        views = {None: (roots, defaultdict(int))}
+        for key in self.children:
+            views[key] = (self.children[key], defaultdict(int))
+
+        chains = {}
+        for s, t, link_type in self.iter_links():
+            s_chain = chains.get(s) or chains.setdefault(s, self.get_chain(s))
+            t_chain = chains.get(t) or chains.setdefault(t, self.get_chain(t))
+            if s_chain[0] != t_chain[0]:
+                views[None][1][(s_chain[0], t_chain[0], link_type)] += 1
+            # the links in the expansions of the super-nodes around s and t
+            for super_key in set(s_chain[:-1] + t_chain[:-1]):
+                expanded = chains.get(super_key) or chains.setdefault(super_key, self.get_chain(super_key))
+                source, target = get_shown(s_chain, expanded), get_shown(t_chain, expanded)
+                if source != target:
+                    views[super_key][1][(source, target, link_type)] += 1
+
+        summaries = {}
+        for key, (members, links) in views.iteritems():
+            summaries[None if key is None else key[1]] = {
+                "node": None if key is None else key[1],
+                "nodes": [self.get_node(member) for member in members],
+                "links": [{"source": s[1], "target": t[1], "type": link_type, "count": count}
+                    for (s, t, link_type), count in sorted(links.iteritems())],
+            }
+        return summaries
+
+
+def get_shown(chain, expanded):
+    # the node shown for the last node of chain if the super-nodes of
+    # the chain expanded are expanded
+    i = 0
+    while i < len(chain) and i < len(expanded) and chain[i] == expanded[i]:
+        i += 1
+    return chain[min(i, len(chain) - 1)]
+
+
+def get_summary_body(summary):
+    return json.dumps(summary, separators=(',', ':'))
+
+
+def store_summaries(cache, generation, chunk_size=None, using=DEFAULT_DB_ALIAS):
+    """
+    Compute all summaries and store them in the response cache for the
+    given generation, together with the set of super-node ids. Return
+    the summaries.
+    """
+    summaries = GraphSummary(chunk_size, using).get_summaries()
+    timeout = get_config('response_cache_timeout', DEFAULT_TIMEOUT)
+    data = {}
+    for node_id, summary in summaries.iteritems():
+        key = responsecache.get_response_key(generation, get_summary_digest(node_id))
+        data[key] = ('application/json', {compression.IDENTITY: (get_summary_body(summary), None)})
+    cache.set_many(data, timeout)
+    cache.set(SUMMARY_INDEX_KEY % generation, frozenset(summaries), timeout)
+    return summaries
+
+
+def get_summary_response(node_id=None):
+    """
+    Return the response with the summary for node_id (None: the
+    top-level graph), computing and storing all summaries if needed.
+    Raises InvalidDataError if node_id is not a super-node.
+    """
+    cache = responsecache.get_response_cache()
+    if cache is None:
+        summaries = GraphSummary().get_summaries()
+    else:
+        generation, modified = responsecache.get_generation(cache)
+        index = cache.get(SUMMARY_INDEX_KEY % generation)
+        if index is not None and node_id not in index:
+            summaries = {}
+        else:
+            summaries = store_summaries(cache, generation)
+
+    if node_id not in summaries:
+        raise InvalidDataError("%s is not a collection or activity flow with members." % node_id)
+    return HttpResponse(get_summary_body(summaries[node_id]), content_type='application/json')
@@ -0,0 +1,395 @@
+"""
+Materialized transitive closure of the lineage relations (table
+prov_vo_lineage, model Lineage), enabled with
+PROV_VO_CONFIG['lineage_table'] = True.
+
+For each pair of an entity or activity and one of its (indirect)
+ancestors along used, wasGeneratedBy, wasDerivedFrom and wasInformedBy,
+one row stores the number of relations on the shortest path between
+them (min_distance). With this table, all ancestors (DEPTH=ALL) or the
+ones within n relations (DEPTH=n) of a set of nodes are found with one
+indexed query, in both directions.
+
+The table is kept up to date by the signals of these relations (see
+signals.py): a new relation u -> v (u is the ancestor) adds the pairs
+of each ancestor of u (and u itself) and each descendant of v (and v
+itself). Deleting a relation (or a node) can only make paths longer or
+remove them; the pairs of the ancestors and descendants around it are
+recomputed from the relations between the nodes that were on such
+paths. After bulk changes (without signals), the table is rebuilt
+completely, as by the prov_lineage command.
+
+The traversal (track_provenance_ids) also follows the other relations
+(hadMember, hadStep, agents, as in utils.get_traversal_steps); it
+alternates between one query in the lineage table for all nodes found
+by these relations and one query per traversal step for the relations
+of all new nodes, instead of one round of queries per level of the
+graph. It gives the same result as rows.track_provenance_ids.
+"""
+from collections import defaultdict, deque
+
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+
+from .models import Entity, Activity, Used, WasGeneratedBy, WasDerivedFrom, WasInformedBy, Lineage
+from .utils import get_config, get_traversal_steps, chunks, RELATION_MODELS
+
+NODE_KINDS = ['entity', 'activity', 'agent']
+
+LINEAGE_BATCH_SIZE = 1000
+
+# the lineage relations, as model, field and kind of the ancestor, field
+# and kind of the descendant
+LINEAGE_RELATIONS = [
+    (Used, 'entity', 'entity', 'activity', 'activity'),
+    (WasGeneratedBy, 'activity', 'activity', 'entity', 'entity'),
+    (WasDerivedFrom, 'usedEntity', 'entity', 'generatedEntity', 'entity'),
+    (WasInformedBy, 'informant', 'activity', 'informed', 'activity'),
+]
+LINEAGE_MODELS = [relation[0] for relation in LINEAGE_RELATIONS]
+
+
+def lineage_enabled():
+    return get_config('lineage_table', False)
+
+
+def get_relation_edge(instance):
+    # (ancestor, descendant) of a lineage relation, as (kind, id) tuples,
+    # or None if one of them is not set
+    for model, anc_field, anc_kind, desc_field, desc_kind in LINEAGE_RELATIONS:
+        if isinstance(instance, model):
+            anc_id = getattr(instance, anc_field + '_id')
+            desc_id = getattr(instance, desc_field + '_id')
+            if anc_id is None or desc_id is None:
+                return None
+            return (anc_kind, anc_id), (desc_kind, desc_id)
+    return None
+
+
+def get_stored_edge(instance, using=DEFAULT_DB_ALIAS):
+    # the edge of a lineage relation as stored in the database
+    if instance.pk is None:
+        return None
+    stored = type(instance).objects.using(using).filter(pk=instance.pk).first()
+    return get_relation_edge(stored) if stored is not None else None
+
+
+def get_node_key(instance):
+    # (kind, id) of an entity or activity
+    if isinstance(instance, Entity):
+        return ('entity', instance.pk)
+    if isinstance(instance, Activity):
+        return ('activity', instance.pk)
+    return None
+
+
+def get_lineage(keys, direction='BACK', using=DEFAULT_DB_ALIAS):
+    """
+    Return the ancestors (direction BACK) or descendants (FORTH) of the
+    given nodes, as dictionary (kind, id) -> {node: min_distance}.
+    """
+    near, far = ('descendant', 'ancestor') if direction == 'BACK' else ('ancestor', 'descendant')
+    keys = set(keys)
+    result = dict((key, {}) for key in keys)
+    fields = [near + '_kind', near + '_id', far + '_kind', far + '_id', 'min_distance']
+    for chunk in chunks(set(node_id for kind, node_id in keys)):
+        rows = Lineage.objects.using(using).filter(**{near + '_id__in': chunk}).values_list(*fields)
+        for near_kind, near_id, far_kind, far_id, distance in rows:
+            if (near_kind, near_id) in keys:
+                result[(near_kind, near_id)][(far_kind, far_id)] = distance
+    return result
+
+
+def get_pairs(ancestors, descendants, using=DEFAULT_DB_ALIAS):
+    # the stored rows between the given nodes: (ancestor, descendant) -> (pk, min_distance)
+    pairs = {}
+    for anc_chunk in chunks(set(node_id for kind, node_id in ancestors)):
+        for desc_chunk in chunks(set(node_id for kind, node_id in descendants)):
+            rows = Lineage.objects.using(using).filter(ancestor_id__in=anc_chunk, descendant_id__in=desc_chunk)
+            for pk, anc_kind, anc_id, desc_kind, desc_id, distance in rows.values_list(
+                    'pk', 'ancestor_kind', 'ancestor_id', 'descendant_kind', 'descendant_id', 'min_distance'):
+                anc, desc = (anc_kind, anc_id), (desc_kind, desc_id)
+                if anc in ancestors and desc in descendants:
+                    pairs[(anc, desc)] = (pk, distance)
+    return pairs
+
+
+def delete_rows(pks, using=DEFAULT_DB_ALIAS):
+    # without collecting the rows and sending signals for each of them
+    for chunk in chunks(pks):
+        Lineage.objects.using(using).filter(pk__in=chunk)._raw_delete(using)
+
+
+def insert_rows(rows, using=DEFAULT_DB_ALIAS):
+    """
+    Insert rows (ancestor kind, ancestor id, descendant kind, descendant
+    id, min_distance) with executemany, much faster than bulk_create
+    with model instances for the large numbers of rows of a rebuild.
+    """
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    opts = Lineage._meta
+    columns = ['ancestor_kind', 'ancestor_id', 'descendant_kind', 'descendant_id', 'min_distance']
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (qn(opts.db_table),
+        ", ".join(qn(opts.get_field(name).column) for name in columns), ", ".join(["%s"] * len(columns)))
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def write_pairs(pairs, distances, using=DEFAULT_DB_ALIAS):
+    """
+    Store the given distances ((ancestor, descendant) -> min_distance,
+    None for no path) of pairs with the stored rows pairs (as returned
+    by get_pairs): insert, update or delete rows.
+    """
+    new = []
+    updated = defaultdict(list)
+    deleted = []
+    for (anc, desc), distance in distances.iteritems():
+        stored = pairs.get((anc, desc))
+        if stored is None:
+            if distance is not None:
+                new.append((anc[0], anc[1], desc[0], desc[1], distance))
+        elif distance is None:
+            deleted.append(stored[0])
+        elif distance != stored[1]:
+            updated[distance].append(stored[0])
+
+    insert_rows(new, using)
+    for distance, pks in updated.iteritems():
+        for chunk in chunks(pks):
+            Lineage.objects.using(using).filter(pk__in=chunk).update(min_distance=distance)
+    delete_rows(deleted, using)
+
+
+def add_edge(ancestor, descendant, using=DEFAULT_DB_ALIAS):
+    """
+    Add the pairs for a new lineage relation between the nodes ancestor
+    and descendant ((kind, id) tuples).
+    """
+    ancestors = get_lineage([ancestor], 'BACK', using)[ancestor]
+    ancestors[ancestor] = 0
+    descendants = get_lineage([descendant], 'FORTH', using)[descendant]
+    descendants[descendant] = 0
+
+    pairs = get_pairs(ancestors, descendants, using)
+    distances = {}
+    for anc, anc_distance in ancestors.iteritems():
+        for desc, desc_distance in descendants.iteritems():
+            if anc == desc:
+                continue
+            distance = anc_distance + 1 + desc_distance
+            stored = pairs.get((anc, desc))
+            if stored is None or distance < stored[1]:
+                distances[(anc, desc)] = distance
+    write_pairs(pairs, distances, using)
+
+
+def add_relations(objs, using=DEFAULT_DB_ALIAS):
+    """
+    Add the pairs for lineage relations created without signals (e.g.
+    with bulk_create), one edge at a time as for single saves; other
+    objects are ignored.
+    """
+    edges = set(get_relation_edge(obj) for obj in objs)
+    edges.discard(None)
+    for ancestor, descendant in edges:
+        add_edge(ancestor, descendant, using)
+
+
+def remove_edge(ancestor, descendant, using=DEFAULT_DB_ALIAS):
+    """
+    Update the pairs after the lineage relation between ancestor and
+    descendant was removed from the database.
+    """
+    ancestors = set(get_lineage([ancestor], 'BACK', using)[ancestor])
+    ancestors.add(ancestor)
+    descendants = set(get_lineage([descendant], 'FORTH', using)[descendant])
+    descendants.add(descendant)
+    recompute_pairs(ancestors, descendants, using)
+
+
+def remove_node(node, using=DEFAULT_DB_ALIAS):
+    """
+    Remove the pairs of a deleted entity or activity (its relations
+    were set to NULL) and update the pairs of the paths through it.
+    """
+    ancestors = set(get_lineage([node], 'BACK', using)[node])
+    descendants = set(get_lineage([node], 'FORTH', using)[node])
+    pks = list(Lineage.objects.using(using).filter(
+        ancestor_kind=node[0], ancestor_id=node[1]).values_list('pk', flat=True))
+    pks += list(Lineage.objects.using(using).filter(
+        descendant_kind=node[0], descendant_id=node[1]).values_list('pk', flat=True))
+    delete_rows(pks, using)
+    if ancestors and descendants:
+        recompute_pairs(ancestors, descendants, using)
+
+
+def recompute_pairs(ancestors, descendants, using=DEFAULT_DB_ALIAS):
+    """
+    Recompute the distances of all pairs of the given ancestors and
+    descendants. Paths between them can only lead over nodes that are
+    descendants of one of the ancestors and ancestors of one of the
+    descendants according to the table before the change, so only the
+    relations between these nodes are loaded and searched in memory.
+    """
+    below = set(ancestors)
+    for found in get_lineage(ancestors, 'FORTH', using).itervalues():
+        below.update(found)
+    above = set(descendants)
+    for found in get_lineage(descendants, 'BACK', using).itervalues():
+        above.update(found)
+    between = below & above
+
+    children = get_children(between, using)
+    distances = {}
+    for anc in ancestors:
+        reached = search_descendants(anc, children)
+        for desc in descendants:
+            if desc != anc:
+                distances[(anc, desc)] = reached.get(desc)
+    write_pairs(get_pairs(ancestors, descendants, using), distances, using)
+
+
+def get_children(nodes, using=DEFAULT_DB_ALIAS):
+    # node -> direct descendants, for the lineage relations between the given nodes
+    children = defaultdict(set)
+    for model, anc_field, anc_kind, desc_field, desc_kind in LINEAGE_RELATIONS:
+        ids = [node_id for kind, node_id in nodes if kind == anc_kind]
+        for chunk in chunks(ids):
+            rows = model.objects.using(using).filter(**{anc_field + '__in': chunk})
+            for anc_id, desc_id in rows.values_list(anc_field, desc_field):
+                if desc_id is not None and (desc_kind, desc_id) in nodes:
+                    children[(anc_kind, anc_id)].add((desc_kind, desc_id))
+    return children
+
+
+def get_all_children(using=DEFAULT_DB_ALIAS):
+    # node -> direct descendants, for all lineage relations
+    children = defaultdict(set)
+    for model, anc_field, anc_kind, desc_field, desc_kind in LINEAGE_RELATIONS:
+        rows = model.objects.using(using).filter(**{anc_field + '__isnull': False, desc_field + '__isnull': False})
+        for anc_id, desc_id in rows.values_list(anc_field, desc_field).iterator():
+            children[(anc_kind, anc_id)].add((desc_kind, desc_id))
+    return children
+
+
+def search_descendants(start, children):
+    # breadth-first search: descendant -> distance from start (not including start)
+    reached = {start: 0}
+    queue = deque([start])
+    while queue:
+        node = queue.popleft()
+        distance = reached[node] + 1
+        for child in children.get(node, ()):
+            if child not in reached:
+                reached[child] = distance
+                queue.append(child)
+    del reached[start]
+    return reached
+
+
+def rebuild_lineage(batch_size=None, using=DEFAULT_DB_ALIAS):
+    """
+    Fill the lineage table from scratch: all lineage relations are
+    loaded into memory, and the descendants of each node are found with
+    one breadth-first search. Returns the number of rows.
+    """
+    batch_size = batch_size or get_config('lineage_batch_size', LINEAGE_BATCH_SIZE)
+    children = get_all_children(using)
+    count = 0
+    with transaction.atomic(using=using):
+        Lineage.objects.using(using).all()._raw_delete(using)
+        rows = []
+        for anc in sorted(children):
+            for desc, distance in search_descendants(anc, children).iteritems():
+                rows.append((anc[0], anc[1], desc[0], desc[1], distance))
+            if len(rows) >= batch_size:
+                insert_rows(rows, using)
+                count += len(rows)
+                rows = []
+        insert_rows(rows, using)
+        count += len(rows)
+    return count
+
+
+def track_provenance_ids(entity_ids=(), activity_ids=(), agent_ids=(), countdown=-1,
+        direction='BACK', members_flag=False, steps_flag=False, agent_flag=False):
+    """
+    Find the provenance of the given start nodes within countdown
+    relations (-1: all) with the lineage table. Returns the ids of all
+    nodes and relations, as rows.track_provenance_ids.
+
+    The shortest distance of each node from the start nodes is found in
+    rounds: the lineage ancestors of all nodes reached by other
+    relations (or the start nodes) are looked up in the lineage table,
+    then the relations of all nodes within the depth are loaded, and
+    nodes that are reached on a shorter path are updated.
+    """
+    steps = get_traversal_steps(direction=direction,
+        members_flag=members_flag,
+        steps_flag=steps_flag,
+        agent_flag=agent_flag)
+
+    def within(distance):
+        return countdown < 0 or distance <= countdown
+
+    def expandable(node):
+        # the relations of nodes at the maximum depth are not followed
+        return (countdown < 0 or distance[node] < countdown) and (node[0] != 'agent' or agent_flag)
+
+    distance = {}
+    for kind, ids in zip(NODE_KINDS, [entity_ids, activity_ids, agent_ids]):
+        for node_id in ids:
+            distance[(kind, node_id)] = 0
+    relation_ids = dict((key, set()) for key in RELATION_MODELS)
+    # node -> next nodes, for the nodes whose relations were loaded
+    neighbours = {}
+
+    changed = set(distance)
+    lookup = set(node for node in distance if node[0] != 'agent')
+    while changed:
+        # ancestors in the lineage table of the nodes reached otherwise
+        if lookup:
+            for node, found in get_lineage(lookup, direction).iteritems():
+                for far, far_distance in found.iteritems():
+                    far_distance += distance[node]
+                    if within(far_distance) and far_distance < distance.get(far, far_distance + 1):
+                        distance[far] = far_distance
+                        changed.add(far)
+
+        # relations of the nodes that were not expanded yet
+        new = [node for node in changed if node not in neighbours and expandable(node)]
+        for node in new:
+            neighbours[node] = []
+        for kind in NODE_KINDS:
+            ids = [node_id for node_kind, node_id in new if node_kind == kind]
+            for chunk in chunks(ids):
+                if kind == 'activity':
+                    relation_ids['parameter'].update(
+                        RELATION_MODELS['parameter'].objects.filter(activity_id__in=chunk).values_list('id', flat=True)
+                    )
+                for step in steps[kind]:
+                    # the column lookup is cheaper than near__in for many ids
+                    queryset = step.model.objects.filter(**{step.near + '_id__in': chunk})
+                    for rel_id, near_id, far_id in queryset.values_list('id', step.near, step.far):
+                        relation_ids[step.key].add(rel_id)
+                        if far_id is not None:
+                            neighbours[(kind, near_id)].append((step.far_kind, far_id))
+
+        # nodes reached on shorter paths over the relations
+        improved = set()
+        for node in changed:
+            if node not in neighbours or not expandable(node):
+                continue
+            far_distance = distance[node] + 1
+            for far in neighbours[node]:
+                if within(far_distance) and far_distance < distance.get(far, far_distance + 1):
+                    distance[far] = far_distance
+                    improved.add(far)
+        changed = improved
+        lookup = set(node for node in improved if node[0] != 'agent')
+
+    node_ids = dict((kind, set()) for kind in NODE_KINDS)
+    for kind, node_id in distance:
+        node_ids[kind].add(node_id)
+    return node_ids, relation_ids
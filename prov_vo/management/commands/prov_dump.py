@@ -0,0 +1,77 @@
+"""
+Write the complete provenance in the database to a file, as the allprov
+view does, e.g.
+
+    python manage.py prov_dump provenance.json
+    python manage.py prov_dump --format PROV-N --model W3C provenance.provn
+    python manage.py prov_dump --model IVOA archive.json.gz
+
+The tables are read in chunks, see prov_vo/export.py, so the document
+is never held in memory completely. Files ending with .gz (or written
+with --gzip) are compressed. Documents written with --model IVOA and
+--format PROV-JSON can be loaded again with prov_load.
+"""
+import gzip
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from prov_vo.export import get_export_sections, PROVENANCE_SERIALIZERS, EXPORT_CHUNK_SIZE
+from prov_vo.renderers import PROVNRenderer, PROVJSONRenderer
+
+RENDERERS = {
+    'PROV-N': PROVNRenderer,
+    'PROV-JSON': PROVJSONRenderer,
+}
+
+
+class Command(BaseCommand):
+    help = "Write all provenance records in the database as PROV-N or PROV-JSON document."
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', nargs='?', default='-',
+            help="Output file, - for standard output (default).")
+        parser.add_argument('--format', choices=sorted(RENDERERS), default='PROV-JSON',
+            help="Format of the document (default: PROV-JSON).")
+        parser.add_argument('--model', choices=sorted(PROVENANCE_SERIALIZERS), default='W3C',
+            help="Data model of the serialization (default: W3C).")
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE,
+            help="Number of objects read per query (default: %d)." % EXPORT_CHUNK_SIZE)
+        parser.add_argument('--gzip', action='store_true',
+            help="Compress the output with gzip (default for files ending with .gz).")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+            help="Database to use (default: %s)." % DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("The chunk size must be positive.")
+
+        filename = options['file']
+        sections = get_export_sections(model=options['model'], chunk_size=options['chunk_size'],
+            using=options['database'])
+        content = RENDERERS[options['format']]().render_sections(sections)
+
+        compressed = options['gzip'] or filename.endswith('.gz')
+        start = time.time()
+        size = 0
+        try:
+            out = sys.stdout if filename == '-' else open(filename, 'wb')
+            try:
+                # closing the GzipFile writes the end of the stream, not closing out
+                stream = gzip.GzipFile(fileobj=out, mode='wb') if compressed else out
+                for chunk in content:
+                    chunk = chunk.encode('utf-8')
+                    stream.write(chunk)
+                    size += len(chunk)
+                if compressed:
+                    stream.close()
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+        except IOError as e:
+            raise CommandError("%s: %s" % (filename, e))
+
+        if options['verbosity'] > 0 and filename != '-':
+            self.stdout.write("%d bytes written to %s in %.1f s" % (size, filename, time.time() - start))
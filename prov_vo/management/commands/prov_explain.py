@@ -0,0 +1,187 @@
+"""
+Show the query plans (EXPLAIN) of the queries used for tracking the
+provenance and report the ones that read whole tables, e.g.
+
+    python manage.py prov_explain
+    python manage.py prov_explain --check -v 2
+
+Supported are SQLite (EXPLAIN QUERY PLAN) and PostgreSQL (EXPLAIN).
+On small tables, PostgreSQL prefers sequential scans even if a suitable
+index exists; use --no-seqscan to check which indexes it would use.
+Without one recursive term per step (SQLite < 3.34.0 and PostgreSQL, see
+cte.supports_step_terms), the recursive query joins the union of all
+relations and reads them completely; this is reported as known
+limitation and does not fail --check.
+"""
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from prov_vo.models import Parameter
+from prov_vo.utils import get_traversal_steps, get_step_queryset, RELATION_MODELS
+from prov_vo import cte
+
+NODE_KINDS = ['entity', 'activity', 'agent']
+DIRECTIONS = ['BACK', 'FORTH']
+
+# ids used as query parameters, the plans do not depend on them
+EXAMPLE_IDS = ['ex:id1', 'ex:id2']
+
+FULL_SCAN = 'full scan'
+KNOWN_FULL_SCAN = 'known scan'
+INDEX_ONLY = 'index only'
+INDEX = 'index'
+
+
+def get_traversal_queries(ids=EXAMPLE_IDS):
+    """
+    Return the queries of the traversal functions for both directions and
+    all flags set, as list of (label, queryset): instances
+    (utils.track_provenance), ids (rows.track_provenance_ids) and node
+    sets (rows.track_node_sets).
+    """
+    queries = []
+    found = set()
+    for direction in DIRECTIONS:
+        steps = get_traversal_steps(direction=direction,
+            members_flag=True, steps_flag=True, agent_flag=True)
+        for kind in NODE_KINDS:
+            for step in steps[kind]:
+                if (step.key, step.near) in found:
+                    continue
+                found.add((step.key, step.near))
+                label = "%s: %s -> %s" % (step.key, step.near, step.far)
+                queryset = step.model.objects.filter(**{step.near + '__in': ids})
+                queries += [
+                    (label + " (instances)", get_step_queryset(step, ids)),
+                    (label + " (ids)", queryset.values_list('id', step.far)),
+                    (label + " (node sets)", queryset.values_list(step.near, step.far)),
+                ]
+
+    queryset = Parameter.objects.filter(activity__in=ids)
+    queries += [
+        ("parameter: activity (instances)", queryset.select_related('description')),
+        ("parameter: activity (ids)", queryset.values_list('id', flat=True)),
+    ]
+    return queries
+
+
+def get_closure_queries(connection, ids=EXAMPLE_IDS):
+    """
+    Return the recursive queries for DEPTH=ALL, if supported by the
+    database, as list of (label, (sql, params), known_full_scan).
+    known_full_scan is True for the union form of the recursion
+    (without step terms), which always reads all relations.
+    """
+    if not cte.supports_recursive_cte(connection):
+        return []
+
+    step_terms = cte.supports_step_terms(connection)
+    queries = []
+    for direction in DIRECTIONS:
+        steps = get_traversal_steps(direction=direction,
+            members_flag=True, steps_flag=True, agent_flag=True)
+        sql = cte.get_closure_sql(steps, [('entity', i) for i in ids], connection.ops.quote_name,
+            step_terms=step_terms)
+        queries.append(("recursive query (%s)" % direction, sql, not step_terms))
+    return queries
+
+
+def explain(connection, sql, params):
+    # return the lines of the query plan
+    if connection.vendor == 'sqlite':
+        explain_sql = "EXPLAIN QUERY PLAN " + sql
+    else:
+        explain_sql = "EXPLAIN " + sql
+    with connection.cursor() as cursor:
+        cursor.execute(explain_sql, params)
+        # SQLite returns (id, parent, notused, detail), PostgreSQL one text column
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def get_access(vendor, plan, tables):
+    """
+    Classify the access to the given tables (the relation tables) in a
+    query plan: FULL_SCAN, if any of them is read completely, INDEX_ONLY,
+    if all lookups are answered from the indexes alone, INDEX otherwise.
+    The nodes joined to the relations are always found by primary key.
+    For SQLite, a search with only a lower bound (e.g. "(activity_id>?)"
+    from "activity_id IS NOT NULL") reads the whole index and counts as
+    full scan.
+    """
+    access = INDEX_ONLY
+    for line in plan:
+        if vendor == 'sqlite':
+            match = re.match(r'\s*(SCAN|SEARCH) (?:TABLE )?(\w+)(.*)', line)
+            if not match or match.group(2) not in tables:
+                continue
+            operation, rest = match.group(1), match.group(3)
+            if operation == 'SCAN' or re.search(r'\(\w+>\?\)$', rest):
+                return FULL_SCAN
+            if 'COVERING INDEX' not in rest and 'INTEGER PRIMARY KEY' not in rest:
+                access = INDEX
+        else:
+            match = re.search(r'Seq Scan on (\w+)', line)
+            if match and match.group(1) in tables:
+                return FULL_SCAN
+            if 'Index Scan' in line or 'Bitmap Heap Scan' in line:
+                access = INDEX
+    return access
+
+
+class Command(BaseCommand):
+    help = "Show the query plans of the provenance traversal and report full table scans."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+            help="Database to use (default: %s)." % DEFAULT_DB_ALIAS)
+        parser.add_argument('--check', action='store_true',
+            help="Exit with an error, if any query reads a whole table.")
+        parser.add_argument('--no-seqscan', action='store_true',
+            help="PostgreSQL only: disable sequential scans, to show the indexes that can be used.")
+
+    def handle(self, *args, **options):
+        database = options['database']
+        connection = connections[database]
+        if connection.vendor not in ['sqlite', 'postgresql']:
+            raise CommandError("EXPLAIN is only supported for SQLite and PostgreSQL, not for %s." % connection.vendor)
+
+        tables = set(model._meta.db_table for model in RELATION_MODELS.values())
+
+        queries = []
+        for label, queryset in get_traversal_queries():
+            queryset = queryset.using(database)
+            queries.append((label, queryset.query.get_compiler(using=database).as_sql(), False))
+        queries += get_closure_queries(connection)
+
+        if options['no_seqscan'] and connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SET enable_seqscan = off")
+
+        full_scans = 0
+        known_full_scans = 0
+        try:
+            for label, (sql, params), known_full_scan in queries:
+                plan = explain(connection, sql, params)
+                access = get_access(connection.vendor, plan, tables)
+                if access == FULL_SCAN and known_full_scan:
+                    access = KNOWN_FULL_SCAN
+                    known_full_scans += 1
+                elif access == FULL_SCAN:
+                    full_scans += 1
+                self.stdout.write("%-10s  %s" % (access, label))
+                if options['verbosity'] > 1:
+                    for line in plan:
+                        self.stdout.write("            %s" % line)
+        finally:
+            if options['no_seqscan'] and connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute("RESET enable_seqscan")
+
+        if known_full_scans:
+            self.stdout.write("%d recursive queries read all relations (known limitation, "
+                "one recursive term per step requires SQLite 3.34.0)" % known_full_scans)
+        self.stdout.write("%d queries, %d with full scans" % (len(queries), full_scans))
+        if options['check'] and full_scans:
+            raise CommandError("%d traversal queries read whole tables." % full_scans)
@@ -0,0 +1,36 @@
+"""
+Rebuild the lineage table (prov_vo_lineage, see prov_vo/lineage.py)
+from the lineage relations in the database, e.g. when switching on
+PROV_VO_CONFIG['lineage_table'] or after changing relations with
+queryset updates or raw SQL:
+
+    python manage.py prov_lineage
+
+While the table is enabled, it is kept up to date when relations are
+saved or deleted, and rebuilt after bulk loads.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from prov_vo.lineage import rebuild_lineage, LINEAGE_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = "Rebuild the table of ancestors and descendants along the lineage relations."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=LINEAGE_BATCH_SIZE,
+            help="Number of rows written per query (default: %d)." % LINEAGE_BATCH_SIZE)
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+            help="Database to use (default: %s)." % DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("The batch size must be positive.")
+
+        start = time.time()
+        count = rebuild_lineage(batch_size=options['batch_size'], using=options['database'])
+        if options['verbosity'] > 0:
+            self.stdout.write("%d lineage rows written in %.1f s" % (count, time.time() - start))
@@ -0,0 +1,77 @@
+"""
+Load provenance records from PROV-JSON documents (as returned by
+provdal with MODEL=IVOA) into the database, e.g.
+
+    python manage.py prov_load provenance.json
+    curl 'http://localhost:8000/prov_vo/provdal/?ID=rave:dr4&DEPTH=ALL' | python manage.py prov_load -
+
+The records are written in batches with bulk_create, see
+prov_vo/bulkload.py; records that exist already are skipped.
+"""
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from prov_vo.bulkload import ProvLoader
+from prov_vo.utils import InvalidDataError
+
+
+class Command(BaseCommand):
+    help = "Load PROV-JSON documents (IVOA model) into the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+',
+            help="PROV-JSON files to load, - for standard input.")
+        parser.add_argument('--batch-size', type=int, default=1000,
+            help="Number of records written per transaction (default: 1000).")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+            help="Database to use (default: %s)." % DEFAULT_DB_ALIAS)
+        parser.add_argument('--progress', type=float, default=10.0,
+            help="Report the progress every this many seconds (default: 10, 0 for no progress).")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("The batch size must be positive.")
+
+        self.interval = options['progress']
+        self.last_report = time.time()
+        progress = self.report_progress if self.interval > 0 and options['verbosity'] > 0 else None
+        loader = ProvLoader(batch_size=options['batch_size'], using=options['database'], progress=progress)
+
+        for filename in options['files']:
+            try:
+                if filename == '-':
+                    loader.load(sys.stdin)
+                else:
+                    with open(filename, 'rb') as f:
+                        loader.load(f)
+            except (IOError, InvalidDataError) as e:
+                raise CommandError("%s: %s" % (filename, e))
+
+        if options['verbosity'] > 0:
+            self.write_summary(loader)
+
+    def report_progress(self, loader):
+        now = time.time()
+        if now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        totals = loader.get_totals()
+        self.stdout.write("%d records read, %d created (%.0f records/s)" % (
+            totals['read'], totals['created'], totals['read'] / max(totals['seconds'], 1e-6)))
+
+    def write_summary(self, loader):
+        self.stdout.write("%-26s %9s %9s %11s %11s" % ('section', 'read', 'created', 'duplicates', 'unresolved'))
+        for section, counts in loader.stats.iteritems():
+            if counts['read']:
+                self.stdout.write("%-26s %9d %9d %11d %11d" % (section, counts['read'], counts['created'],
+                    counts['duplicates'], counts['unresolved']))
+        for section, obj_id, references in loader.unresolved:
+            self.stdout.write("unresolved %s %s: %s" % (section, obj_id or '', ', '.join(
+                "%s=%s" % (name, value) for name, value in references)))
+
+        totals = loader.get_totals()
+        self.stdout.write("%d records read, %d created in %.1f s (%.0f records/s)" % (
+            totals['read'], totals['created'], totals['seconds'], totals['read'] / max(totals['seconds'], 1e-6)))
@@ -0,0 +1,44 @@
+"""
+Compute the level-of-detail graph summaries (graph/summary, see
+prov_vo/graphsummary.py) and store them in the response cache, e.g.
+after loading a data release:
+
+    python manage.py prov_load release.json
+    python manage.py prov_summarize
+
+Requires PROV_VO_CONFIG['response_cache'] to be set to a cache shared
+by the web server processes (e.g. a file, database or memcached cache).
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from prov_vo import responsecache
+from prov_vo.export import EXPORT_CHUNK_SIZE
+from prov_vo.graphsummary import store_summaries
+
+
+class Command(BaseCommand):
+    help = "Compute the summaries of the provenance graph and store them in the response cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE,
+            help="Number of rows read per query (default: %d)." % EXPORT_CHUNK_SIZE)
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+            help="Database to use (default: %s)." % DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("The chunk size must be positive.")
+        cache = responsecache.get_response_cache()
+        if cache is None:
+            raise CommandError("No response cache configured (PROV_VO_CONFIG['response_cache']).")
+
+        start = time.time()
+        generation, modified = responsecache.get_generation(cache)
+        summaries = store_summaries(cache, generation, chunk_size=options['chunk_size'],
+            using=options['database'])
+        if options['verbosity'] > 0:
+            self.stdout.write("%d summaries (%d top-level nodes) stored in %.1f s" % (
+                len(summaries), len(summaries[None]['nodes']), time.time() - start))
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:58
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prov_vo', '0008_char_id_in_usedDescription_and_wasGeneratedByDescription'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='hadmember',
+            name='collection',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='prov_vo.Collection'),
+        ),
+        migrations.AlterField(
+            model_name='hadmember',
+            name='entity',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ecollection', to='prov_vo.Entity'),
+        ),
+        migrations.AlterField(
+            model_name='hadstep',
+            name='activity',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='activityFlow', to='prov_vo.Activity'),
+        ),
+        migrations.AlterField(
+            model_name='hadstep',
+            name='activityFlow',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='prov_vo.ActivityFlow'),
+        ),
+        migrations.AlterField(
+            model_name='parameter',
+            name='activity',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='prov_vo.Activity'),
+        ),
+        migrations.AlterField(
+            model_name='used',
+            name='activity',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='prov_vo.Activity'),
+        ),
+        migrations.AlterField(
+            model_name='used',
+            name='entity',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='prov_vo.Entity'),
+        ),
+        migrations.AlterField(
+            model_name='wasassociatedwith',
+            name='activity',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='prov_vo.Activity'),
+        ),
+        migrations.AlterField(
+            model_name='wasassociatedwith',
+            name='agent',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='prov_vo.Agent'),
+        ),
+        migrations.AlterField(
+            model_name='wasattributedto',
+            name='agent',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='prov_vo.Agent'),
+        ),
+        migrations.AlterField(
+            model_name='wasattributedto',
+            name='entity',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='prov_vo.Entity'),
+        ),
+        migrations.AlterField(
+            model_name='wasderivedfrom',
+            name='generatedEntity',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='prov_vo.Entity'),
+        ),
+        migrations.AlterField(
+            model_name='wasderivedfrom',
+            name='usedEntity',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='generatedEntity', to='prov_vo.Entity'),
+        ),
+        migrations.AlterField(
+            model_name='wasgeneratedby',
+            name='activity',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='prov_vo.Activity'),
+        ),
+        migrations.AlterField(
+            model_name='wasgeneratedby',
+            name='entity',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='prov_vo.Entity'),
+        ),
+        migrations.AlterField(
+            model_name='wasinformedby',
+            name='informant',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='informed', to='prov_vo.Activity'),
+        ),
+        migrations.AlterField(
+            model_name='wasinformedby',
+            name='informed',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='prov_vo.Activity'),
+        ),
+        migrations.AddIndex(
+            model_name='hadmember',
+            index=models.Index(fields=['collection', 'entity', 'id'], name='prov_hm_coll_ent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hadmember',
+            index=models.Index(fields=['entity', 'collection', 'id'], name='prov_hm_ent_coll_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wasassociatedwith',
+            index=models.Index(fields=['activity', 'agent', 'id'], name='prov_waw_act_agent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wasassociatedwith',
+            index=models.Index(fields=['agent', 'activity', 'id'], name='prov_waw_agent_act_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hadstep',
+            index=models.Index(fields=['activityFlow', 'activity', 'id'], name='prov_hs_flow_act_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hadstep',
+            index=models.Index(fields=['activity', 'activityFlow', 'id'], name='prov_hs_act_flow_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wasattributedto',
+            index=models.Index(fields=['entity', 'agent', 'id'], name='prov_wat_ent_agent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wasattributedto',
+            index=models.Index(fields=['agent', 'entity', 'id'], name='prov_wat_agent_ent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='used',
+            index=models.Index(fields=['entity', 'activity', 'id'], name='prov_used_ent_act_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='used',
+            index=models.Index(fields=['activity', 'entity', 'id'], name='prov_used_act_ent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wasinformedby',
+            index=models.Index(fields=['informed', 'informant', 'id'], name='prov_wib_informed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wasinformedby',
+            index=models.Index(fields=['informant', 'informed', 'id'], name='prov_wib_informant_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='parameter',
+            index=models.Index(fields=['activity', 'id'], name='prov_param_act_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wasgeneratedby',
+            index=models.Index(fields=['entity', 'activity', 'id'], name='prov_wgb_ent_act_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wasgeneratedby',
+            index=models.Index(fields=['activity', 'entity', 'id'], name='prov_wgb_act_ent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wasderivedfrom',
+            index=models.Index(fields=['generatedEntity', 'usedEntity', 'id'], name='prov_wdf_gen_used_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wasderivedfrom',
+            index=models.Index(fields=['usedEntity', 'generatedEntity', 'id'], name='prov_wdf_used_gen_idx'),
+        ),
+    ]
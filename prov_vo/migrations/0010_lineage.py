@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 05:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prov_vo', '0009_traversal_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Lineage',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('ancestor_kind', models.CharField(max_length=16)),
+                ('ancestor_id', models.CharField(max_length=128)),
+                ('descendant_kind', models.CharField(max_length=16)),
+                ('descendant_id', models.CharField(max_length=128)),
+                ('min_distance', models.IntegerField()),
+            ],
+            options={
+                'db_table': 'prov_vo_lineage',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='lineage',
+            index=models.Index(fields=['descendant_id', 'min_distance'], name='prov_lineage_desc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lineage',
+            index=models.Index(fields=['ancestor_id', 'min_distance'], name='prov_lineage_anc_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='lineage',
+            unique_together=set([('ancestor_id', 'ancestor_kind', 'descendant_id', 'descendant_kind')]),
+        ),
+    ]
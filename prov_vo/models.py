@@ -148,7 +148,13 @@ class Parameter(models.Model):
     id = models.CharField(primary_key=True, max_length=128)
     description = models.ForeignKey("ParameterDescription", null=True)
     value = models.CharField(max_length=128, null=True, blank=True)
-    activity = models.ForeignKey(Activity, null=True)
+    activity = models.ForeignKey(Activity, null=True, db_index=False)
+
+    class Meta:
+        # covering index for finding the parameters of activities
+        indexes = [
+            models.Index(fields=['activity', 'id'], name='prov_param_act_idx'),
+        ]
 
     def __str__(self):
         return self.id
@@ -175,14 +181,25 @@ class ParameterDescription(models.Model):
 
 
 # relation classes
+# Each relation has composite indexes (near, far, id) for both directions
+# of the traversal (see utils.get_traversal_steps), so that the ids of the
+# relations and next nodes can be read from the index alone. They replace
+# the single-column indexes of the foreign keys (db_index=False).
 @python_2_unicode_compatible
 class Used(models.Model):
     id = models.AutoField(primary_key=True)
-    activity = models.ForeignKey(Activity, null=True, blank=True, on_delete=models.SET_NULL) #, on_delete=models.CASCADE) # Should be required!
-    entity = models.ForeignKey(Entity, null=True, blank=True, on_delete=models.SET_NULL) #, on_delete=models.CASCADE) # Should be required!
+    activity = models.ForeignKey(Activity, null=True, blank=True, on_delete=models.SET_NULL, db_index=False) #, on_delete=models.CASCADE) # Should be required!
+    entity = models.ForeignKey(Entity, null=True, blank=True, on_delete=models.SET_NULL, db_index=False) #, on_delete=models.CASCADE) # Should be required!
     time = models.DateTimeField(null=True)
     role = models.CharField(max_length=128, blank=True, null=True) #-> move to description!
     description = models.ForeignKey("UsedDescription", null=True, blank=True, on_delete=models.SET_NULL)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['entity', 'activity', 'id'], name='prov_used_ent_act_idx'),
+            models.Index(fields=['activity', 'entity', 'id'], name='prov_used_act_ent_idx'),
+        ]
+
     def __str__(self):
         return "id=%s; activity=%s; entity=%s" % (str(self.id), self.activity, self.entity)
 
@@ -199,12 +216,18 @@ class UsedDescription(models.Model):
 @python_2_unicode_compatible
 class WasGeneratedBy(models.Model):
     id = models.AutoField(primary_key=True)
-    entity = models.ForeignKey(Entity, null=True, blank=True, on_delete=models.SET_NULL) #, on_delete=models.CASCADE)
-    activity = models.ForeignKey(Activity, null=True, blank=True, on_delete=models.SET_NULL) #, on_delete=models.CASCADE)
+    entity = models.ForeignKey(Entity, null=True, blank=True, on_delete=models.SET_NULL, db_index=False) #, on_delete=models.CASCADE)
+    activity = models.ForeignKey(Activity, null=True, blank=True, on_delete=models.SET_NULL, db_index=False) #, on_delete=models.CASCADE)
     time = models.DateTimeField(null=True)
     role = models.CharField(max_length=128, blank=True, null=True)  # -> move to desc.!
     description = models.ForeignKey("WasGeneratedByDescription", null=True, blank=True, on_delete=models.SET_NULL)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['entity', 'activity', 'id'], name='prov_wgb_ent_act_idx'),
+            models.Index(fields=['activity', 'entity', 'id'], name='prov_wgb_act_ent_idx'),
+        ]
+
     def __str__(self):
         return "id=%s; entity=%s; activity=%s" % (str(self.id), self.entity, self.activity)
 
@@ -221,8 +244,14 @@ class WasGeneratedByDescription(models.Model):
 @python_2_unicode_compatible
 class WasDerivedFrom(models.Model):
     id = models.AutoField(primary_key=True)
-    generatedEntity = models.ForeignKey(Entity, null=True, blank=True, on_delete=models.SET_NULL)
-    usedEntity = models.ForeignKey(Entity, related_name='generatedEntity', null=True, blank=True, on_delete=models.SET_NULL) #, on_delete=models.CASCADE)
+    generatedEntity = models.ForeignKey(Entity, null=True, blank=True, on_delete=models.SET_NULL, db_index=False)
+    usedEntity = models.ForeignKey(Entity, related_name='generatedEntity', null=True, blank=True, on_delete=models.SET_NULL, db_index=False) #, on_delete=models.CASCADE)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['generatedEntity', 'usedEntity', 'id'], name='prov_wdf_gen_used_idx'),
+            models.Index(fields=['usedEntity', 'generatedEntity', 'id'], name='prov_wdf_used_gen_idx'),
+        ]
 
     def __str__(self):
         return "id=%s; generatedEntity=%s; usedEntity=%s" % (str(self.id), self.generatedEntity, self.usedEntity)
@@ -230,30 +259,48 @@ class WasDerivedFrom(models.Model):
 @python_2_unicode_compatible
 class WasInformedBy(models.Model):
     id = models.AutoField(primary_key=True)
-    informed = models.ForeignKey(Activity, null=True, blank=True, on_delete=models.SET_NULL)
-    informant = models.ForeignKey(Activity, related_name='informed', null=True, blank=True, on_delete=models.SET_NULL)
+    informed = models.ForeignKey(Activity, null=True, blank=True, on_delete=models.SET_NULL, db_index=False)
+    informant = models.ForeignKey(Activity, related_name='informed', null=True, blank=True, on_delete=models.SET_NULL, db_index=False)
 #    role = models.CharField(max_length=128, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['informed', 'informant', 'id'], name='prov_wib_informed_idx'),
+            models.Index(fields=['informant', 'informed', 'id'], name='prov_wib_informant_idx'),
+        ]
+
     def __str__(self):
         return "id=%s; entity=%s; agent=%s; role=%s" % (str(self.id), self.entity, self.agent, self.role)
 
 @python_2_unicode_compatible
 class WasAssociatedWith(models.Model):
     id = models.AutoField(primary_key=True)
-    activity = models.ForeignKey(Activity, null=True, blank=True, on_delete=models.SET_NULL)
-    agent = models.ForeignKey(Agent, null=True, blank=True, on_delete=models.SET_NULL) #, on_delete=models.CASCADE)
+    activity = models.ForeignKey(Activity, null=True, blank=True, on_delete=models.SET_NULL, db_index=False)
+    agent = models.ForeignKey(Agent, null=True, blank=True, on_delete=models.SET_NULL, db_index=False) #, on_delete=models.CASCADE)
     role = models.CharField(max_length=128, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['activity', 'agent', 'id'], name='prov_waw_act_agent_idx'),
+            models.Index(fields=['agent', 'activity', 'id'], name='prov_waw_agent_act_idx'),
+        ]
+
     def __str__(self):
         return "id=%s; activity=%s; agent=%s; role=%s" % (str(self.id), self.activity, self.agent, self.role)
 
 @python_2_unicode_compatible
 class WasAttributedTo(models.Model):
     id = models.AutoField(primary_key=True)
-    entity = models.ForeignKey(Entity, null=True, blank=True, on_delete=models.SET_NULL)
-    agent = models.ForeignKey(Agent, null=True, blank=True, on_delete=models.SET_NULL) #, on_delete=models.CASCADE)
+    entity = models.ForeignKey(Entity, null=True, blank=True, on_delete=models.SET_NULL, db_index=False)
+    agent = models.ForeignKey(Agent, null=True, blank=True, on_delete=models.SET_NULL, db_index=False) #, on_delete=models.CASCADE)
     role = models.CharField(max_length=128, blank=True, null=True)  # not allowed by W3C!!
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['entity', 'agent', 'id'], name='prov_wat_ent_agent_idx'),
+            models.Index(fields=['agent', 'entity', 'id'], name='prov_wat_agent_ent_idx'),
+        ]
+
     def __str__(self):
         return "id=%s; entity=%s; agent=%s; role=%s" % (str(self.id), self.entity, self.agent, self.role)
 
@@ -261,8 +308,14 @@ class WasAttributedTo(models.Model):
 @python_2_unicode_compatible
 class HadMember(models.Model):
     id = models.AutoField(primary_key=True)
-    collection = models.ForeignKey(Collection, null=True, blank=True, on_delete=models.SET_NULL)  # enforce prov-type: collection
-    entity = models.ForeignKey(Entity, related_name='ecollection', null=True, blank=True, on_delete=models.SET_NULL) # related_name = 'collection' throws error!
+    collection = models.ForeignKey(Collection, null=True, blank=True, on_delete=models.SET_NULL, db_index=False)  # enforce prov-type: collection
+    entity = models.ForeignKey(Entity, related_name='ecollection', null=True, blank=True, on_delete=models.SET_NULL, db_index=False) # related_name = 'collection' throws error!
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['collection', 'entity', 'id'], name='prov_hm_coll_ent_idx'),
+            models.Index(fields=['entity', 'collection', 'id'], name='prov_hm_ent_coll_idx'),
+        ]
 
     def __str__(self):
         return "id=%s; collection=%s; entity=%s; role=%s" % (str(self.id), self.collection, self.entity, self.role)
@@ -270,8 +323,37 @@ class HadMember(models.Model):
 @python_2_unicode_compatible
 class HadStep(models.Model):
     id = models.AutoField(primary_key=True)
-    activityFlow = models.ForeignKey(ActivityFlow, null=True, blank=True, on_delete=models.SET_NULL) #, on_delete=models.CASCADE)
-    activity = models.ForeignKey(Activity, related_name='activityFlow', null=True, blank=True, on_delete=models.SET_NULL)
+    activityFlow = models.ForeignKey(ActivityFlow, null=True, blank=True, on_delete=models.SET_NULL, db_index=False) #, on_delete=models.CASCADE)
+    activity = models.ForeignKey(Activity, related_name='activityFlow', null=True, blank=True, on_delete=models.SET_NULL, db_index=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['activityFlow', 'activity', 'id'], name='prov_hs_flow_act_idx'),
+            models.Index(fields=['activity', 'activityFlow', 'id'], name='prov_hs_act_flow_idx'),
+        ]
 
     def __str__(self):
         return "id=%s; activityFlow=%s; activity=%s" % (str(self.id), self.activityFlow, self.activity)
+
+
+# transitive closure of the lineage relations, maintained by lineage.py
+@python_2_unicode_compatible
+class Lineage(models.Model):
+    id = models.AutoField(primary_key=True)
+    ancestor_kind = models.CharField(max_length=16)  # entity or activity
+    ancestor_id = models.CharField(max_length=128)
+    descendant_kind = models.CharField(max_length=16)
+    descendant_id = models.CharField(max_length=128)
+    min_distance = models.IntegerField()  # number of relations on the shortest path
+
+    class Meta:
+        db_table = 'prov_vo_lineage'
+        unique_together = [('ancestor_id', 'ancestor_kind', 'descendant_id', 'descendant_kind')]
+        indexes = [
+            models.Index(fields=['descendant_id', 'min_distance'], name='prov_lineage_desc_idx'),
+            models.Index(fields=['ancestor_id', 'min_distance'], name='prov_lineage_anc_idx'),
+        ]
+
+    def __str__(self):
+        return "%s %s -> %s %s (%d)" % (self.ancestor_kind, self.ancestor_id,
+            self.descendant_kind, self.descendant_id, self.min_distance)
@@ -0,0 +1,27 @@
+"""
+Keyset pagination for the REST API: the objects are ordered by their
+primary keys (the ids of nodes and descriptions, the integer ids of
+relations), and the cursor of the next page contains the last id. So
+each page is fetched with one "id > last id ORDER BY id LIMIT n" query
+using the primary key index, and no COUNT query is needed; pages stay
+consistent while objects are added.
+"""
+from rest_framework.pagination import CursorPagination
+
+from .utils import get_config
+
+
+class KeysetPagination(CursorPagination):
+    """
+    CursorPagination over the primary key; the page size is taken from
+    PROV_VO_CONFIG['api_page_size'] (default 100) and can be chosen with
+    the page_size parameter up to PROV_VO_CONFIG['api_max_page_size']
+    (default 1000).
+    """
+    ordering = 'pk'
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        self.page_size = get_config('api_page_size', 100)
+        self.max_page_size = get_config('api_max_page_size', 1000)
+        return super(KeysetPagination, self).get_page_size(request)
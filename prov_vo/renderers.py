@@ -4,6 +4,7 @@ import json
 
 from django.utils.xmlutils import SimplerXMLGenerator
 from django.utils.six.moves import StringIO
+from io import BytesIO
 from django.utils.encoding import smart_text
 from django.utils.encoding import smart_unicode
 from django.utils import timezone
@@ -11,6 +12,14 @@ from rest_framework.renderers import BaseRenderer
 from lxml import etree
 
 class PROVJSONRenderer(BaseRenderer):
+    """
+    Renders the serialized data as PROV-JSON, indented by indent spaces,
+    or as compact JSON without any whitespace if indent is None.
+    """
+
+    def __init__(self, indent=4):
+        self.indent = indent
+
     def render(self, data):
         # remove empty dicts
         for key, value in data.iteritems():
@@ -19,112 +28,259 @@ class PROVJSONRenderer(BaseRenderer):
 
         string = json.dumps(data,
                 #sort_keys=True,
-                indent=4
+                indent=self.indent,
+                separators=self.get_layout()[2:]
             )
 
         return string
 
+    def get_encoder(self):
+        return json.JSONEncoder(indent=self.indent, separators=self.get_layout()[2:])
+
+    def get_layout(self):
+        # newline, indentation of one level, item and key separator, as used by json.dumps
+        if self.indent is None:
+            return '', '', ',', ':'
+        return '\n', ' ' * self.indent, ', ', ': '
+
+    def render_stream(self, serializer, chunk_size=65536):
+        """
+        Yield the same document as render(serializer.data) in chunks of
+        about chunk_size characters. Each section (prefix, activity,
+        entity, ...) is serialized only when it is reached and encoded
+        incrementally, so the complete document is never held in memory.
+        """
+        return join_chunks(self.iter_sections(serializer, self.get_encoder()), chunk_size)
+
+    def iter_sections(self, serializer, encoder):
+        newline, indent, item_separator, key_separator = self.get_layout()
+        first = True
+        for name in serializer.fields.keys():
+            section = get_section(serializer, name)
+            # skip empty sections, as in render
+            if len(section) == 0:
+                continue
+            yield ('{' if first else item_separator) + newline + indent + encoder.encode(name) + key_separator
+            # sections are nested one level deeper than in their own document
+            for chunk in encoder.iterencode(section):
+                yield chunk.replace('\n', '\n' + indent)
+            first = False
+            del section
+
+        yield '{}' if first else newline + '}'
+
+    def render_sections(self, sections, chunk_size=65536):
+        """
+        Like render_stream, for sections that are not serialized at once:
+        sections is an ordered dictionary of section name and an object
+        with iteritems() yielding the serialized items (see export.py).
+        """
+        return join_chunks(self.iter_items(sections, self.get_encoder()), chunk_size)
+
+    def iter_items(self, sections, encoder):
+        newline, indent, item_separator, key_separator = self.get_layout()
+        first = True
+        for name, section in sections.iteritems():
+            empty = True
+            for key, value in section.iteritems():
+                if empty:
+                    yield ('{' if first else item_separator) + newline + indent + encoder.encode(name) \
+                        + key_separator + '{' + newline + indent * 2
+                    first = False
+                else:
+                    yield item_separator + newline + indent * 2
+                yield encoder.encode(key) + key_separator
+                for chunk in encoder.iterencode(value):
+                    yield chunk.replace('\n', '\n' + indent * 2)
+                empty = False
+            # skip empty sections, as in render
+            if not empty:
+                yield newline + indent + '}'
+
+        yield '{}' if first else newline + '}'
+
+
+def join_chunks(strings, chunk_size):
+    # combine many small strings into chunks of (at least) chunk_size
+    buf = []
+    size = 0
+    for string in strings:
+        buf.append(string)
+        size += len(string)
+        if size >= chunk_size:
+            yield ''.join(buf)
+            buf = []
+            size = 0
+    if buf:
+        yield ''.join(buf)
+
+
+class PROVXMLBaseRenderer(BaseRenderer):
+    """
+    Common parts of the PROV-XML renderers. Each statement is first
+    converted to a (tag, attributes, text, children) tuple; render builds
+    the complete element tree from these, render_stream writes them
+    incrementally with lxml's xmlfile (empty elements are written as
+    <a></a> there instead of <a/>, otherwise the output is the same).
+    """
 
-class PROVXMLRenderer(BaseRenderer):
-    def render(self, data):
-        # remove empty dicts
-        for key, value in data.iteritems():
-            if len(value) == 0:
-                data.pop(key)
-
-        nsmap = {}
-        for prefix, ns in data['prefix'].iteritems():
-            nsmap[prefix] = ns
-        data.pop('prefix')
-        PROV = "{%s}" % nsmap['voprov']
-        root = etree.Element(PROV+'document', nsmap=nsmap)
-
-        reference_list = ['voprov:description', 'voprov:activity', 'voprov:entity',
-                'voprov:agent', 'voprov:influencer', 'voprov:influencee',
-                'voprov:informed', 'voprov:informant', 'voprov:usedEntity',
-                'voprov:generatedEntity', 'voprov:collection', 'voprov:activityFlow',
-                'voprov:activityDescription', 'voprov:entityDescription']
-
+    # prefix of the document namespace
+    prefix = None
+
+    # attributes that are written as references (ref-attribute)
+    reference_list = []
+
+    def set_namespaces(self, prefixes):
+        # namespace map and qualified names are computed once per document
+        self.nsmap = {}
+        for prefix, ns in prefixes.iteritems():
+            self.nsmap[prefix] = ns
+        self.PROV = "{%s}" % self.nsmap[self.prefix]
+        self.id_attribute = self.prefix + ':id'
+        self.qnames = {}
+
+    def get_qname(self, attribute):
+        # convert 'prefix:name' to '{namespace}name'
+        try:
+            return self.qnames[attribute]
+        except KeyError:
+            parts = attribute.split(':')
+            qname = "{%s}%s" % (self.nsmap[parts[0]], parts[1])
+            self.qnames[attribute] = qname
+            return qname
+
+    def get_statement(self, classkey, obj):
         # Sort attributes: 1. mandatory att., 2. optional att. in alphabetical order
         # => Done by sorting fields in serializers
-        for classkey in data:
-            for e in data[classkey]:
-                leaf = etree.SubElement(root, PROV+classkey)
-
-                for attribute in data[classkey][e]:
-                    if attribute == 'voprov:id':
-                        leaf.attrib[PROV+'id'] = data[classkey][e]['voprov:id']
-                    else:
-                        att_ns = attribute.split(':')[0]
-                        NS = "{%s}" % nsmap[att_ns]
-                        att_name = attribute.split(':')[1]
-                        leaf2 = etree.SubElement(leaf, NS+att_name)
-                        if attribute in reference_list:
-                            leaf2.attrib[PROV+'ref'] = data[classkey][e][attribute]
-                        else:
-                            leaf2.text = data[classkey][e][attribute]
-
-        xml = etree.tostring(root, pretty_print=True)
-
-        return xml
-
+        attrib = {}
+        children = []
+        for attribute, value in obj.iteritems():
+            if attribute == self.id_attribute:
+                attrib[self.PROV+'id'] = value
+            else:
+                children.append(self.get_attribute_element(attribute, value))
+        return (self.PROV+classkey, attrib, None, children)
+
+    def get_attribute_element(self, attribute, value):
+        if attribute in self.reference_list:
+            return (self.get_qname(attribute), {self.PROV+'ref': value}, None, [])
+        return (self.get_qname(attribute), {}, value, [])
 
-class W3CPROVXMLRenderer(BaseRenderer):
     def render(self, data):
-
         # remove empty dicts
         for key, value in data.iteritems():
             if len(value) == 0:
                 data.pop(key)
 
-        nsmap = {}
-        for prefix, ns in data['prefix'].iteritems():
-            nsmap[prefix] = ns
-        data.pop('prefix')
-        PROV = "{%s}" % nsmap['prov']
-        root = etree.Element(PROV+'document', nsmap=nsmap)
+        self.set_namespaces(data.pop('prefix'))
+        root = etree.Element(self.PROV+'document', nsmap=self.nsmap)
 
-        reference_list = ['prov:activity', 'prov:entity',
-                'prov:agent', 'prov:influencer', 'prov:influencee',
-                'prov:informed', 'prov:informant', 'prov:usedEntity',
-                'prov:generatedEntity', 'prov:collection',
-                'voprov:activityFlow',
-                'voprov:activityDescription', 'voprov:entityDescription']
-
-        # Sort attributes: 1. mandatory att., 2. optional att. in alphabetical order
-        # => Done by sorting fields in serializers
         for classkey in data:
             for e in data[classkey]:
-                leaf = etree.SubElement(root, PROV+classkey)
-                for attribute in data[classkey][e]:
-                    if attribute == 'prov:id':
-                        leaf.attrib[PROV+'id'] = data[classkey][e][attribute]
-                    else:
-                        att_ns = attribute.split(':')[0]
-                        NS = "{%s}" % nsmap[att_ns]
-                        att_name = attribute.split(':')[1]
-                        leaf2 = etree.SubElement(leaf, NS+att_name)
-
-                        if attribute in reference_list:
-                            leaf2.attrib[PROV+'ref'] = data[classkey][e][attribute]
-                        elif attribute == 'voprov:description':
-                            # embed the descriptions here
-                            for desc_attribute in data[classkey][e][attribute]:
-                                if desc_attribute == 'prov:id':  # or if voprov:id
-                                    leaf2.attrib[PROV+'id'] = data[classkey][e][attribute][desc_attribute]
-                                else:
-                                    att_ns = desc_attribute.split(':')[0]
-                                    NS = "{%s}" % nsmap[att_ns]
-                                    att_name = desc_attribute.split(':')[1]
-                                    leaf3 = etree.SubElement(leaf2, NS+att_name)
-                                    leaf3.text = data[classkey][e][attribute][desc_attribute]
-                        else:
-                            leaf2.text = data[classkey][e][attribute]
+                build_element(root, self.get_statement(classkey, data[classkey][e]))
 
         xml = etree.tostring(root, pretty_print=True)
 
         return xml
 
+    def render_stream(self, serializer, chunk_size=65536):
+        """
+        Yield the document for the given provenance serializer in chunks
+        of about chunk_size bytes. Sections are serialized only when they
+        are reached and each statement is written out directly, so
+        neither the serialized data nor the element tree are kept.
+        """
+        return join_chunks(self.iter_xml(serializer), chunk_size)
+
+    def iter_xml(self, serializer):
+        self.set_namespaces(get_section(serializer, 'prefix'))
+        out = BytesIO()
+        empty = True
+        with etree.xmlfile(out) as xf:
+            with xf.element(self.PROV+'document', nsmap=self.nsmap):
+                for classkey in serializer.fields.keys():
+                    if classkey == 'prefix':
+                        continue
+                    section = get_section(serializer, classkey)
+                    for e in section:
+                        xf.write('\n  ')
+                        write_element(xf, self.get_statement(classkey, section[e]), 1)
+                        xf.flush()
+                        yield drain(out)
+                        empty = False
+                    del section
+                if not empty:
+                    xf.write('\n')
+        yield drain(out) + b'\n'
+
+
+def build_element(parent, node):
+    # add a (tag, attributes, text, children) tuple as subelement
+    tag, attrib, text, children = node
+    element = etree.SubElement(parent, tag, attrib)
+    if text is not None:
+        element.text = text
+    for child in children:
+        build_element(element, child)
+
+
+def write_element(xf, node, level):
+    # write a (tag, attributes, text, children) tuple with xmlfile,
+    # indented like etree.tostring(pretty_print=True)
+    tag, attrib, text, children = node
+    with xf.element(tag, attrib):
+        if text is not None:
+            xf.write(text)
+        for child in children:
+            xf.write('\n' + '  ' * (level + 1))
+            write_element(xf, child, level + 1)
+        if children:
+            xf.write('\n' + '  ' * level)
+
+
+def drain(out):
+    # return and remove the content written to out so far
+    value = out.getvalue()
+    out.seek(0)
+    out.truncate()
+    return value
+
+
+class PROVXMLRenderer(PROVXMLBaseRenderer):
+
+    prefix = 'voprov'
+
+    reference_list = ['voprov:description', 'voprov:activity', 'voprov:entity',
+            'voprov:agent', 'voprov:influencer', 'voprov:influencee',
+            'voprov:informed', 'voprov:informant', 'voprov:usedEntity',
+            'voprov:generatedEntity', 'voprov:collection', 'voprov:activityFlow',
+            'voprov:activityDescription', 'voprov:entityDescription']
+
+
+class W3CPROVXMLRenderer(PROVXMLBaseRenderer):
+
+    prefix = 'prov'
+
+    reference_list = ['prov:activity', 'prov:entity',
+            'prov:agent', 'prov:influencer', 'prov:influencee',
+            'prov:informed', 'prov:informant', 'prov:usedEntity',
+            'prov:generatedEntity', 'prov:collection',
+            'voprov:activityFlow',
+            'voprov:activityDescription', 'voprov:entityDescription']
+
+    def get_attribute_element(self, attribute, value):
+        if attribute == 'voprov:description':
+            # embed the descriptions here
+            attrib = {}
+            children = []
+            for desc_attribute, desc_value in value.iteritems():
+                if desc_attribute == 'prov:id':  # or if voprov:id
+                    attrib[self.PROV+'id'] = desc_value
+                else:
+                    children.append((self.get_qname(desc_attribute), {}, desc_value, []))
+            return (self.get_qname(attribute), attrib, None, children)
+        return super(W3CPROVXMLRenderer, self).get_attribute_element(attribute, value)
+
 
 class PROVNBaseRenderer(BaseRenderer):
 
@@ -169,9 +325,10 @@ class PROVNBaseRenderer(BaseRenderer):
         for key, val in obj.iteritems():
             attributes += '%s="%s", ' % (key, val)
 
-        # add to string (and remove final comma)
+        # add to string (and remove final comma),
+        # only the final ")" is replaced (values may contain brackets, too)
         if attributes:
-            string = string.replace(")", ", [%s])" % attributes.rstrip(', '))
+            string = string[:-1] + ", [%s])" % attributes.rstrip(', ')
 
         return string
 
@@ -481,80 +638,69 @@ class PROVNRenderer(PROVNBaseRenderer):
     and returns a PROV-N string
     """
 
-    def render(self, data):
-
-        string = "document\n"
-        for p_id, p in data['prefix'].iteritems():
-            string += "prefix %s <%s>\n" % (p_id, p)
-        string += "\n"
-
-        for a_id, a in data['activity'].iteritems():
-            string += ActivityPROVNRenderer().render(a) + "\n"
-
-        if 'activityFlow' in data:
-            for a_id, a in data['activityFlow'].iteritems():
-                string += ActivityFlowPROVNRenderer().render(a) + "\n"
-
-        if 'activityDescription' in data:
-            for a_id, a in data['activityDescription'].iteritems():
-                string += ActivityDescriptionPROVNRenderer().render(a) + "\n"
-
-        if 'parameter' in data:
-            for p_id, p in data['parameter'].iteritems():
-                string += ParameterPROVNRenderer().render(p) + "\n"
-
-        if 'parameterDescription' in data:
-            for h_id, h in data['parameterDescription'].iteritems():
-                string += ParameterDescriptionPROVNRenderer().render(h) + "\n"
-
-        for e_id, e in data['entity'].iteritems():
-            string += EntityPROVNRenderer().render(e) + "\n"
-
-        if 'entityDescription' in data:
-            for a_id, a in data['entityDescription'].iteritems():
-                string += EntityDescriptionPROVNRenderer().render(a) + "\n"
-
-        for a_id, a in data['agent'].iteritems():
-            string += AgentPROVNRenderer().render(a) + "\n"
-
-        for u_id, u in data['used'].iteritems():
-            string += UsedPROVNRenderer().render(u) + "\n"
-
-        if 'usedDescription' in data:
-            for u_id, u in data['usedDescription'].iteritems():
-                string += UsedDescriptionPROVNRenderer().render(u) + "\n"
+    # sections in the order of the PROV-N document, with the renderer
+    # for their statements (renderers are stateless, thus shared)
+    sections = [
+        ('activity', ActivityPROVNRenderer()),
+        ('activityFlow', ActivityFlowPROVNRenderer()),
+        ('activityDescription', ActivityDescriptionPROVNRenderer()),
+        ('parameter', ParameterPROVNRenderer()),
+        ('parameterDescription', ParameterDescriptionPROVNRenderer()),
+        ('entity', EntityPROVNRenderer()),
+        ('entityDescription', EntityDescriptionPROVNRenderer()),
+        ('agent', AgentPROVNRenderer()),
+        ('used', UsedPROVNRenderer()),
+        ('usedDescription', UsedDescriptionPROVNRenderer()),
+        ('wasGeneratedBy', WasGeneratedByPROVNRenderer()),
+        ('wasGeneratedByDescription', WasGeneratedByDescriptionPROVNRenderer()),
+        ('wasAssociatedWith', WasAssociatedWithPROVNRenderer()),
+        ('wasAttributedTo', WasAttributedToPROVNRenderer()),
+        ('hadMember', HadMemberPROVNRenderer()),
+        ('wasDerivedFrom', WasDerivedFromPROVNRenderer()),
+        ('hadStep', HadStepPROVNRenderer()),
+        ('wasInformedBy', WasInformedByPROVNRenderer()),
+        ('wasInfluencedBy', WasInfluencedByPROVNRenderer()),
+    ]
 
-        for w_id, w in data['wasGeneratedBy'].iteritems():
-            string += WasGeneratedByPROVNRenderer().render(w) + "\n"
-
-        if 'wasGeneratedByDescription' in data:
-            for w_id, w in data['wasGeneratedByDescription'].iteritems():
-                string += WasGeneratedByDescriptionPROVNRenderer().render(w) + "\n"
-
-        for w_id, w in data['wasAssociatedWith'].iteritems():
-            string += WasAssociatedWithPROVNRenderer().render(w) + "\n"
-
-        for w_id, w in data['wasAttributedTo'].iteritems():
-            string += WasAttributedToPROVNRenderer().render(w) + "\n"
-
-        for h_id, h in data['hadMember'].iteritems():
-            string += HadMemberPROVNRenderer().render(h) + "\n"
-
-        for w_id, w in data['wasDerivedFrom'].iteritems():
-            string += WasDerivedFromPROVNRenderer().render(w) + "\n"
-
-        if 'hadStep' in data:
-            for h_id, h in data['hadStep'].iteritems():
-                string += HadStepPROVNRenderer().render(h) + "\n"
-
-        if 'wasInformedBy' in data:
-            for w_id, w in data['wasInformedBy'].iteritems():
-                string += WasInformedByPROVNRenderer().render(w) + "\n"
-
-        if 'wasInfluencedBy' in data:
-            for w_id, w in data['wasInfluencedBy'].iteritems():
-                string += WasInfluencedByPROVNRenderer().render(w) + "\n"
-
-        string += "endDocument"
-
-        return string
+    def render(self, data):
+        return "".join(self.iter_lines(data.get))
+
+    def render_stream(self, serializer, chunk_size=65536):
+        """
+        Yield the same document as render(serializer.data) in chunks of
+        about chunk_size characters; each section is serialized only
+        when it is reached.
+        """
+        return join_chunks(self.iter_lines(lambda key: get_section(serializer, key)), chunk_size)
+
+    def render_sections(self, sections, chunk_size=65536):
+        """
+        Like render_stream, for sections given as ordered dictionary of
+        section name and an object with itervalues() (see export.py).
+        """
+        return join_chunks(self.iter_lines(sections.get), chunk_size)
+
+    def iter_lines(self, get_section_data):
+        # yield the document line by line (one statement per line);
+        # get_section_data returns the serialized data for a section key
+        # (or None, if it does not exist)
+        yield "document\n"
+        for p_id, p in get_section_data('prefix').iteritems():
+            yield "prefix %s <%s>\n" % (p_id, p)
+        yield "\n"
+
+        for key, renderer in self.sections:
+            section = get_section_data(key)
+            if section is not None:
+                for obj in section.itervalues():
+                    yield renderer.render(obj) + "\n"
+
+        yield "endDocument"
+
+
+def get_section(serializer, name):
+    # serialize one section of a provenance serializer (None if it has no such section)
+    field = serializer.fields.get(name)
+    if field is None:
+        return None
+    return field.to_representation(field.get_attribute(serializer.instance))
@@ -0,0 +1,216 @@
+"""
+Instrumentation of the provdal requests, enabled with
+PROV_VO_CONFIG['request_stats']. Each phase of a request
+
+    resolve         finding the nodes for the given ids
+    traversal       following the relations and loading nodes and relations
+    descriptions    loading the descriptions of nodes and relations
+    serialization   converting the provenance record for the model
+    rendering       writing the response body in the requested format
+
+is measured separately: number of SQL queries, time spent in the
+database and wall time, plus the number of nodes and relations found
+per type. The measurements are returned in the Server-Timing header,
+e.g.
+
+    Server-Timing: resolve;dur=0.81;desc="3 queries in 0.42 ms", ..., total;dur=12.30
+
+and written as one log line (JSON) per request to the logger
+prov_vo.stats, with the complete measurements also in the attribute
+prov_stats of the log record. With PROV_VO_CONFIG['request_stats_header']
+they are also returned as JSON in the X-Prov-Stats header.
+
+Large records are streamed: they are serialized and rendered (and
+compressed) while the response is sent, after the headers. For these,
+the phase streaming takes the place of serialization and rendering. It
+is only contained in the log line, which is written at the end of the
+stream; the headers list it without duration. Cached responses only
+have the total time.
+
+Queries are counted by logging them (as with settings.DEBUG) while a
+phase is running. When switched off, the views get NO_STATS, whose
+phases do nothing.
+"""
+import json
+import logging
+import time
+from collections import OrderedDict, deque
+
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from .utils import get_config
+
+logger = logging.getLogger('prov_vo.stats')
+
+NODE_KEYS = ['activity', 'activityFlow', 'entity', 'collection', 'agent']
+RELATION_KEYS = [
+    'used', 'wasGeneratedBy', 'wasAssociatedWith', 'wasAttributedTo', 'hadMember',
+    'wasDerivedFrom', 'wasInfluencedBy', 'hadStep', 'wasInformedBy'
+]
+
+
+def request_stats_enabled():
+    return bool(get_config('request_stats', False))
+
+
+def get_request_stats(using=DEFAULT_DB_ALIAS):
+    """
+    Return a new RequestStats for a request, or NO_STATS if the
+    instrumentation is switched off.
+    """
+    if request_stats_enabled():
+        return RequestStats(using)
+    return NO_STATS
+
+
+class Phase(object):
+    """
+    Context manager measuring one phase of a request: the queries are
+    logged in a separate queries_log of the connection and added to the
+    original one afterwards (if it is used at all).
+    """
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        connection = self.stats.connection
+        self.queries_log = connection.queries_log
+        self.queries_logged = connection.queries_logged
+        self.force_debug_cursor = connection.force_debug_cursor
+        connection.queries_log = deque()
+        connection.force_debug_cursor = True
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall_time = time.time() - self.start
+        connection = self.stats.connection
+        queries = connection.queries_log
+        connection.queries_log = self.queries_log
+        connection.force_debug_cursor = self.force_debug_cursor
+        if self.queries_logged:
+            self.queries_log.extend(queries)
+        self.stats.add_phase(self.name, len(queries),
+            sum(float(query['time']) for query in queries), wall_time)
+        return False
+
+
+class RequestStats(object):
+    """
+    The measurements of one request: phase name -> number of queries,
+    database time and wall time (seconds), and the number of nodes and
+    relations per type.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.connection = connections[using]
+        self.start = time.time()
+        self.phases = OrderedDict()
+        self.nodes = {}
+        self.relations = {}
+
+    def phase(self, name):
+        return Phase(self, name)
+
+    def add_phase(self, name, queries, db_time, wall_time):
+        # a phase can run more than once, e.g. per section
+        phase = self.phases.setdefault(name, [0, 0.0, 0.0])
+        phase[0] += queries
+        phase[1] += db_time
+        phase[2] += wall_time
+
+    def count(self, prov):
+        # the number of nodes and relations in the provenance record
+        self.nodes = dict((key, len(prov[key])) for key in NODE_KEYS if prov.get(key))
+        self.relations = dict((key, len(prov[key])) for key in RELATION_KEYS if prov.get(key))
+
+    def get_data(self):
+        # all measurements until now, times in milliseconds
+        total = time.time() - self.start
+        return OrderedDict([
+            ('phases', [OrderedDict([
+                ('name', name),
+                ('queries', queries),
+                ('db_time', round(db_time * 1000, 2)),
+                ('wall_time', round(wall_time * 1000, 2))
+            ]) for name, (queries, db_time, wall_time) in self.phases.iteritems()]),
+            ('queries', sum(phase[0] for phase in self.phases.itervalues())),
+            ('total', round(total * 1000, 2)),
+            ('nodes', self.nodes),
+            ('relations', self.relations),
+        ])
+
+    def finish(self, request, response):
+        """
+        Add the headers with the measurements to the response and write
+        the log line, for streamed responses at the end of the stream.
+        Returns the response.
+        """
+        data = self.get_data()
+        metrics = ['%s;dur=%.2f;desc="%d queries in %.2f ms"' % (
+            phase['name'], phase['wall_time'], phase['queries'], phase['db_time'])
+            for phase in data['phases']]
+        if response.streaming:
+            data['streaming'] = "measured in the log"
+            metrics.append('streaming;desc="measured in the log"')
+        metrics.append('total;dur=%.2f' % data['total'])
+        response['Server-Timing'] = ', '.join(metrics)
+        if get_config('request_stats_header', False):
+            response['X-Prov-Stats'] = json.dumps(data, separators=(',', ':'))
+
+        if response.streaming:
+            response.streaming_content = self.iter_streaming(response.streaming_content,
+                request.get_full_path(), response.status_code)
+        else:
+            self.log(request.get_full_path(), response.status_code)
+        return response
+
+    def iter_streaming(self, content, path, status):
+        # measure producing each chunk of a streamed response
+        iterator = iter(content)
+        try:
+            while True:
+                with self.phase('streaming'):
+                    try:
+                        chunk = next(iterator)
+                    except StopIteration:
+                        return
+                yield chunk
+        finally:
+            self.log(path, status)
+
+    def log(self, path, status):
+        data = self.get_data()
+        data['path'] = path
+        data['status'] = status
+        logger.info("provdal %s", json.dumps(data, separators=(',', ':')), extra={'prov_stats': data})
+
+
+class NoPhase(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class NoStats(object):
+    """
+    Stand-in for RequestStats if the instrumentation is switched off.
+    """
+
+    def phase(self, name):
+        return NO_PHASE
+
+    def count(self, prov):
+        pass
+
+    def finish(self, request, response):
+        return response
+
+
+NO_PHASE = NoPhase()
+NO_STATS = NoStats()
@@ -0,0 +1,179 @@
+"""
+Cache for provdal responses, using Django's cache framework.
+
+Enabled with PROV_VO_CONFIG['response_cache'] = <cache alias> (one of
+the CACHES in the settings, e.g. a locmem, file or database cache).
+Responses are stored under a hash of the normalised request parameters
+and the current provenance generation. The generation is a counter in
+the same cache, which is increased whenever a provenance object is
+saved or deleted (see signals.py), so all cached responses become
+invalid at once. Bulk changes (bulk_create, queryset updates) send no
+signals, call bump_generation() after them.
+
+The generation and the hash are also used as ETag (with the content
+encoding appended), requests with a matching If-None-Match header get a
+304 (Not Modified) response. The responses are stored compressed, one
+body per content encoding requested, see compression.py.
+"""
+import hashlib
+import time
+import urllib
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, quote_etag, parse_etags
+
+from .utils import get_config
+from . import compression
+
+GENERATION_KEY = 'prov_vo:generation'
+MODIFIED_KEY = 'prov_vo:modified'
+RESPONSE_KEY = 'prov_vo:response:%s'
+
+
+def get_response_cache():
+    # the configured cache, or None if responses are not cached
+    alias = get_config('response_cache', None)
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def get_generation(cache):
+    """
+    Return the current provenance generation and the time of the last
+    change. If the counter is missing (first use, or evicted from the
+    cache), it restarts at the current time in milliseconds, so that
+    responses cached for an earlier generation are never used again.
+    """
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        now = time.time()
+        cache.add(GENERATION_KEY, int(now * 1000), timeout=None)
+        cache.add(MODIFIED_KEY, now, timeout=None)
+        generation = cache.get(GENERATION_KEY, int(now * 1000))
+    modified = cache.get(MODIFIED_KEY) or time.time()
+    return generation, modified
+
+
+def get_shared_generation():
+    """
+    Return the current provenance generation, shared by all processes
+    using the response cache, or None if no response cache is
+    configured. Process-wide caches (see closurecache.py) compare it
+    with the generation they were filled for, to notice changes made
+    by other processes.
+    """
+    cache = get_response_cache()
+    if cache is None:
+        return None
+    return get_generation(cache)[0]
+
+
+def bump_generation():
+    # invalidate all cached responses, return the new generation (or None)
+    cache = get_response_cache()
+    if cache is None:
+        return None
+    try:
+        generation = cache.incr(GENERATION_KEY)
+    except ValueError:
+        # no generation yet, it is created on next use
+        generation = None
+    cache.set(MODIFIED_KEY, time.time(), timeout=None)
+    return generation
+
+
+def get_response_key(generation, digest):
+    # the cache key of a response
+    return RESPONSE_KEY % ("%s-%s" % (generation, digest))
+
+
+def get_params_digest(id_list, countdown, model, format, flags, **options):
+    """
+    Hash of the normalised provdal parameters: ids sorted (and each id
+    only once), the depth as countdown (-1 for ALL), the flags
+    (including direction) and further options (e.g. pretty) as parsed
+    by the view, so that equivalent requests share the cached response.
+    """
+    params = [('ID', i) for i in sorted(set(id_list))]
+    params += [
+        ('DEPTH', countdown),
+        ('MODEL', model),
+        ('RESPONSEFORMAT', format),
+    ]
+    params += [(key.upper(), flags[key]) for key in sorted(flags)]
+    params += [(key.upper(), options[key]) for key in sorted(options)]
+    params = [(key, unicode(value).encode('utf-8')) for key, value in params]
+    return hashlib.md5(urllib.urlencode(params)).hexdigest()
+
+
+def cached_response(request, digest, make_response):
+    """
+    Return the cached response for the given parameter digest, or
+    create it with make_response() and store it in the cache.
+    The response is encoded as negotiated with the request (see
+    compression.py) and stored encoded, together with the other
+    encodings already requested. Streaming responses and errors are not
+    stored. Successful responses get ETag and Last-Modified headers.
+    """
+    encoding = compression.get_encoding(request)
+    cache = get_response_cache()
+    if cache is None:
+        return compression.encode_response(make_response(), encoding)
+
+    generation, modified = get_generation(cache)
+    # each encoding is a different representation, with its own ETag
+    etag = quote_etag("%s-%s%s" % (generation, digest,
+        '' if encoding == compression.IDENTITY else '-' + encoding))
+
+    # weak comparison, as required for If-None-Match
+    etags = [e[2:] if e.startswith('W/') else e
+        for e in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))]
+    if etag in etags or '*' in etags:
+        response = HttpResponseNotModified()
+        if compression.compression_enabled():
+            patch_vary_headers(response, ('Accept-Encoding',))
+    else:
+        key = get_response_key(generation, digest)
+        cached = cache.get(key)
+        if cached is not None:
+            content_type, bodies = cached
+            if encoding not in bodies:
+                # encode the content once more, from any stored encoding
+                content, content_encoding = bodies.values()[0]
+                content = compression.decompress(content, content_encoding or compression.IDENTITY)
+                response = compression.encode_response(HttpResponse(content, content_type=content_type), encoding)
+                store_body(cache, key, content_type, bodies, encoding, response)
+            response = get_body_response(content_type, bodies[encoding])
+        else:
+            response = compression.encode_response(make_response(), encoding)
+            if response.status_code != 200:
+                return response
+            if not response.streaming:
+                store_body(cache, key, response['Content-Type'], {}, encoding, response)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(modified)
+    return response
+
+
+def store_body(cache, key, content_type, bodies, encoding, response):
+    # add the body of the response for this encoding to the cached bodies
+    bodies[encoding] = (response.content, response.get('Content-Encoding'))
+    timeout = get_config('response_cache_timeout', DEFAULT_TIMEOUT)
+    cache.set(key, (content_type, bodies), timeout)
+
+
+def get_body_response(content_type, body):
+    # the response for a cached (content, Content-Encoding header) pair
+    content, content_encoding = body
+    response = HttpResponse(content, content_type=content_type)
+    if content_encoding:
+        response['Content-Encoding'] = content_encoding
+        response['Content-Length'] = str(len(content))
+    if compression.compression_enabled():
+        patch_vary_headers(response, ('Accept-Encoding',))
+    return response
@@ -0,0 +1,337 @@
+"""
+Provenance tracking and loading with values() rows instead of model
+instances, enabled with PROV_VO_CONFIG['row_traversal'] = True.
+
+The traversal only fetches ids (values_list), the resulting nodes,
+relations and descriptions are then loaded as dictionaries containing
+just the fields needed by the IVOA serializers, which serialize them
+with CompiledSerializer.row_to_representation. So no model instances
+are created at all. The W3C serializers need model instances (method
+fields), thus MODEL=W3C always uses the model traversal.
+"""
+from .models import Activity
+from .serializers import (
+    get_compiled_serializer,
+    VOActivitySerializer,
+    VOActivityFlowSerializer,
+    VOActivityDescriptionSerializer,
+    VOEntitySerializer,
+    VOEntityDescriptionSerializer,
+    VOAgentSerializer,
+    VOParameterSerializer,
+    VOParameterDescriptionSerializer,
+    VOUsedSerializer,
+    VOUsedDescriptionSerializer,
+    VOWasGeneratedBySerializer,
+    VOWasGeneratedByDescriptionSerializer,
+    VOWasAssociatedWithSerializer,
+    VOWasAttributedToSerializer,
+    VOHadMemberSerializer,
+    VOWasDerivedFromSerializer,
+    VOHadStepSerializer,
+    VOWasInformedBySerializer,
+)
+from .utils import (
+    get_config, get_traversal_steps, chunks, activity_kind_cache, resolve_ids,
+    RELATION_MODELS, NODE_MODELS
+)
+from . import cte, graphindex, closurecache, lineage
+
+NODE_KINDS = ['entity', 'activity', 'agent']
+
+# serializer for each section of prov, defines the fields of the rows
+ROW_SERIALIZERS = {
+    'activity': VOActivitySerializer,
+    'activityFlow': VOActivityFlowSerializer,
+    'entity': VOEntitySerializer,
+    'agent': VOAgentSerializer,
+    'used': VOUsedSerializer,
+    'wasGeneratedBy': VOWasGeneratedBySerializer,
+    'wasAssociatedWith': VOWasAssociatedWithSerializer,
+    'wasAttributedTo': VOWasAttributedToSerializer,
+    'hadMember': VOHadMemberSerializer,
+    'wasDerivedFrom': VOWasDerivedFromSerializer,
+    'hadStep': VOHadStepSerializer,
+    'wasInformedBy': VOWasInformedBySerializer,
+    'parameter': VOParameterSerializer,
+    'activityDescription': VOActivityDescriptionSerializer,
+    'entityDescription': VOEntityDescriptionSerializer,
+    'parameterDescription': VOParameterDescriptionSerializer,
+    'usedDescription': VOUsedDescriptionSerializer,
+    'wasGeneratedByDescription': VOWasGeneratedByDescriptionSerializer,
+}
+
+# sections whose descriptions are added to prov (as in views.provdal)
+DESCRIBED_KEYS = ['entity', 'activity', 'used', 'wasGeneratedBy', 'parameter']
+
+
+def row_traversal_enabled():
+    # only if all sections can be serialized as rows, otherwise the
+    # model traversal is used
+    return get_config('row_traversal', False) and all(
+        get_compiled_serializer(serializer_class).supports_rows
+        for serializer_class in ROW_SERIALIZERS.itervalues())
+
+
+def get_row_fields(key):
+    # fields to be selected with values() for the given section
+    fields = ['id']
+    for field in get_compiled_serializer(ROW_SERIALIZERS[key]).values_fields():
+        if field not in fields:
+            fields.append(field)
+    return fields
+
+
+def track_provenance_ids(entity_ids=(), activity_ids=(), agent_ids=(), countdown=-1,
+        direction='BACK', members_flag=False, steps_flag=False, agent_flag=False):
+    """
+    Breadth-first traversal like utils.track_provenance, but only the
+    ids of the relations and the next nodes are fetched (values_list).
+    Returns the ids of all nodes (dictionary of sets per node kind) and
+    relations (dictionary of sets per relation key, including
+    'parameter'), including the start nodes.
+    """
+    steps = get_traversal_steps(direction=direction,
+        members_flag=members_flag,
+        steps_flag=steps_flag,
+        agent_flag=agent_flag)
+
+    node_ids = {
+        'entity': set(entity_ids),
+        'activity': set(activity_ids),
+        'agent': set(agent_ids)
+    }
+    relation_ids = dict((key, set()) for key in RELATION_MODELS)
+
+    frontier = dict((kind, set(node_ids[kind])) for kind in NODE_KINDS)
+    if not agent_flag:
+        frontier['agent'] = set()
+
+    while countdown != 0 and any(frontier.values()):
+        countdown -= 1
+        found = dict((kind, set()) for kind in NODE_KINDS)
+
+        # parameters of the activities that are followed further
+        for chunk in chunks(frontier['activity']):
+            relation_ids['parameter'].update(
+                RELATION_MODELS['parameter'].objects.filter(activity__in=chunk).values_list('id', flat=True)
+            )
+
+        for kind in NODE_KINDS:
+            for step in steps[kind]:
+                for chunk in chunks(frontier[kind]):
+                    queryset = step.model.objects.filter(**{step.near + '__in': chunk})
+                    for rel_id, next_id in queryset.values_list('id', step.far):
+                        relation_ids[step.key].add(rel_id)
+                        if next_id is not None and next_id not in node_ids[step.far_kind]:
+                            found[step.far_kind].add(next_id)
+
+        for kind in NODE_KINDS:
+            node_ids[kind].update(found[kind])
+
+        # do not follow agents further, unless flag is set
+        if not agent_flag:
+            found['agent'] = set()
+        frontier = found
+
+    return node_ids, relation_ids
+
+
+def track_node_sets(id_list, countdown=-1,
+        direction='BACK', members_flag=False, steps_flag=False, agent_flag=False):
+    """
+    Find the nodes in the provenance of each of the given ids, with one
+    breadth-first traversal from all start nodes at once: each node
+    carries the set of start ids it was reached from, and only the
+    start ids that are new for the next node are passed on. So each
+    node is expanded at most once per level, and for each start id at
+    its shortest distance, as in track_provenance_ids.
+    Returns a dictionary start id -> node ids (set per node kind),
+    including the start node itself; unknown ids get empty sets.
+    """
+    steps = get_traversal_steps(direction=direction,
+        members_flag=members_flag,
+        steps_flag=steps_flag,
+        agent_flag=agent_flag)
+
+    # node id -> start ids, per node kind
+    reached = dict((kind, {}) for kind in NODE_KINDS)
+    for kind, ids in zip(NODE_KINDS, resolve_ids(id_list)):
+        for node_id in ids:
+            reached[kind][node_id] = set([node_id])
+
+    frontier = dict((kind, dict(reached[kind])) for kind in NODE_KINDS)
+    if not agent_flag:
+        frontier['agent'] = {}
+
+    while countdown != 0 and any(frontier.values()):
+        countdown -= 1
+        found = dict((kind, {}) for kind in NODE_KINDS)
+
+        for kind in NODE_KINDS:
+            for step in steps[kind]:
+                far_reached = reached[step.far_kind]
+                for chunk in chunks(frontier[kind]):
+                    queryset = step.model.objects.filter(**{step.near + '__in': chunk})
+                    for near_id, far_id in queryset.values_list(step.near, step.far):
+                        if far_id is None:
+                            continue
+                        sources = frontier[kind][near_id].difference(far_reached.get(far_id, ()))
+                        if sources:
+                            found[step.far_kind].setdefault(far_id, set()).update(sources)
+
+        for kind in NODE_KINDS:
+            for node_id, sources in found[kind].iteritems():
+                reached[kind].setdefault(node_id, set()).update(sources)
+
+        # do not follow agents further, unless flag is set
+        if not agent_flag:
+            found['agent'] = {}
+        frontier = found
+
+    node_sets = dict((i, dict((kind, set()) for kind in NODE_KINDS)) for i in id_list)
+    for kind in NODE_KINDS:
+        for node_id, sources in reached[kind].iteritems():
+            for source in sources:
+                node_sets[source][kind].add(node_id)
+    return node_sets
+
+
+# Ways of finding the provenance, see choose_traversal
+CLOSURE_CACHE = 'closure cache'
+GRAPH_INDEX = 'graph index'
+LINEAGE_TABLE = 'lineage table'
+RECURSIVE_CTE = 'recursive query'
+BREADTH_FIRST = 'breadth-first'
+
+
+def choose_traversal(num_start_nodes, countdown, closure_cache=True):
+    """
+    Return the way of finding the provenance of the given number of start
+    nodes, for find_provenance_ids as well as views.find_provenance.
+    With the closure cache (only for DEPTH=ALL and if closure_cache is
+    True), DEPTH=ALL is put together from the cached provenance of the
+    single start nodes. If the in-memory graph index is enabled, the
+    traversal is done there; with the lineage table, the ancestors along
+    the lineage relations are looked up there. Otherwise the complete
+    provenance (DEPTH=ALL) is retrieved with one recursive query, if the
+    database supports it (and it is not switched off in the settings),
+    or the relations are followed level by level.
+    """
+    if closure_cache and countdown == -1 and closurecache.closure_cache_enabled():
+        return CLOSURE_CACHE
+    if graphindex.graph_index_enabled():
+        return GRAPH_INDEX
+    if lineage.lineage_enabled():
+        return LINEAGE_TABLE
+    if countdown == -1 and get_config('recursive_cte', True)\
+            and cte.can_track_provenance_cte(num_start_nodes):
+        return RECURSIVE_CTE
+    return BREADTH_FIRST
+
+
+def find_provenance_ids(entity_ids, activity_ids, agent_ids, countdown, **flags):
+    # the complete provenance of each start node may be cached
+    num_start_nodes = len(entity_ids) + len(activity_ids) + len(agent_ids)
+    if choose_traversal(num_start_nodes, countdown) == CLOSURE_CACHE:
+        def track_ids(entity_ids, activity_ids, agent_ids):
+            return search_provenance_ids(entity_ids, activity_ids, agent_ids, countdown, **flags)
+        return closurecache.get_closure_ids(entity_ids, activity_ids, agent_ids, track_ids, **flags)
+
+    return search_provenance_ids(entity_ids, activity_ids, agent_ids, countdown, **flags)
+
+
+def search_provenance_ids(entity_ids, activity_ids, agent_ids, countdown, **flags):
+    # find the provenance ids without the closure cache
+    num_start_nodes = len(entity_ids) + len(activity_ids) + len(agent_ids)
+    traversal = choose_traversal(num_start_nodes, countdown, closure_cache=False)
+
+    if traversal == GRAPH_INDEX:
+        return graphindex.get_graph_index().track(
+            entity_ids, activity_ids, agent_ids, countdown, **flags)
+
+    if traversal == LINEAGE_TABLE:
+        return lineage.track_provenance_ids(entity_ids, activity_ids, agent_ids, countdown, **flags)
+
+    if traversal == RECURSIVE_CTE:
+        node_ids, relation_ids = cte.get_provenance_ids_cte(entity_ids, activity_ids, agent_ids, **flags)
+        # the start nodes are part of the result in any case
+        for kind, ids in zip(NODE_KINDS, [entity_ids, activity_ids, agent_ids]):
+            node_ids[kind].update(ids)
+        return node_ids, relation_ids
+
+    return track_provenance_ids(entity_ids, activity_ids, agent_ids, countdown, **flags)
+
+
+def add_rows(prov, key, model, ids):
+    # load the rows with the given ids and store them in prov[key]
+    fields = get_row_fields(key)
+    for chunk in chunks(ids):
+        for row in model.objects.filter(id__in=chunk).values(*fields):
+            prov[key][row['id']] = row
+    return prov
+
+
+def add_node_rows(prov, kind, ids):
+    """
+    Load the rows of the nodes of the given kind and store them in prov.
+    Activities are stored as 'activity' or 'activityFlow', depending on
+    the (reverse one-to-one) link to the activityflow table, which is
+    fetched in the same query.
+    """
+    if kind != 'activity':
+        return add_rows(prov, kind, NODE_MODELS[kind], ids)
+
+    fields = get_row_fields('activity') + ['activityflow']
+    for chunk in chunks(ids):
+        for row in Activity.objects.filter(id__in=chunk).values(*fields):
+            if row.pop('activityflow') is not None:
+                activity_type = 'activityFlow'
+            else:
+                activity_type = 'activity'
+            prov[activity_type][row['id']] = row
+            activity_kind_cache.set(row['id'], activity_type)
+
+    return prov
+
+
+def fill_provenance_rows(prov, node_ids, relation_ids):
+    """
+    Load nodes, relations and their descriptions with the given ids as
+    rows and store them in prov; same arguments as utils.fill_provenance.
+    """
+    prov = add_graph_rows(prov, node_ids, relation_ids)
+    return add_description_rows(prov)
+
+
+def add_graph_rows(prov, node_ids, relation_ids):
+    # the nodes and relations only, without their descriptions
+    for kind in NODE_KINDS:
+        prov = add_node_rows(prov, kind, node_ids.get(kind, []))
+
+    for key, ids in relation_ids.iteritems():
+        prov = add_rows(prov, key, RELATION_MODELS[key], ids)
+    return prov
+
+
+def add_description_rows(prov):
+    # the rows contain the description ids, load these descriptions as well
+    for key in DESCRIBED_KEYS:
+        ids = set(row['description'] for row in prov[key].itervalues())
+        ids.discard(None)
+        model = RELATION_MODELS.get(key, NODE_MODELS.get(key))
+        description_model = model._meta.get_field('description').related_model
+        prov = add_rows(prov, key + 'Description', description_model, ids)
+
+    return prov
+
+
+def track_provenance_rows(prov, id_list, countdown, **flags):
+    """
+    Find the provenance of the nodes with the given ids (entities,
+    activities or agents) and store all nodes, relations and
+    descriptions as rows in prov.
+    """
+    entity_ids, activity_ids, agent_ids = resolve_ids(id_list)
+    node_ids, relation_ids = find_provenance_ids(entity_ids, activity_ids, agent_ids, countdown, **flags)
+    return fill_provenance_rows(prov, node_ids, relation_ids)
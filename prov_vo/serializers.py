@@ -1,10 +1,14 @@
 from collections import OrderedDict
 
 from rest_framework import serializers
-from rest_framework.fields import SkipField, empty
+from rest_framework.fields import SkipField, empty, is_simple_callable
 from rest_framework.relations import PKOnlyObject
+from rest_framework.utils.serializer_helpers import ReturnDict
+
+from rest_framework.settings import api_settings
 
 from django.db.models import Max
+from django.core.exceptions import ObjectDoesNotExist
 
 from .models import (
     Activity,
@@ -27,6 +31,7 @@ from .models import (
     UsedDescription,
     WasGeneratedByDescription
 )
+from .utils import get_config, chunks, bulk_create_objects, bulk_update_objects
 
 # Define custom CharField to add attribute custom_field_name
 class CustomCharField(serializers.CharField):
@@ -38,6 +43,11 @@ class CustomCharField(serializers.CharField):
         self.min_length = kwargs.pop('min_length', None)
 
         self.custom_field_name = kwargs.pop('custom_field_name', None)
+        # all attributes are optional when writing, as in the models,
+        # except for the primary key (e.g. prov_id)
+        if not kwargs.get('read_only', False) and kwargs.get('source') not in ['id', 'pk']:
+            kwargs.setdefault('required', False)
+            kwargs.setdefault('allow_null', True)
 
         super(CustomCharField, self).__init__(**kwargs)
         if self.max_length is not None:
@@ -59,6 +69,9 @@ class CustomDateTimeField(serializers.DateTimeField):
         if default_timezone is not None:
             self.timezone = default_timezone
         self.custom_field_name = kwargs.pop('custom_field_name', None)
+        if not kwargs.get('read_only', False) and kwargs.get('source') not in ['id', 'pk']:
+            kwargs.setdefault('required', False)
+            kwargs.setdefault('allow_null', True)
         super(CustomDateTimeField, self).__init__(*args, **kwargs)
 
 
@@ -72,9 +85,111 @@ class CustomSerializerMethodField(serializers.SerializerMethodField):
         super(CustomSerializerMethodField, self).__init__(**kwargs)
 
 
+# PrimaryKeyRelatedField that can use the ids checked for a whole list
+class PrefetchedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+
+    def to_internal_value(self, data):
+        # BulkListSerializer puts the existing ids per model into the
+        # context, so that no query per object is needed
+        model = self.get_queryset().model
+        existing = self.context.get('existing_ids', {}).get(model)
+        if existing is None:
+            return super(PrefetchedPrimaryKeyRelatedField, self).to_internal_value(data)
+        pk = model._meta.pk.to_python(data)
+        if pk not in existing:
+            self.fail('does_not_exist', pk_value=data)
+        return model(pk=pk)
+
+
+def get_foreign_key(model, source):
+    # the foreign key of the model set by a field with the given source
+    # (name or attname, e.g. activity or activity_id), or None
+    for model_field in model._meta.concrete_fields:
+        if model_field.many_to_one and source in [model_field.name, model_field.attname]:
+            return model_field
+    return None
+
+
 # Define custom serializer class with some modifications
 class NonNullCustomSerializer(serializers.ModelSerializer):
 
+    serializer_related_field = PrefetchedPrimaryKeyRelatedField
+
+    def get_output_names(self):
+        # field name -> (qualified) name used in the output, e.g. prov:id
+        names = {}
+        for field in self.fields.values():
+            custom_field_name = getattr(field, 'custom_field_name', None)
+            names[field.field_name] = custom_field_name or field.field_name
+        return names
+
+    def get_input_value(self, data, field):
+        # value of the field in the input, given by field or output name
+        custom_field_name = getattr(field, 'custom_field_name', None)
+        if field.field_name not in data and custom_field_name in data:
+            return data[custom_field_name]
+        return data.get(field.field_name)
+
+    def get_id_foreign_keys(self):
+        """
+        Return (serializer field, model foreign key) for the writable
+        fields that are no related fields, but set a foreign key by id,
+        e.g. prov_activity with source activity_id. Their values are
+        checked in to_internal_value.
+        """
+        model = self.Meta.model
+        foreign_keys = []
+        for field in self._writable_fields:
+            if isinstance(field, serializers.RelatedField):
+                continue
+            model_field = get_foreign_key(model, field.source)
+            if model_field is not None:
+                foreign_keys.append((field, model_field))
+        return foreign_keys
+
+    def to_internal_value(self, data):
+        """
+        Accept the output names (e.g. prov:id) as well as the field names
+        (prov_id) in the input, and report errors with the output names.
+        Foreign keys given by id must exist; the ids of the referenced
+        objects are taken from the context, if BulkListSerializer has
+        looked them up, otherwise they are queried.
+        """
+        names = self.get_output_names()
+        if isinstance(data, dict):
+            data = dict(data)
+            for field_name, output_name in names.iteritems():
+                if output_name != field_name and output_name in data and field_name not in data:
+                    data[field_name] = data.pop(output_name)
+
+        errors = {}
+        try:
+            attrs = super(NonNullCustomSerializer, self).to_internal_value(data)
+        except serializers.ValidationError as exc:
+            errors = exc.detail
+            attrs = {}
+
+        existing_ids = self.context.get('existing_ids', {})
+        for field, model_field in self.get_id_foreign_keys():
+            if field.source not in attrs or field.field_name in errors:
+                continue
+            value = attrs.pop(field.source)
+            model = model_field.related_model
+            if value is not None:
+                pk = model._meta.pk.to_python(value)
+                if model in existing_ids:
+                    found = pk in existing_ids[model]
+                else:
+                    found = model._base_manager.filter(pk=pk).exists()
+                if not found:
+                    errors[field.field_name] = [PrefetchedPrimaryKeyRelatedField.default_error_messages['does_not_exist'].format(pk_value=value)]
+                    continue
+            attrs[model_field.attname] = value
+
+        if errors:
+            raise serializers.ValidationError(dict((names.get(key, key), value) for key, value in errors.iteritems()))
+        return attrs
+
     def to_representation(self, instance):
         """
         Object instance -> Dict of primitive datatypes.
@@ -130,6 +245,255 @@ class NonNullCustomSerializer(serializers.ModelSerializer):
 
         return ret
 
+
+class BulkListSerializer(serializers.ListSerializer):
+    """
+    ListSerializer for creating or updating many objects at once, used by
+    views.BulkModelViewSet. The ids referenced by all objects are looked
+    up with one id__in query per model (and chunk) before the objects are
+    validated, and the objects are written with utils.bulk_create_objects
+    or utils.bulk_update_objects. Objects are updated by their ids. As for
+    ListSerializer, errors are returned as a list with one entry (maybe
+    empty) per object. Saving sends no signals, see signals.py.
+    """
+
+    def get_pk_field(self):
+        # the serializer field of the primary key, e.g. prov_id
+        for field in self.child._writable_fields:
+            if field.source in ['id', 'pk']:
+                return field
+        return None
+
+    def get_existing_ids(self, model, ids):
+        existing = set()
+        for chunk in chunks(set(ids)):
+            existing.update(model._base_manager.filter(pk__in=chunk).values_list('pk', flat=True))
+        return existing
+
+    def find_existing_ids(self, data):
+        # ids referenced by the objects that exist, per model
+        child = self.child
+        model = child.Meta.model
+        references = {}
+        for field in child._writable_fields:
+            if isinstance(field, serializers.RelatedField):
+                related_model = field.get_queryset().model
+            else:
+                model_field = get_foreign_key(model, field.source)
+                if model_field is None:
+                    continue
+                related_model = model_field.related_model
+            ids = references.setdefault(related_model, set())
+            for item in data:
+                value = child.get_input_value(item, field)
+                if value is not None and not isinstance(value, (dict, list)):
+                    ids.add(related_model._meta.pk.to_python(value))
+
+        return dict((related_model, self.get_existing_ids(related_model, ids))
+            for related_model, ids in references.iteritems())
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: ["Expected a list of items but got type \"%s\"." % type(data).__name__]
+            })
+        max_items = get_config('bulk_max_items', 1000)
+        if len(data) > max_items:
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: ["At most %d items are allowed in one request, but %d were given." % (max_items, len(data))]
+            })
+
+        items = [item if isinstance(item, dict) else {} for item in data]
+        self._context['existing_ids'] = self.find_existing_ids(items)
+
+        # the ids of the objects themselves: new ones must not exist yet,
+        # updated ones must exist
+        model = self.child.Meta.model
+        pk_field = self.get_pk_field()
+        item_errors = [{} for item in data]
+        if pk_field is not None:
+            name = self.child.get_output_names()[pk_field.field_name]
+            ids = [self.child.get_input_value(item, pk_field) for item in items]
+            existing = self.get_existing_ids(model, [i for i in ids if i is not None])
+            seen = set()
+            for num, obj_id in enumerate(ids):
+                if obj_id is None:
+                    item_errors[num][name] = ["This field is required."]
+                elif obj_id in seen:
+                    item_errors[num][name] = ["The id %s is given more than once." % obj_id]
+                elif self.instance is None and obj_id in existing:
+                    item_errors[num][name] = ["An object with the id %s exists already." % obj_id]
+                elif self.instance is not None and obj_id not in existing:
+                    item_errors[num][name] = ["Object with the id %s does not exist." % obj_id]
+                seen.add(obj_id)
+        elif self.instance is not None:
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: ["These objects have no ids and cannot be updated in bulk."]
+            })
+
+        ret = []
+        errors = []
+        for num, item in enumerate(data):
+            try:
+                validated = self.child.run_validation(item)
+            except serializers.ValidationError as exc:
+                errors.append(dict(item_errors[num], **exc.detail))
+            else:
+                ret.append(validated)
+                errors.append(item_errors[num])
+
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return ret
+
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        objs = []
+        for attrs in validated_data:
+            obj = model(**attrs)
+            if model._meta.parents:
+                # the primary key of Collection is the link to the entity
+                setattr(obj, model._meta.pk.attname, obj.id)
+            objs.append(obj)
+        bulk_create_objects(model, objs)
+        return objs
+
+    def update(self, queryset, validated_data):
+        model = self.child.Meta.model
+        instances = {}
+        for chunk in chunks(attrs['id'] for attrs in validated_data):
+            instances.update(queryset.in_bulk(chunk))
+
+        objs = []
+        field_names = set()
+        for attrs in validated_data:
+            obj = instances[attrs['id']]
+            for attname, value in attrs.iteritems():
+                setattr(obj, attname, value)
+                field_names.add(attname)
+            objs.append(obj)
+        field_names.discard('id')
+        if field_names:
+            bulk_update_objects(model, objs, field_names)
+        return objs
+
+
+class CompiledSerializer(object):
+    """
+    Fast path for NonNullCustomSerializer classes: the readable fields are
+    analysed once per serializer class and converted to a tuple of
+    (attribute path, values() key, output field name, converter), so
+    serializing an object needs no DRF field machinery anymore.
+    The output is the same as for serializer_class(instance).data.
+    Model instances as well as dictionaries from values() can be
+    serialized; the latter only if there are no method fields.
+    """
+
+    def __init__(self, serializer_class):
+        # the serializer instance is only needed for bound fields,
+        # i.e. the methods of SerializerMethodFields
+        serializer = serializer_class()
+        model = serializer.Meta.model
+        self.name = serializer_class.__name__
+        self.supports_rows = True
+
+        fields = []
+        for field in serializer._readable_fields:
+            field_name = field.field_name
+            if getattr(field, 'custom_field_name', None) is not None:
+                field_name = field.custom_field_name
+
+            attrs = list(field.source_attrs)
+            converter = field.to_representation
+            if isinstance(field, serializers.SerializerMethodField):
+                self.supports_rows = False
+            elif isinstance(field, serializers.RelatedField) and field.use_pk_only_optimization() and len(attrs) == 1:
+                # use the foreign key value directly, as DRF does
+                attrs = [model._meta.get_field(attrs[0]).attname]
+                converter = self.pk_converter(field)
+
+            key = '__'.join(field.source_attrs)
+            fields.append((tuple(attrs), key, field_name, converter))
+
+        self.fields = tuple(fields)
+
+    def pk_converter(self, field):
+        def converter(value):
+            return field.to_representation(PKOnlyObject(pk=value))
+        return converter
+
+    def values_fields(self):
+        # the lookups needed for serializing values() rows
+        return [key for attrs, key, field_name, converter in self.fields]
+
+    def to_representation(self, instance):
+        ret = OrderedDict()
+        for attrs, key, field_name, converter in self.fields:
+            value = instance
+            try:
+                for attr in attrs:
+                    value = getattr(value, attr)
+                    if is_simple_callable(value):
+                        value = value()
+            except AttributeError:
+                continue
+            except ObjectDoesNotExist:
+                value = None
+
+            # skip None fields, empty representations and empty lists
+            if value is None:
+                continue
+            representation = converter(value)
+            if representation is None or (isinstance(representation, list) and not representation):
+                continue
+            ret[field_name] = representation
+
+        return ret
+
+    def row_to_representation(self, row):
+        if not self.supports_rows:
+            # method fields need the model instance
+            raise TypeError("%s has method fields and cannot serialize values() rows." % self.name)
+        ret = OrderedDict()
+        for attrs, key, field_name, converter in self.fields:
+            value = row.get(key)
+            if value is None:
+                continue
+            representation = converter(value)
+            if representation is None or (isinstance(representation, list) and not representation):
+                continue
+            ret[field_name] = representation
+
+        return ret
+
+
+compiled_serializers = {}
+
+
+def get_compiled_serializer(serializer_class):
+    # compile each serializer class only once
+    try:
+        return compiled_serializers[serializer_class]
+    except KeyError:
+        compiled = CompiledSerializer(serializer_class)
+        compiled_serializers[serializer_class] = compiled
+        return compiled
+
+
+def serialize(serializer_class, instance):
+    # same result as serializer_class(instance).data, but faster;
+    # instance may also be a row from values() (see rows.py)
+    if isinstance(instance, dict):
+        return get_compiled_serializer(serializer_class).row_to_representation(instance)
+    return get_compiled_serializer(serializer_class).to_representation(instance)
+
+
+def serialize_nested(serializer_class, instance):
+    # serialize(), for values that are written as string (e.g. the
+    # descriptions in W3C PROV-N): .data is a ReturnDict, printed as dict
+    return ReturnDict(serialize(serializer_class, instance), serializer=None)
+
+
 # W3C compatible serializer classes
 class ActivitySerializer(NonNullCustomSerializer):
 
@@ -167,7 +531,7 @@ class W3CActivitySerializer(ActivitySerializer):
     def get_voprov_description(self, obj):
         description = obj.description
         if description:
-            data = W3CActivityDescriptionSerializer(description).data
+            data = serialize_nested(W3CActivityDescriptionSerializer, description)
         else:
             data = None
         return data
@@ -237,7 +601,7 @@ class W3CEntitySerializer(EntitySerializer):
     def get_voprov_description(self, obj):
         description = obj.description
         if description:
-            data = W3CEntityDescriptionSerializer(description).data
+            data = serialize_nested(W3CEntityDescriptionSerializer, description)
         else:
             data = None
         return data
@@ -293,7 +657,7 @@ class W3CUsedSerializer(UsedSerializer):
     def get_voprov_description(self, obj):
         description = obj.description
         if description:
-            data = W3CUsedDescriptionSerializer(description).data
+            data = serialize_nested(W3CUsedDescriptionSerializer, description)
         else:
             data = None
         return data
@@ -332,7 +696,7 @@ class W3CWasGeneratedBySerializer(WasGeneratedBySerializer):
     def get_voprov_description(self, obj):
         description = obj.description
         if description:
-            data = W3CWasGeneratedByDescriptionSerializer(description).data
+            data = serialize_nested(W3CWasGeneratedByDescriptionSerializer, description)
         else:
             data = None
         return data
@@ -489,31 +853,31 @@ class W3CProvenanceSerializer(serializers.Serializer):
     def get_activity(self, obj):
         activity = {}
         for a_id, a in obj['activity'].iteritems():
-            data = W3CActivitySerializer(a).data
+            data = serialize(W3CActivitySerializer, a)
             activity[a_id] = data
 
         # add activities that are stored as activityFlow to
         # "normal" activities for W3C serialisation,
         for a_id, a in obj['activityFlow'].iteritems():
-            data = W3CActivityFlowSerializer(a).data
+            data = serialize(W3CActivityFlowSerializer, a)
             activity[a_id] = data
         return activity
 
     def get_entity(self, obj):
         entity = {}
         for e_id, e in obj['entity'].iteritems():
-            data = W3CEntitySerializer(e).data
+            data = serialize(W3CEntitySerializer, e)
             entity[e_id] = data
 
         # add collections to entities as well
         # -- actually not needed, since they are added as entities only in utils.track-functions
         for e_id, e in obj['collection'].iteritems():
-            data = W3CCollectionSerializer(e).data
+            data = serialize(W3CCollectionSerializer, e)
             entity[e_id] = data
 
         # and add parameters
         for p_id, p in obj['parameter'].iteritems():
-            data = W3CParameterSerializer(p).data
+            data = serialize(W3CParameterSerializer, p)
             entity[p_id] = data
             # add additionally needed used-relationship at "get_used"
 
@@ -532,7 +896,7 @@ class W3CProvenanceSerializer(serializers.Serializer):
     def get_agent(self, obj):
         agent = {}
         for a_id, a in obj['agent'].iteritems():
-            data = AgentSerializer(a).data
+            data = serialize(AgentSerializer, a)
             agent[a_id] = data
 
         return agent
@@ -540,16 +904,22 @@ class W3CProvenanceSerializer(serializers.Serializer):
     def get_used(self, obj):
         used = {}
         for u_id, u in obj['used'].iteritems():
-            data = W3CUsedSerializer(u).data
+            data = serialize(W3CUsedSerializer, u)
             u_id = self.add_namespace_to_id(u_id)
             used[u_id] = self.restructure_relations(data)
 
         # add one used-relationship for each parameter, only temporary (do not save!):
-        num_param = 0
-        for p_id, p in obj['parameter'].iteritems():
-            activity = p.activity
+        used.update(self.get_parameter_used(obj['parameter']))
+
+        return used
+
+    def get_parameter_used(self, parameters, start=0):
+        # the used-relationships of the parameters, numbered p<start>, p<start+1>, ...
+        used = {}
+        num_param = start
+        for p_id, p in parameters.iteritems():
             u_id = 'p%s' % num_param
-            data = {'id': u_id, 'activity': activity.id, 'entity': p_id, 'role': 'voprov:parameter'}
+            data = {'id': u_id, 'activity': p.activity_id, 'entity': p_id, 'role': 'voprov:parameter'}
 
             u_id = self.add_namespace_to_id(u_id)
             used[u_id] = self.restructure_relations(data)
@@ -561,7 +931,7 @@ class W3CProvenanceSerializer(serializers.Serializer):
     def get_wasGeneratedBy(self, obj):
         wasGeneratedBy = {}
         for w_id, w in obj['wasGeneratedBy'].iteritems():
-            data = W3CWasGeneratedBySerializer(w).data
+            data = serialize(W3CWasGeneratedBySerializer, w)
             w_id = self.add_namespace_to_id(w_id)
             wasGeneratedBy[w_id] = self.restructure_relations(data)
 
@@ -570,7 +940,7 @@ class W3CProvenanceSerializer(serializers.Serializer):
     def get_wasAssociatedWith(self, obj):
         wasAssociatedWith = {}
         for w_id, w in obj['wasAssociatedWith'].iteritems():
-            data = WasAssociatedWithSerializer(w).data
+            data = serialize(WasAssociatedWithSerializer, w)
             w_id = self.add_namespace_to_id(w_id)
             wasAssociatedWith[w_id] = self.restructure_relations(data)
 
@@ -579,7 +949,7 @@ class W3CProvenanceSerializer(serializers.Serializer):
     def get_wasAttributedTo(self, obj):
         wasAttributedTo = {}
         for w_id, w in obj['wasAttributedTo'].iteritems():
-            data = WasAttributedToSerializer(w).data
+            data = serialize(WasAttributedToSerializer, w)
             w_id = self.add_namespace_to_id(w_id)
             wasAttributedTo[w_id] = self.restructure_relations(data)
 
@@ -588,7 +958,7 @@ class W3CProvenanceSerializer(serializers.Serializer):
     def get_hadMember(self, obj):
         hadMember = {}
         for h_id, h in obj['hadMember'].iteritems():
-            data = HadMemberSerializer(h).data
+            data = serialize(HadMemberSerializer, h)
             h_id = self.add_namespace_to_id(h_id)
             hadMember[h_id] = self.restructure_relations(data)
 
@@ -597,7 +967,7 @@ class W3CProvenanceSerializer(serializers.Serializer):
     def get_wasDerivedFrom(self, obj):
         wasDerivedFrom = {}
         for w_id, w in obj['wasDerivedFrom'].iteritems():
-            data = WasDerivedFromSerializer(w).data
+            data = serialize(WasDerivedFromSerializer, w)
             w_id = self.add_namespace_to_id(w_id)
             wasDerivedFrom[w_id] = self.restructure_relations(data)
 
@@ -606,7 +976,7 @@ class W3CProvenanceSerializer(serializers.Serializer):
     def get_wasInformedBy(self, obj):
         wasInformedBy = {}
         for w_id, w in obj['wasInformedBy'].iteritems():
-            data = WasInformedBySerializer(w).data
+            data = serialize(WasInformedBySerializer, w)
             w_id = self.add_namespace_to_id(w_id)
             wasInformedBy[w_id] = self.restructure_relations(data)
 
@@ -616,7 +986,7 @@ class W3CProvenanceSerializer(serializers.Serializer):
         wasInfluencedBy = {}
         # go through all hadStep relations
         for w_id, w in obj['hadStep'].iteritems():
-            data = W3CHadStepSerializer(w).data
+            data = serialize(W3CHadStepSerializer, w)
             w_id = self.add_namespace_to_id(w_id)
             wasInfluencedBy[w_id] = self.restructure_relations(data)
 
@@ -910,7 +1280,7 @@ class VOProvenanceSerializer(serializers.Serializer):
     def get_activity(self, obj):
         activity = {}
         for a_id, a in obj['activity'].iteritems():
-            data = VOActivitySerializer(a).data
+            data = serialize(VOActivitySerializer, a)
             activity[a_id] = data
             #print 'act_id: ', activity[a_id]
 
@@ -919,7 +1289,7 @@ class VOProvenanceSerializer(serializers.Serializer):
     def get_activityFlow(self, obj):
         activityFlow = {}
         for a_id, a in obj['activityFlow'].iteritems():
-            data = VOActivityFlowSerializer(a).data
+            data = serialize(VOActivityFlowSerializer, a)
             activityFlow[a_id] = data
 
         return activityFlow
@@ -927,7 +1297,7 @@ class VOProvenanceSerializer(serializers.Serializer):
     def get_activityDescription(self, obj):
         activityDescription = {}
         for a_id, a in obj['activityDescription'].iteritems():
-            data = VOActivityDescriptionSerializer(a).data
+            data = serialize(VOActivityDescriptionSerializer, a)
             activityDescription[a_id] = data
 
         return activityDescription
@@ -935,7 +1305,7 @@ class VOProvenanceSerializer(serializers.Serializer):
     def get_entity(self, obj):
         entity = {}
         for e_id, e in obj['entity'].iteritems():
-            data = VOEntitySerializer(e).data
+            data = serialize(VOEntitySerializer, e)
             entity[e_id] = data
 
         return entity
@@ -943,7 +1313,7 @@ class VOProvenanceSerializer(serializers.Serializer):
     def get_collection(self, obj):
         collection = {}
         for c_id, c in obj['collection'].iteritems():
-            data = VOCollectionSerializer(c).data
+            data = serialize(VOCollectionSerializer, c)
             collection[c_id] = data
 
         return collection
@@ -951,7 +1321,7 @@ class VOProvenanceSerializer(serializers.Serializer):
     def get_entityDescription(self, obj):
         entityDescription = {}
         for e_id, e in obj['entityDescription'].iteritems():
-            data = VOEntityDescriptionSerializer(e).data
+            data = serialize(VOEntityDescriptionSerializer, e)
             entityDescription[e_id] = data
 
         return entityDescription
@@ -959,7 +1329,7 @@ class VOProvenanceSerializer(serializers.Serializer):
     def get_agent(self, obj):
         agent = {}
         for a_id, a in obj['agent'].iteritems():
-            data = VOAgentSerializer(a).data
+            data = serialize(VOAgentSerializer, a)
             agent[a_id] = data
 
         return agent
@@ -967,7 +1337,7 @@ class VOProvenanceSerializer(serializers.Serializer):
     def get_parameter(self, obj):
         parameter = {}
         for p_id, p in obj['parameter'].iteritems():
-            data = VOParameterSerializer(p).data
+            data = serialize(VOParameterSerializer, p)
             parameter[p_id] = data
             #print 'param_id: ', parameter[p_id]
         return parameter
@@ -975,7 +1345,7 @@ class VOProvenanceSerializer(serializers.Serializer):
     def get_parameterDescription(self, obj):
         parameterDescription = {}
         for p_id, p in obj['parameterDescription'].iteritems():
-            data = VOParameterDescriptionSerializer(p).data
+            data = serialize(VOParameterDescriptionSerializer, p)
             parameterDescription[p_id] = data
             #print 'paramdesc: ', data
         return parameterDescription
@@ -983,7 +1353,7 @@ class VOProvenanceSerializer(serializers.Serializer):
     def get_used(self, obj):
         used = {}
         for u_id, u in obj['used'].iteritems():
-            data = VOUsedSerializer(u).data
+            data = serialize(VOUsedSerializer, u)
             u_id = self.add_namespace_to_id(u_id)
             used[u_id] = self.restructure_relations(data)
 
@@ -992,7 +1362,7 @@ class VOProvenanceSerializer(serializers.Serializer):
     def get_usedDescription(self, obj):
         usedDescription = {}
         for u_id, u in obj['usedDescription'].iteritems():
-            data = VOUsedDescriptionSerializer(u).data
+            data = serialize(VOUsedDescriptionSerializer, u)
             u_id = self.add_namespace_to_id(u_id)
             usedDescription[u_id] = self.restructure_relations(data)
 
@@ -1001,7 +1371,7 @@ class VOProvenanceSerializer(serializers.Serializer):
     def get_wasGeneratedBy(self, obj):
         wasGeneratedBy = {}
         for w_id, w in obj['wasGeneratedBy'].iteritems():
-            data = VOWasGeneratedBySerializer(w).data
+            data = serialize(VOWasGeneratedBySerializer, w)
             w_id = self.add_namespace_to_id(w_id)
             wasGeneratedBy[w_id] = self.restructure_relations(data)
 
@@ -1010,7 +1380,7 @@ class VOProvenanceSerializer(serializers.Serializer):
     def get_wasGeneratedByDescription(self, obj):
         wasGeneratedByDescription = {}
         for w_id, w in obj['wasGeneratedByDescription'].iteritems():
-            data = VOWasGeneratedByDescriptionSerializer(w).data
+            data = serialize(VOWasGeneratedByDescriptionSerializer, w)
             w_id = self.add_namespace_to_id(w_id)
             wasGeneratedByDescription[w_id] = self.restructure_relations(data)
 
@@ -1019,7 +1389,7 @@ class VOProvenanceSerializer(serializers.Serializer):
     def get_wasAssociatedWith(self, obj):
         wasAssociatedWith = {}
         for w_id, w in obj['wasAssociatedWith'].iteritems():
-            data = VOWasAssociatedWithSerializer(w).data
+            data = serialize(VOWasAssociatedWithSerializer, w)
             w_id = self.add_namespace_to_id(w_id)
             wasAssociatedWith[w_id] = self.restructure_relations(data)
 
@@ -1028,7 +1398,7 @@ class VOProvenanceSerializer(serializers.Serializer):
     def get_wasAttributedTo(self, obj):
         wasAttributedTo = {}
         for w_id, w in obj['wasAttributedTo'].iteritems():
-            data = VOWasAttributedToSerializer(w).data
+            data = serialize(VOWasAttributedToSerializer, w)
             w_id = self.add_namespace_to_id(w_id)
             wasAttributedTo[w_id] = self.restructure_relations(data)
 
@@ -1037,7 +1407,7 @@ class VOProvenanceSerializer(serializers.Serializer):
     def get_hadMember(self, obj):
         hadMember = {}
         for h_id, h in obj['hadMember'].iteritems():
-            data = VOHadMemberSerializer(h).data
+            data = serialize(VOHadMemberSerializer, h)
             h_id = self.add_namespace_to_id(h_id)
             hadMember[h_id] = self.restructure_relations(data)
 
@@ -1046,7 +1416,7 @@ class VOProvenanceSerializer(serializers.Serializer):
     def get_wasDerivedFrom(self, obj):
         wasDerivedFrom = {}
         for w_id, w in obj['wasDerivedFrom'].iteritems():
-            data = VOWasDerivedFromSerializer(w).data
+            data = serialize(VOWasDerivedFromSerializer, w)
             w_id = self.add_namespace_to_id(w_id)
             wasDerivedFrom[w_id] = self.restructure_relations(data)
 
@@ -1055,7 +1425,7 @@ class VOProvenanceSerializer(serializers.Serializer):
     def get_hadStep(self, obj):
         hadStep = {}
         for h_id, h in obj['hadStep'].iteritems():
-            data = VOHadStepSerializer(h).data
+            data = serialize(VOHadStepSerializer, h)
             h_id = self.add_namespace_to_id(h_id)
             hadStep[h_id] = self.restructure_relations(data)
 
@@ -1064,7 +1434,7 @@ class VOProvenanceSerializer(serializers.Serializer):
     def get_wasInformedBy(self, obj):
         wasInformedBy = {}
         for w_id, w in obj['wasInformedBy'].iteritems():
-            data = VOWasInformedBySerializer(w).data
+            data = serialize(VOWasInformedBySerializer, w)
             w_id = self.add_namespace_to_id(w_id)
             wasInformedBy[w_id] = self.restructure_relations(data)
 
@@ -0,0 +1,97 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import ActivityFlow
+from .utils import activity_kind_cache
+from . import graphindex, responsecache, lineage
+from .closurecache import closure_cache
+
+
+@receiver(post_save, sender=ActivityFlow)
+@receiver(post_delete, sender=ActivityFlow)
+def invalidate_activity_kind(sender, instance, **kwargs):
+    # the activity may have been cached as plain activity before
+    activity_kind_cache.invalidate(instance.id)
+
+
+@receiver(post_save)
+def update_graph_index_on_save(sender, instance, **kwargs):
+    # keep the in-memory graph index up to date, if it was loaded
+    index = graphindex.loaded_graph_index()
+    if index is not None:
+        index.save_object(instance)
+
+
+@receiver(post_delete)
+def update_graph_index_on_delete(sender, instance, **kwargs):
+    index = graphindex.loaded_graph_index()
+    if index is not None:
+        index.delete_object(instance)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_cached_provenance(sender, **kwargs):
+    # any change of the provenance data invalidates the cached provdal
+    # responses and the cached closures
+    if sender._meta.app_label == 'prov_vo':
+        generation = responsecache.bump_generation()
+        graphindex.advance_graph_index(generation)
+        closure_cache.clear()
+
+
+@receiver(pre_save)
+def remember_lineage_edge(sender, instance, using, **kwargs):
+    # the relation may be changed to link other nodes
+    if sender in lineage.LINEAGE_MODELS and lineage.lineage_enabled():
+        instance._stored_lineage_edge = lineage.get_stored_edge(instance, using)
+
+
+@receiver(post_save)
+def update_lineage_on_save(sender, instance, using, **kwargs):
+    # keep the lineage table up to date, if it is used
+    if sender in lineage.LINEAGE_MODELS and lineage.lineage_enabled():
+        stored = getattr(instance, '_stored_lineage_edge', None)
+        edge = lineage.get_relation_edge(instance)
+        if stored != edge:
+            if stored is not None:
+                lineage.remove_edge(*stored, using=using)
+            if edge is not None:
+                lineage.add_edge(*edge, using=using)
+
+
+@receiver(post_delete)
+def update_lineage_on_delete(sender, instance, using, **kwargs):
+    if not lineage.lineage_enabled():
+        return
+    if sender in lineage.LINEAGE_MODELS:
+        edge = lineage.get_relation_edge(instance)
+        if edge is not None:
+            lineage.remove_edge(*edge, using=using)
+    else:
+        # the relations of a deleted node are set to NULL without signals
+        node = lineage.get_node_key(instance)
+        if node is not None:
+            lineage.remove_node(node, using=using)
+
+
+def invalidate_after_bulk_change(activity_flow_ids=(), graph_changed=True, created=None):
+    """
+    bulk_create and queryset updates send no signals: invalidate the
+    caches as the receivers above do for single objects, including the
+    kinds of the given (new) activityFlows. The graph index is only
+    reloaded if nodes or relations were added. If the created objects
+    are given, their relations are added to the lineage table as for
+    single saves, otherwise the lineage table is rebuilt.
+    """
+    for activity_id in activity_flow_ids:
+        activity_kind_cache.invalidate(activity_id)
+    if graph_changed:
+        graphindex.reset_graph_index()
+        if lineage.lineage_enabled():
+            if created is not None:
+                lineage.add_relations(created)
+            else:
+                lineage.rebuild_lineage()
+    responsecache.bump_generation()
+    closure_cache.clear()
@@ -30,7 +30,34 @@ var path = sankey.link();
 var url_graphjson = d3.select("#url_graphjson").text();
 var jsonurl = url_graphjson;
 
+// graphs with more nodes are drawn at the precomputed layout,
+// without running the force simulation in the browser
+var maxForceNodes = 300;
+
+// convert the compact GRAPH-JSON (COMPACT=TRUE, columnar arrays)
+// to lists of node and link objects, as in the default GRAPH-JSON
+function toNodesLinks(prov) {
+  if (!prov.nodeTypes) {
+    return prov;
+  }
+  var nodes = prov.nodes.id.map(function(id, i) {
+    var node = {id: id, name: prov.nodes.name[i] || id, type: prov.nodeTypes[prov.nodes.type[i]]};
+    if (prov.layout) {
+      node.layoutX = prov.layout.x[i];
+      node.layoutY = prov.layout.y[i];
+    }
+    return node;
+  });
+  var links = prov.links.source.map(function(source, i) {
+    var type = prov.linkTypes[prov.links.type[i]];
+    return {source: nodes[source], target: nodes[prov.links.target[i]], type: type,
+      value: (type == "used" || type == "wasGeneratedBy") ? 0.5 : 0.2};
+  });
+  return {nodes: nodes, links: links};
+}
+
 d3.json(jsonurl, function(prov) {
+  prov = toNodesLinks(prov);
   sankey
       .nodes(prov.nodes)
       .links(prov.links)
@@ -149,6 +176,17 @@ var defs = svg2.append("svg:defs");
 
 var jsonurl = url_graphjson;
 d3.json(jsonurl, function(prov) {
+  prov = toNodesLinks(prov);
+
+  // start from the precomputed layout, if available
+  var precomputed = prov.nodes.length > 0 && prov.nodes[0].layoutX !== undefined;
+  if (precomputed) {
+    prov.nodes.forEach(function(d) {
+      d.x = d.px = 20 + d.layoutX * (width2 - 40);
+      d.y = d.py = 20 + d.layoutY * (height2 - 40);
+    });
+  }
+  var fixed = precomputed && prov.nodes.length > maxForceNodes;
 
   var force = d3.layout.force()
       .nodes(prov.nodes)
@@ -156,8 +194,12 @@ d3.json(jsonurl, function(prov) {
       .size([width2, height2])
       .linkDistance(60)
       .charge(-300)
-      .on("tick", tick)
-      .start();
+      .on("tick", tick);
+  if (fixed) {
+    prov.nodes.forEach(function(d) { d.fixed = true; });
+  } else {
+    force.start();
+  }
 
   // Per-type markers, as they don't inherit styles.
   svg2.append("defs").selectAll("marker")
@@ -241,6 +283,10 @@ d3.json(jsonurl, function(prov) {
     text.attr("transform", transform);
   }
 
+  if (fixed) {
+    tick();
+  }
+
   function linkArc(d) {
     var dx = d.target.x - d.source.x,
         dy = d.target.y - d.source.y,
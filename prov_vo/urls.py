@@ -8,8 +8,18 @@ import vosi.urls
 
 app_name = 'prov_vo'
 
+
+class BulkRouter(routers.DefaultRouter):
+    # PUT and PATCH to the list url update a list of objects
+    routes = [
+        route._replace(mapping=dict(route.mapping, put='bulk_update', patch='partial_bulk_update'))
+        if isinstance(route, routers.Route) and route.mapping.get('post') == 'create' else route
+        for route in routers.DefaultRouter.routes
+    ]
+
+
 # add automatically created urls:
-router = routers.DefaultRouter()
+router = BulkRouter()
 router.register(r'activities', views.ActivityViewSet)
 router.register(r'entities', views.EntityViewSet)
 router.register(r'agents', views.AgentViewSet)
@@ -35,7 +45,10 @@ urlpatterns = [
 
     # provdal form
     url(r'^provdal/$', views.provdal, name='provdal'),
+    url(r'^provdal/batch/$', views.provdal_batch, name='provdal_batch'),
     url(r'^provdalform/$', views.provdal_form, name='provdal_form'),
+    # loading PROV-JSON documents
+    url(r'^provload/$', views.provload, name='provload'),
     # vosi endpoints required by dali: capabilities (must be sibling to provdal, Sec. 2 of DALI), availability
     url(r'^availability/$', vosi.views.availability, name='vosi_availability'),
     url(r'^capabilities/$', vosi.views.capabilities, name='vosi_capabilities'),
@@ -43,5 +56,6 @@ urlpatterns = [
     # graph overviews
     url(r'^graph/$', views.graph, name='graph'),
     url(r'^graph/graphjson$', views.fullgraphjson, name='graphjson'),
+    url(r'^graph/summary$', views.summarygraph, name='graphsummary'),
 
 ]
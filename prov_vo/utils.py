@@ -5,12 +5,27 @@ from .models import (
     ParameterDescription
 )
 import logging
+import threading
+from collections import namedtuple, OrderedDict
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import Case, When, Value
 from django.http import QueryDict
 
 class InvalidDataError(Exception):
     pass
 
 
+def get_config(key, default=None):
+    # Return the value for key from the (optional) PROV_VO_CONFIG settings,
+    # or the default value, if it is not defined there
+    try:
+        return settings.PROV_VO_CONFIG[key]
+    except (AttributeError, KeyError):
+        return default
+
+
 class QueryDictDALI(QueryDict):
     """
     Same as QueryDict class, but can turn URL parameter names to
@@ -85,6 +100,11 @@ class QueryDictDALI(QueryDict):
 
 
 
+# Recursive (depth-first) tracking of provenance, one node at a time.
+# Not used by the provdal view anymore, see track_provenance below.
+# Since each node is expanded only where it was found first, DEPTH=n
+# misses nodes behind a shortcut that is found after a longer path
+# (see benchmarks/depth_traversal.py).
 def track_entity(entity, prov, countdown, direction='BACK', members_flag=False, steps_flag=False, agent_flag=False):
     if countdown == 0:
         return prov
@@ -136,7 +156,7 @@ def track_entity(entity, prov, countdown, direction='BACK', members_flag=False,
     if direction == 'BACK':
 
         # wasGeneratedBy
-        queryset = WasGeneratedBy.objects.filter(entity=entity.id)
+        queryset = WasGeneratedBy.objects.filter(entity=entity.id).select_related('activity__description', 'description')
         for wg in queryset:
             # add wasGeneratedBy-link
             # --> need to check if it's already there, because I may have
@@ -173,7 +193,7 @@ def track_entity(entity, prov, countdown, direction='BACK', members_flag=False,
         # in FORTH case, we have to find out where entities are being used:
 
         # used relations
-        queryset = Used.objects.filter(entity=entity.id)
+        queryset = Used.objects.filter(entity=entity.id).select_related('activity__description', 'description')
         for u in queryset:
             # add used-link, if not yet done
             if u.id not in prov['used']:
@@ -198,7 +218,7 @@ def track_entity(entity, prov, countdown, direction='BACK', members_flag=False,
 
 
     # check membership to collection
-    queryset = HadMember.objects.filter(entity=entity.id)
+    queryset = HadMember.objects.filter(entity=entity.id).select_related('collection__description')
     for h in queryset:
     #     print "Entity "+ entity.id + " is member of collection: ", h.collection.id, follow
 
@@ -221,7 +241,7 @@ def track_entity(entity, prov, countdown, direction='BACK', members_flag=False,
 
     # hadMember (check for members)
     if members_flag:
-        queryset = HadMember.objects.filter(collection=entity.id)
+        queryset = HadMember.objects.filter(collection=entity.id).select_related('entity__description')
         for h in queryset:
             # add relation to prov
             if h.id not in prov['hadMember']:
@@ -242,7 +262,7 @@ def track_entity(entity, prov, countdown, direction='BACK', members_flag=False,
 
 
     # check agent relation (attribution)
-    queryset = WasAttributedTo.objects.filter(entity=entity.id)
+    queryset = WasAttributedTo.objects.filter(entity=entity.id).select_related('agent')
     for wa in queryset:
         # add wasAttributedto relationship
         if wa.id not in prov['wasAttributedTo']:
@@ -276,7 +296,7 @@ def track_activity(activity, prov, countdown, direction='BACK', members_flag=Fal
     # independent of back/forth
     # TODO: need to always add them as soon as an entity was hit, not just when following an entity further!!
     # Same for entityDescription, activityDescription , usedDescription and wasGeneratedByDescription
-    queryset = Parameter.objects.filter(activity=activity.id)
+    queryset = Parameter.objects.filter(activity=activity.id).select_related('description')
     for p in queryset:
         prov['parameter'][p.id] = p
         # if there is a parameter, a corresponding parameterDescription
@@ -296,9 +316,9 @@ def track_activity(activity, prov, countdown, direction='BACK', members_flag=Fal
 
     # wasInformedBy
     if direction == 'BACK':
-        queryset = WasInformedBy.objects.filter(informed=activity.id)
+        queryset = WasInformedBy.objects.filter(informed=activity.id).select_related('informant__description')
     else:
-        queryset = WasInformedBy.objects.filter(informant=activity.id)
+        queryset = WasInformedBy.objects.filter(informant=activity.id).select_related('informed__description')
 
     for wi in queryset:
 
@@ -325,7 +345,7 @@ def track_activity(activity, prov, countdown, direction='BACK', members_flag=Fal
 
     if direction == 'BACK':
         # used relations
-        queryset = Used.objects.filter(activity=activity.id)
+        queryset = Used.objects.filter(activity=activity.id).select_related('entity__description', 'description')
         for u in queryset:
             # add used-link, if not yet done
             if u.id not in prov['used']:
@@ -351,7 +371,7 @@ def track_activity(activity, prov, countdown, direction='BACK', members_flag=Fal
         # produced entities for this activity
 
         # wasGeneratedBy
-        queryset = WasGeneratedBy.objects.filter(activity=activity.id)
+        queryset = WasGeneratedBy.objects.filter(activity=activity.id).select_related('entity__description', 'description')
         for wg in queryset:
             # add wasGeneratedBy-link
             if wg.id not in prov['wasGeneratedBy']:
@@ -375,7 +395,7 @@ def track_activity(activity, prov, countdown, direction='BACK', members_flag=Fal
 
 
     # check agent relation (association)
-    queryset = WasAssociatedWith.objects.filter(activity=activity.id)
+    queryset = WasAssociatedWith.objects.filter(activity=activity.id).select_related('agent')
     for wa in queryset:
 
         # add relationship to prov
@@ -396,7 +416,7 @@ def track_activity(activity, prov, countdown, direction='BACK', members_flag=Fal
 
 
     # hadStep - find activityFlows to which it belongs
-    queryset = HadStep.objects.filter(activity=activity.id)
+    queryset = HadStep.objects.filter(activity=activity.id).select_related('activityFlow__description')
     for h in queryset:
         # add relationship to prov
         if h.id not in prov['hadStep']:
@@ -416,7 +436,7 @@ def track_activity(activity, prov, countdown, direction='BACK', members_flag=Fal
 
     # get member activities: follow hadStep from activityflow to activity
     if steps_flag:
-        queryset = HadStep.objects.filter(activityFlow=activity.id)
+        queryset = HadStep.objects.filter(activityFlow=activity.id).select_related('activity__description')
         for h in queryset:
             # add relationship to prov
             if h.id not in prov['hadStep']:
@@ -437,14 +457,65 @@ def track_activity(activity, prov, countdown, direction='BACK', members_flag=Fal
     return prov
 
 
+class ActivityKindCache(object):
+    """
+    Process-wide least-recently-used cache of activity id -> kind
+    ('activity' or 'activityFlow'). The maximum number of entries is
+    taken from PROV_VO_CONFIG['activity_kind_cache_size'], the cache is
+    switched off if it is not set (or 0). Entries are invalidated by the
+    post_save/post_delete signals of ActivityFlow (see signals.py); note
+    that bulk_create and queryset updates do not send these signals.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_maxsize(self):
+        return get_config('activity_kind_cache_size', 0)
+
+    def get(self, activity_id):
+        with self.lock:
+            try:
+                kind = self.entries.pop(activity_id)
+            except KeyError:
+                return None
+            # move to the end, as most recently used
+            self.entries[activity_id] = kind
+            return kind
+
+    def set(self, activity_id, kind):
+        maxsize = self.get_maxsize()
+        if not maxsize:
+            return
+        with self.lock:
+            self.entries.pop(activity_id, None)
+            self.entries[activity_id] = kind
+            while len(self.entries) > maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, activity_id):
+        with self.lock:
+            self.entries.pop(activity_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+activity_kind_cache = ActivityKindCache()
+
+
 def get_activity_type(activity_id):
     # check if it is an activityFlow or activity,
     # return string (what it is)
-    afset = ActivityFlow.objects.filter(id=activity_id)
-    if len(afset) > 0:
-        activity_type = 'activityFlow'
-    else:
-        activity_type = 'activity'
+    activity_type = activity_kind_cache.get(activity_id)
+    if activity_type is None:
+        if ActivityFlow.objects.filter(id=activity_id).exists():
+            activity_type = 'activityFlow'
+        else:
+            activity_type = 'activity'
+        activity_kind_cache.set(activity_id, activity_type)
 
     return activity_type
 
@@ -458,7 +529,7 @@ def track_agent(agent, prov, countdown, direction='BACK', members_flag=False, st
 
     # Check possible agent relationships and follow corresponding activity/entity
 
-    queryset = WasAssociatedWith.objects.filter(agent=agent.id)
+    queryset = WasAssociatedWith.objects.filter(agent=agent.id).select_related('activity__description')
     for wa in queryset:
 
         # add relationship to prov
@@ -478,7 +549,7 @@ def track_agent(agent, prov, countdown, direction='BACK', members_flag=False, st
                 agent_flag=agent_flag)
 
     # check agent relation (attribution)
-    queryset = WasAttributedTo.objects.filter(agent=agent.id)
+    queryset = WasAttributedTo.objects.filter(agent=agent.id).select_related('entity__description')
     for wa in queryset:
         # add wasAttributedTo relationship
         if wa.id not in prov['wasAttributedTo']:
@@ -496,3 +567,317 @@ def track_agent(agent, prov, countdown, direction='BACK', members_flag=False, st
                 agent_flag=agent_flag)
 
     return prov
+
+
+# Breadth-first traversal
+# -----------------------
+# Instead of following each node recursively (as done in track_entity,
+# track_activity and track_agent), the whole frontier of one level is
+# expanded at once, with one id__in query per relation type. Thus the
+# number of queries only depends on the depth and the number of relation
+# types, not on the number of nodes, and there is no recursion limit.
+
+# A traversal step describes how to get from a node to its neighbours
+# via one relation: key of the relation in the prov dictionary, relation
+# model, field linking to the current node, field linking to the next node
+# and kind of the next node ('entity', 'activity' or 'agent').
+TraversalStep = namedtuple('TraversalStep', ['key', 'model', 'near', 'far', 'far_kind'])
+
+# Relation models, by their key in the prov dictionary
+RELATION_MODELS = {
+    'used': Used,
+    'wasGeneratedBy': WasGeneratedBy,
+    'wasAssociatedWith': WasAssociatedWith,
+    'wasAttributedTo': WasAttributedTo,
+    'hadMember': HadMember,
+    'wasDerivedFrom': WasDerivedFrom,
+    'hadStep': HadStep,
+    'wasInformedBy': WasInformedBy,
+    'parameter': Parameter,
+}
+
+# Maximum number of ids used in one id__in lookup
+# (SQLite allows at most 999 variables per query)
+CHUNK_SIZE = 500
+
+
+def get_traversal_steps(direction='BACK', members_flag=False, steps_flag=False, agent_flag=False):
+    """
+    Return the traversal steps to be followed from entities, activities
+    and agents, as a dictionary with one list of steps per node kind.
+    The relations are the same as followed by track_entity, track_activity
+    and track_agent.
+    """
+    if direction == 'BACK':
+        entity_steps = [
+            TraversalStep('wasDerivedFrom', WasDerivedFrom, 'generatedEntity', 'usedEntity', 'entity'),
+            TraversalStep('wasGeneratedBy', WasGeneratedBy, 'entity', 'activity', 'activity'),
+        ]
+        activity_steps = [
+            TraversalStep('wasInformedBy', WasInformedBy, 'informed', 'informant', 'activity'),
+            TraversalStep('used', Used, 'activity', 'entity', 'entity'),
+        ]
+    else:
+        entity_steps = [
+            TraversalStep('wasDerivedFrom', WasDerivedFrom, 'usedEntity', 'generatedEntity', 'entity'),
+            TraversalStep('used', Used, 'entity', 'activity', 'activity'),
+        ]
+        activity_steps = [
+            TraversalStep('wasInformedBy', WasInformedBy, 'informant', 'informed', 'activity'),
+            TraversalStep('wasGeneratedBy', WasGeneratedBy, 'activity', 'entity', 'entity'),
+        ]
+
+    # collections and agents are found independent of the direction
+    entity_steps.append(TraversalStep('hadMember', HadMember, 'entity', 'collection', 'entity'))
+    if members_flag:
+        entity_steps.append(TraversalStep('hadMember', HadMember, 'collection', 'entity', 'entity'))
+    entity_steps.append(TraversalStep('wasAttributedTo', WasAttributedTo, 'entity', 'agent', 'agent'))
+
+    activity_steps.append(TraversalStep('wasAssociatedWith', WasAssociatedWith, 'activity', 'agent', 'agent'))
+    activity_steps.append(TraversalStep('hadStep', HadStep, 'activity', 'activityFlow', 'activity'))
+    if steps_flag:
+        activity_steps.append(TraversalStep('hadStep', HadStep, 'activityFlow', 'activity', 'activity'))
+
+    # agents are only followed further, if the flag is set
+    agent_steps = []
+    if agent_flag:
+        agent_steps = [
+            TraversalStep('wasAssociatedWith', WasAssociatedWith, 'agent', 'activity', 'activity'),
+            TraversalStep('wasAttributedTo', WasAttributedTo, 'agent', 'entity', 'entity'),
+        ]
+
+    return {'entity': entity_steps, 'activity': activity_steps, 'agent': agent_steps}
+
+
+def chunks(ids, size=CHUNK_SIZE):
+    # split ids into lists of at most size elements, for id__in lookups
+    ids = list(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def bulk_create_objects(model, objs, using=DEFAULT_DB_ALIAS):
+    """
+    bulk_create, also for models with multi-table inheritance (Collection,
+    ActivityFlow), which bulk_create does not support: the rows of the
+    parent (Entity, Activity) are written first, then the links of the
+    subclass table to them. No signals are sent, see signals.py.
+    """
+    if not model._meta.parents:
+        return model.objects.using(using).bulk_create(objs)
+
+    parent = model._meta.get_parent_list()[0]
+    parent_fields = [f.attname for f in parent._meta.concrete_fields]
+    parent.objects.using(using).bulk_create([
+        parent(**dict((name, getattr(obj, name)) for name in parent_fields)) for obj in objs
+    ])
+
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    sql = "INSERT INTO %s (%s) VALUES (%%s)" % (qn(model._meta.db_table), qn(model._meta.pk.column))
+    with connection.cursor() as cursor:
+        for chunk in chunks(obj.pk for obj in objs):
+            cursor.executemany(sql, [(i,) for i in chunk])
+    return objs
+
+
+def bulk_update_objects(model, objs, field_names, using=DEFAULT_DB_ALIAS):
+    """
+    Write the given fields (names or attnames) of the objects with one
+    UPDATE per chunk, setting each field with CASE WHEN pk = ... THEN
+    value ... END. No signals are sent, see signals.py.
+    """
+    fields = [f for f in model._meta.concrete_fields if f.name in field_names or f.attname in field_names]
+    for chunk in chunks(objs):
+        values = {}
+        for field in fields:
+            whens = [When(pk=obj.pk, then=Value(getattr(obj, field.attname), output_field=field)) for obj in chunk]
+            values[field.attname] = Case(*whens, output_field=field)
+        model._base_manager.using(using).filter(pk__in=[obj.pk for obj in chunk]).update(**values)
+
+
+def is_visited(prov, kind, node_id):
+    # check if a node of the given kind is already stored in prov;
+    # activities may be stored as activity or activityFlow
+    if kind == 'activity':
+        return node_id in prov['activity'] or node_id in prov['activityFlow']
+    return node_id in prov[kind]
+
+
+# Node models per node kind and the relations that are loaded together
+# with the nodes (select_related)
+NODE_MODELS = {'entity': Entity, 'activity': Activity, 'agent': Agent}
+NODE_RELATED = {'entity': ['description'], 'activity': ['description', 'activityflow'], 'agent': []}
+
+
+def select_description(queryset):
+    # load the description together with each object, if the model has one
+    if 'description' in [f.name for f in queryset.model._meta.fields]:
+        return queryset.select_related('description')
+    return queryset
+
+
+def store_node(prov, kind, node):
+    # store a node in prov; activities that were loaded with their
+    # activityflow (select_related) are stored as activity or activityFlow
+    if kind == 'activity':
+        try:
+            node.activityflow
+            activity_type = 'activityFlow'
+        except ActivityFlow.DoesNotExist:
+            activity_type = 'activity'
+        prov[activity_type][node.id] = node
+        activity_kind_cache.set(node.id, activity_type)
+    else:
+        prov[kind][node.id] = node
+
+
+def add_nodes(prov, kind, ids):
+    """
+    Load the nodes of the given kind with the given ids from the database
+    and store them in prov. Activities are stored as 'activity' or
+    'activityFlow', depending on their type, which is determined in the
+    same query (left join to activityflow).
+    """
+    model = NODE_MODELS[kind]
+    for chunk in chunks(ids):
+        for node in model.objects.filter(id__in=chunk).select_related(*NODE_RELATED[kind]):
+            store_node(prov, kind, node)
+
+    return prov
+
+
+def resolve_ids(id_list):
+    """
+    Find out which of the given ids belong to entities, activities and
+    agents, with one id__in query per node kind (and chunk of ids).
+    Returns the lists of entity, activity and agent ids.
+    """
+    node_ids = []
+    for kind in ['entity', 'activity', 'agent']:
+        ids = []
+        for chunk in chunks(set(id_list)):
+            ids.extend(NODE_MODELS[kind].objects.filter(id__in=chunk).values_list('id', flat=True))
+        node_ids.append(ids)
+    return node_ids
+
+
+def add_start_nodes(prov, id_list):
+    """
+    Load the entities, activities and agents with the given ids (one
+    query per node kind and chunk of ids) and store them in prov.
+    Unknown ids are ignored. Returns the lists of entity, activity and
+    agent ids that were found.
+    """
+    node_ids = []
+    for kind in ['entity', 'activity', 'agent']:
+        ids = []
+        for chunk in chunks(set(id_list)):
+            for node in NODE_MODELS[kind].objects.filter(id__in=chunk).select_related(*NODE_RELATED[kind]):
+                store_node(prov, kind, node)
+                ids.append(node.id)
+        node_ids.append(ids)
+    return node_ids
+
+
+def get_step_queryset(step, ids):
+    """
+    Return the queryset for following the given traversal step from the
+    nodes with the given ids. The relation description and the next node
+    (with its description) are loaded in the same query, unless the
+    relation links to a subclass (Collection, ActivityFlow); these nodes
+    are loaded separately with add_nodes.
+    """
+    queryset = select_description(step.model.objects.filter(**{step.near + '__in': ids}))
+    if step_loads_far_node(step):
+        related = [step.far] + [step.far + '__' + r for r in NODE_RELATED[step.far_kind]]
+        queryset = queryset.select_related(*related)
+    return queryset
+
+
+def step_loads_far_node(step):
+    far_model = step.model._meta.get_field(step.far).related_model
+    return far_model is NODE_MODELS[step.far_kind]
+
+
+def track_provenance(prov, entity_ids=(), activity_ids=(), agent_ids=(), countdown=-1,
+        direction='BACK', members_flag=False, steps_flag=False, agent_flag=False):
+    """
+    Breadth-first replacement for track_entity, track_activity and track_agent.
+
+    Starts at the entities, activities and agents with the given ids
+    (which must already be stored in prov) and follows at most countdown
+    relations (countdown=-1: follow all relations). Each node is expanded
+    only once, at its shortest distance from the start nodes.
+    Returns the updated prov dictionary.
+    """
+    steps = get_traversal_steps(direction=direction,
+        members_flag=members_flag,
+        steps_flag=steps_flag,
+        agent_flag=agent_flag)
+
+    frontier = {
+        'entity': set(entity_ids),
+        'activity': set(activity_ids),
+        'agent': set(agent_ids) if agent_flag else set()
+    }
+
+    while countdown != 0 and any(frontier.values()):
+        countdown -= 1
+        # next nodes, by kind: id -> node (None, if not loaded yet)
+        found = {'entity': {}, 'activity': {}, 'agent': {}}
+
+        # add parameters of the activities that are followed further
+        for chunk in chunks(frontier['activity']):
+            for p in Parameter.objects.filter(activity__in=chunk).select_related('description'):
+                prov['parameter'][p.id] = p
+
+        for kind in ['entity', 'activity', 'agent']:
+            for step in steps[kind]:
+                loads_far_node = step_loads_far_node(step)
+                for chunk in chunks(frontier[kind]):
+                    for r in get_step_queryset(step, chunk):
+                        # add relation, and remember next node, if not visited yet
+                        prov[step.key][r.id] = r
+                        next_id = getattr(r, step.far + '_id')
+                        if next_id is None or is_visited(prov, step.far_kind, next_id):
+                            continue
+                        if loads_far_node:
+                            found[step.far_kind][next_id] = getattr(r, step.far)
+                        else:
+                            found[step.far_kind].setdefault(next_id, None)
+
+        for kind in ['entity', 'activity', 'agent']:
+            missing = [i for i, node in found[kind].iteritems() if node is None]
+            prov = add_nodes(prov, kind, missing)
+            for node in found[kind].itervalues():
+                if node is not None:
+                    store_node(prov, kind, node)
+
+        # do not follow agents further, unless flag is set
+        if not agent_flag:
+            found['agent'] = {}
+        frontier = dict((kind, set(found[kind])) for kind in found)
+
+    return prov
+
+
+def fill_provenance(prov, node_ids, relation_ids):
+    """
+    Load nodes and relations with the given ids from the database and
+    store them in prov. node_ids is a dictionary of id sets per node kind
+    ('entity', 'activity', 'agent'), relation_ids a dictionary of id sets
+    per relation key (including 'parameter'). Nodes that are already
+    stored in prov are not loaded again.
+    """
+    for kind in ['entity', 'activity', 'agent']:
+        ids = [i for i in node_ids.get(kind, []) if not is_visited(prov, kind, i)]
+        prov = add_nodes(prov, kind, ids)
+
+    for key, ids in relation_ids.iteritems():
+        model = RELATION_MODELS[key]
+        for chunk in chunks(ids):
+            for r in select_description(model.objects.filter(id__in=chunk)):
+                prov[key][r.id] = r
+
+    return prov
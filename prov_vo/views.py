@@ -6,13 +6,14 @@ from datetime import datetime
 from django.conf import settings
 
 from django.shortcuts import get_object_or_404, render
-from django.http import HttpResponse, HttpResponseRedirect, HttpResponseBadRequest, HttpResponseServerError
+from django.http import HttpResponse, HttpResponseRedirect, HttpResponseBadRequest, HttpResponseServerError, HttpResponseNotAllowed, HttpResponseForbidden
 from django.http import Http404
 #from django.template import loader
 from django.core.urlresolvers import reverse
-from django.core.exceptions import ValidationError
+from django.core.exceptions import ValidationError, FieldDoesNotExist
 from django.views import generic
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.db import transaction
 from django.db.models.fields.related import ManyToManyField
 from django.core import serializers
 from django.views.decorators.csrf import csrf_exempt
@@ -24,11 +25,23 @@ from braces.views import JSONResponseMixin
 #from rest_framework.renderers import XMLRenderer
 from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
-from rest_framework import viewsets
+from rest_framework import viewsets, status
+from rest_framework.exceptions import ValidationError as DRFValidationError
 
 import utils
-from utils import QueryDictDALI
+import cte
+import rows
+import responsecache
+import bulkload
+import export
+import compression
+import graphjson
+import fullgraph
+import graphsummary
+import requeststats
+from utils import QueryDictDALI, InvalidDataError
 from decorators import exceptions_to_http_status
+from signals import invalidate_after_bulk_change
 
 from .models import (
     Activity,
@@ -39,15 +52,8 @@ from .models import (
     WasAssociatedWith,
     WasAttributedTo,
     HadMember,
-    HadStep,
     WasDerivedFrom,
-    WasInformedBy,
-    ActivityFlow,
     Collection,
-    Parameter,
-    ParameterDescription,
-    ActivityDescription,
-    EntityDescription,
     UsedDescription,
     WasGeneratedByDescription
     #Bundle,
@@ -70,8 +76,11 @@ from .serializers import (
     W3CProvenanceSerializer,
     VOProvenanceSerializer,
     ProvenanceGraphSerializer,
-    ParameterSerializer
+    ParameterSerializer,
+    BulkListSerializer,
+    get_foreign_key
 )
+from .pagination import KeysetPagination
 
 from .renderers import PROVNRenderer, PROVJSONRenderer, PROVXMLRenderer, W3CPROVXMLRenderer
 from vosi.renderers import VosiAvailabilityRenderer, VosiCapabilityRenderer
@@ -83,39 +92,155 @@ from .forms import ProvDalForm
 class IndexView(generic.TemplateView):
     template_name = 'prov_vo/index.html'
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class BulkModelViewSet(viewsets.ModelViewSet):
+    """
+    ModelViewSet that also accepts a list of objects: POST to the list url
+    creates all of them, PUT or PATCH updates them (identified by their
+    ids). The objects are validated and written at once (see
+    serializers.BulkListSerializer), in one transaction; if any of them
+    is invalid, nothing is written and the errors are returned as a list
+    with one entry per object.
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        if not kwargs.pop('many', False):
+            return super(BulkModelViewSet, self).get_serializer(*args, **kwargs)
+        kwargs['context'] = self.get_serializer_context()
+        child = self.get_serializer_class()(partial=kwargs.get('partial', False), context=kwargs['context'])
+        return BulkListSerializer(*args, child=child, **kwargs)
+
+    def create(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            return super(BulkModelViewSet, self).create(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            created = serializer.save()
+        invalidate_after_bulk_change(created=created)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def bulk_update(self, request, *args, **kwargs):
+        partial = kwargs.pop('partial', False)
+        serializer = self.get_serializer(self.filter_queryset(self.get_queryset()),
+            data=request.data, many=True, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            serializer.save()
+        invalidate_after_bulk_change(graph_changed=False)
+        return Response(serializer.data)
+
+    def partial_bulk_update(self, request, *args, **kwargs):
+        kwargs['partial'] = True
+        return self.bulk_update(request, *args, **kwargs)
+
+class ProvModelViewSet(BulkModelViewSet):
+    """
+    Viewset of the REST API: lists are paginated by primary key (see
+    pagination.py), and the parameter fields (comma-separated output or
+    field names, e.g. fields=prov:id,prov:label) restricts the output
+    of GET requests to these fields and the query to their columns
+    (only()).
+    """
+    pagination_class = KeysetPagination
+
+    def get_selected_fields(self):
+        # names of the serializer fields selected with fields, or None
+        if self.request is None or self.request.method != 'GET':
+            return None
+        param = self.request.query_params.get('fields')
+        if not param:
+            return None
+
+        serializer = self.get_serializer_class()()
+        names = {}
+        for field_name, output_name in serializer.get_output_names().iteritems():
+            names[field_name] = field_name
+            names[output_name] = field_name
+        selected = set()
+        unknown = []
+        for name in param.split(','):
+            name = name.strip()
+            if name in names:
+                selected.add(names[name])
+            elif name:
+                unknown.append(name)
+        if unknown:
+            raise DRFValidationError({'fields': ["Unknown fields: %s" % ', '.join(unknown)]})
+        return selected
+
+    def get_queryset(self):
+        queryset = super(ProvModelViewSet, self).get_queryset()
+        if self.request is None or self.request.method != 'GET':
+            return queryset
+        selected = self.get_selected_fields()
+        if selected is None:
+            # the description is serialized for each object
+            return utils.select_description(queryset)
+
+        # load only the columns of the selected fields (and the primary key)
+        model = queryset.model
+        serializer = self.get_serializer_class()()
+        columns = []
+        for field_name in selected:
+            source = serializer.fields[field_name].source_attrs
+            model_field = get_foreign_key(model, source[0]) if source else None
+            if model_field is None and source:
+                try:
+                    model_field = model._meta.get_field(source[0])
+                except FieldDoesNotExist:
+                    pass
+            if model_field is None or not model_field.concrete:
+                # e.g. method fields, which may need any attribute
+                return utils.select_description(queryset)
+            columns.append(model_field.name)
+        queryset = queryset.only(*columns)
+        if 'description' in columns:
+            queryset = utils.select_description(queryset)
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super(ProvModelViewSet, self).get_serializer(*args, **kwargs)
+        selected = self.get_selected_fields()
+        if selected is not None:
+            child = getattr(serializer, 'child', serializer)
+            for field_name in list(child.fields):
+                if field_name not in selected:
+                    child.fields.pop(field_name)
+        return serializer
+
+class ActivityViewSet(ProvModelViewSet):
     serializer_class = ActivitySerializer
     queryset = Activity.objects.all()
 
-class EntityViewSet(viewsets.ModelViewSet):
+class EntityViewSet(ProvModelViewSet):
     serializer_class = EntitySerializer
     queryset = Entity.objects.all()
 
-class AgentViewSet(viewsets.ModelViewSet):
+class AgentViewSet(ProvModelViewSet):
     serializer_class = AgentSerializer
     queryset = Agent.objects.all()
 
-class UsedViewSet(viewsets.ModelViewSet):
+class UsedViewSet(ProvModelViewSet):
     serializer_class = UsedSerializer
     queryset = Used.objects.all()
 
-class WasGeneratedByViewSet(viewsets.ModelViewSet):
+class WasGeneratedByViewSet(ProvModelViewSet):
     serializer_class = WasGeneratedBySerializer
     queryset = WasGeneratedBy.objects.all()
 
-class WasAssociatedWithViewSet(viewsets.ModelViewSet):
+class WasAssociatedWithViewSet(ProvModelViewSet):
     serializer_class = WasAssociatedWithSerializer
     queryset = WasAssociatedWith.objects.all()
 
-class WasAttributedToViewSet(viewsets.ModelViewSet):
+class WasAttributedToViewSet(ProvModelViewSet):
     serializer_class = WasAttributedToSerializer
     queryset = WasAttributedTo.objects.all()
 
-class HadMemberViewSet(viewsets.ModelViewSet):
+class HadMemberViewSet(ProvModelViewSet):
     serializer_class = HadMemberSerializer
     queryset = HadMember.objects.all()
 
-class WasDerivedFromViewSet(viewsets.ModelViewSet):
+class WasDerivedFromViewSet(ProvModelViewSet):
     serializer_class = WasDerivedFromSerializer
     queryset = WasDerivedFrom.objects.all()
 
@@ -123,78 +248,40 @@ class WasDerivedFromViewSet(viewsets.ModelViewSet):
 #     serializer_class = ActivityFlowSerializer
 #     queryset = ActivityFlow.objects.all()
 
-class CollectionViewSet(viewsets.ModelViewSet):
+class CollectionViewSet(ProvModelViewSet):
     serializer_class = W3CCollectionSerializer
     queryset = Collection.objects.all()
 
 
-def convert_to_dict_querysets(listqueryset):
-
-    objdict = {}
-    for q in listqueryset:
-        objdict[q.id] = q
-
-    return objdict
-
-
-# simple view to serialize everything, W3C compatible
+# simple view to serialize everything, W3C compatible (or IVOA with MODEL=IVOA);
+# the tables are read in chunks and the document is streamed, see export.py
 def allprov(request, format):
 
-    # first store everything in a prov-dictionary
-    prefix = {
-        "voprov": "http://www.ivoa.net/documents/ProvenanceDM/voprov/",
-        "org": "http://www.ivoa.net/documents/ProvenanceDM/voprov/org/",
-        "vo": "http://www.ivoa.net/documents/ProvenanceDM/voprov/vo",
-        "prov": "http://www.w3.org/ns/prov#",  # defined by default
-        "xsd": "http://www.w3.org/2000/10/XMLSchema#"  # defined by default
-    }
-
-    # add prefixes from settings, if existing:
+    model = request.GET.get('MODEL', 'W3C')
+    if model not in export.PROVENANCE_SERIALIZERS:
+        return HttpResponseBadRequest("Bad request: the value '%s' is not supported for parameter MODEL" % (model))
     try:
-        for key, value in settings.PROV_VO_CONFIG.namespaces.items():
-            prefix[key] = value
-    except:
-        pass
-
-
-    prov = {
-        'prefix': prefix,
-        'activity': convert_to_dict_querysets(Activity.objects.all()),
-        'activityFlow': convert_to_dict_querysets(ActivityFlow.objects.all()),
-        'entity': convert_to_dict_querysets(Entity.objects.all()),
-        'collection': convert_to_dict_querysets(Collection.objects.all()),
-        'agent': convert_to_dict_querysets(Agent.objects.all()),
-        'used': convert_to_dict_querysets(Used.objects.all()),
-        'wasGeneratedBy': convert_to_dict_querysets(WasGeneratedBy.objects.all()),
-        'wasAssociatedWith': convert_to_dict_querysets(WasAssociatedWith.objects.all()),
-        'wasAttributedTo': convert_to_dict_querysets(WasAttributedTo.objects.all()),
-        'hadMember': convert_to_dict_querysets(HadMember.objects.all()),
-        'wasDerivedFrom': convert_to_dict_querysets(WasDerivedFrom.objects.all()),
-        'hadStep': convert_to_dict_querysets(HadStep.objects.all()),
-        'wasInformedBy': convert_to_dict_querysets(WasInformedBy.objects.all()),
-        'parameter': convert_to_dict_querysets(Parameter.objects.all()),
-        'parameterDescription': convert_to_dict_querysets(ParameterDescription.objects.all()),
-        'activityDescription': convert_to_dict_querysets(ActivityDescription.objects.all()),
-        'entityDescription': convert_to_dict_querysets(EntityDescription.objects.all())
-    }
-
-    # serialize it (W3C):
-    serializer = W3CProvenanceSerializer(prov)
-    data = serializer.data
+        pretty = set_true_false('PRETTY', request.GET.get('PRETTY', str(utils.get_config('pretty_json', False))))
+    except InvalidDataError as e:
+        return HttpResponseBadRequest(str(e))
 
     # write provenance information in desired format:
     if format == 'PROV-N':
-        provstr = PROVNRenderer().render(data)
-        return HttpResponse(provstr, content_type='text/plain; charset=utf-8')
+        renderer = PROVNRenderer()
+        content_type = 'text/plain; charset=utf-8'
 
     elif format == 'PROV-JSON':
-        json_str = PROVJSONRenderer().render(data)
-        return HttpResponse(json_str, content_type='application/json; charset=utf-8')
+        renderer = get_json_renderer(pretty)
+        content_type = 'application/json; charset=utf-8'
 
     else:
         # format is not known, return error
         return HttpResponseBadRequest('Bad request: format %s is not supported by this service.' % format)
 
+    response = StreamingHttpResponse(renderer.render_sections(export.get_export_sections(model=model)),
+        content_type=content_type)
+    return compression.encode_response(response, compression.get_encoding(request))
+
 
 def prettyprovn(request):
     # use hyperlinks for ids
@@ -222,76 +309,22 @@ def graph(request):
     return render(request, 'prov_vo/graph.html', {'url': 'graphjson'})
 
 
+@exceptions_to_http_status
 def fullgraphjson(request):
-    # TODO: should construct this similar to provdal-version
-
-    activity_list = Activity.objects.all()
-    entity_list = Entity.objects.all()
-    agent_list = Agent.objects.all()
-
-    used_list = Used.objects.all()
-    wasGeneratedBy_list = WasGeneratedBy.objects.all()
-    wasAssociatedWith_list = WasAssociatedWith.objects.all()
-    wasAttributedTo_list = WasAttributedTo.objects.all()
-    hadMember_list = HadMember.objects.all()
-
-    nodes_dict = []
-    count_nodes = 0
-    count_act = 0
-
-    links_dict = []
-    count_link = 0
-
-    map_activity_ids = {}
-    map_entity_ids = {}
-    map_agent_ids = {}
-
-
-    for a in activity_list:
-        nodes_dict.append({"name": a.name, "type": "activity"})
-        map_activity_ids[a.id] = count_nodes
-        count_nodes = count_nodes + 1
-
-    for e in entity_list:
-        nodes_dict.append({"name": e.name, "type": "entity"})
-        map_entity_ids[e.id] = count_nodes
-        count_nodes = count_nodes + 1
+    # graph of the complete database, see fullgraph.py for the parameters
+    options = fullgraph.get_fullgraph_options(request.GET)
+    content = fullgraph.FullGraph(**options).iter_json()
+    response = StreamingHttpResponse(content, content_type='application/json')
+    return compression.encode_response(response, compression.get_encoding(request))
 
-    for ag in agent_list:
-        nodes_dict.append({"name": ag.name, "type": "agent"})
-        map_agent_ids[ag.id] = count_nodes
-        count_nodes = count_nodes + 1
 
-    # add links (source, target, value)
-    for u in used_list:
-        links_dict.append({"source": map_activity_ids[u.activity.id], "target": map_entity_ids[u.entity.id], "value": 0.5, "type": "used"})
-        count_link = count_link + 1
-
-    for w in wasGeneratedBy_list:
-        links_dict.append({"source": map_entity_ids[w.entity.id], "target": map_activity_ids[w.activity.id], "value": 0.5, "type": "wasGeneratedBy"})
-        count_link = count_link + 1
-
-    for w in wasAssociatedWith_list:
-        links_dict.append({"source": map_activity_ids[w.activity.id], "target": map_agent_ids[w.agent.id], "value": 0.2, "type": "wasAssociatedWith"})
-        count_link = count_link + 1
-
-    for w in wasAttributedTo_list:
-        links_dict.append({"source": map_entity_ids[w.entity.id], "target": map_agent_ids[w.agent.id], "value": 0.2, "type": "wasAttributedTo"})
-        count_link = count_link + 1
-
-    for h in hadMember_list:
-        s =  map_entity_ids[h.collection_id]
-        #print >>sys.stderr, 'h.collection_id, h.entity_id: ', h.collection_id, ", '"+h.entity_id+"'"
-        t = map_entity_ids[h.entity_id]
-        #print "map_entity_ids[h.collection_id]"
-        #links_dict.append({"source": map_entity_ids[h.collection_id], "target": map_entity_ids[h.entity_id], "value": 0.2, "type": "hadMember"})
-        links_dict.append({"source": s, "target": t, "value": 0.2, "type": "hadMember"})
-        count_link = count_link + 1
-
-
-    prov_dict = {"nodes": nodes_dict, "links": links_dict}
-
-    return JsonResponse(prov_dict)
+@exceptions_to_http_status
+def summarygraph(request):
+    # level-of-detail graph, see graphsummary.py
+    node_id = request.GET.get('node') or None
+    digest = graphsummary.get_summary_digest(node_id)
+    return responsecache.cached_response(request, digest,
+        lambda: graphsummary.get_summary_response(node_id))
 
 
 def provdal_form(request):
@@ -362,6 +395,100 @@ def provdal(request):
     h = QueryDictDALI(querydict=request.GET) #make a copy from req.GET right here?
     #h = upper_case_params_querydict(request.GET)
 
+    return get_provdal(request, h)
+
+
+@csrf_exempt
+@exceptions_to_http_status
+def provdal_batch(request):
+    """
+    Batch version of provdal for many ids, e.g. for a whole catalogue:
+    the parameters are POSTed, either as JSON object (with a list of
+    ids for ID) or as form data, where the ids can also be given in
+    uploaded text files (one id per line). The parameters are the same
+    as for provdal, with the additional parameter MODE: MERGED (default)
+    returns one provenance record for all ids, NODES a JSON object with
+    the ids of the nodes in the provenance of each single id.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    h = get_batch_parameters(request)
+    mode = h.getsingle('MODE', default='MERGED', removekey=True).upper()
+    if mode not in ['MERGED', 'NODES']:
+        return HttpResponseBadRequest("Bad request: the value '%s' is not supported for parameter MODE" % (mode))
+    if h.getsingle('RESPONSEFORMAT') == 'GRAPH':
+        return HttpResponseBadRequest("Bad request: RESPONSEFORMAT=GRAPH is not supported for batch requests, use GRAPH-JSON.")
+
+    num_ids = len(h.getlist('ID'))
+    max_ids = utils.get_config('batch_max_ids', 10000)
+    if num_ids > max_ids:
+        return HttpResponseBadRequest("Bad request: at most %d ids are allowed in one batch request, but %d were given." % (max_ids, num_ids))
+
+    return get_provdal(request, h, nodes_only=(mode == 'NODES'))
+
+
+@csrf_exempt
+@exceptions_to_http_status
+def provload(request):
+    """
+    Load the provenance records of a PROV-JSON document (MODEL=IVOA),
+    POSTed as request body or as uploaded file(s), into the database;
+    returns the numbers of records read, created, skipped as duplicates
+    or unresolved per section. Only available if 'load_endpoint' is set
+    in PROV_VO_CONFIG.
+    """
+    if not utils.get_config('load_endpoint', False):
+        return HttpResponseForbidden("Loading provenance records is not enabled.")
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    loader = bulkload.ProvLoader(batch_size=utils.get_config('load_batch_size', 1000))
+    if request.FILES:
+        for f in request.FILES.itervalues():
+            loader.load(f)
+    else:
+        loader.load(request)
+
+    stats = dict((section, counts) for section, counts in loader.stats.iteritems() if counts['read'])
+    return JsonResponse({
+        'sections': stats,
+        'totals': loader.get_totals(),
+        'unresolved': [{'section': section, 'id': obj_id, 'references': dict(references)}
+            for section, obj_id, references in loader.unresolved],
+    })
+
+
+def get_batch_parameters(request):
+    # collect the parameters of a batch request, with upper case names
+    h = QueryDictDALI()
+    if request.content_type == 'application/json':
+        try:
+            params = json.loads(request.body)
+        except ValueError:
+            raise InvalidDataError("Bad request: the request body is not valid JSON.")
+        if not isinstance(params, dict):
+            raise InvalidDataError("Bad request: the request body must be a JSON object.")
+        for key, value in params.iteritems():
+            values = value if isinstance(value, list) else [value]
+            h.setlist(key, [unicode(v).upper() if isinstance(v, bool) else unicode(v) for v in values])
+    else:
+        for key, values in request.POST.iterlists():
+            h.setlist(key, values)
+        for f in request.FILES.itervalues():
+            ids = [line.strip() for line in f.read().decode('utf-8').splitlines()]
+            h.setlist('ID', h.getlist('ID') + [i for i in ids if i])
+
+    h.make_upper_case_parameter_names()
+    return h
+
+
+def get_provdal(request, h, nodes_only=False):
+    """
+    Check the (upper case) parameters of a provdal request and return
+    the provenance record, or only the node ids in the provenance of
+    each single id, if nodes_only is set.
+    """
     # There can be more than one ID given, thus use getlist:
     if 'ID' not in h:
         return HttpResponse('Bad request: the ID parameter is required.', status=400)
@@ -378,6 +505,9 @@ def provdal(request):
 
     # only in this implementation, not part of the standard
     model = h.getsingle('MODEL', default='IVOA', removekey=True)  # one of IVOA, W3C (or None?)
+    pretty = h.getsingle('PRETTY', default=str(utils.get_config('pretty_json', False)), removekey=True)  # indented PROV-JSON
+    compact = h.getsingle('COMPACT', default='FALSE', removekey=True)  # columnar GRAPH-JSON
+    layout = h.getsingle('LAYOUT', default=None, removekey=True)  # node coordinates for compact GRAPH-JSON
 
     # if there are any more (unexpected) parameters, throw an error
     if len(h.keys()) > 0:
@@ -400,7 +530,7 @@ def provdal(request):
         for i in id_list:
             ids += 'ID=%s&' % i
         return render(request, 'prov_vo/provdal_graph.html',
-            {'url': reverse('prov_vo:provdal') + "?%sDEPTH=%s&DIRECTION=%s&MEMBERS=%s&STEPS=%s&AGENT=%s&RESPONSEFORMAT=GRAPH-JSON&MODEL=%s" % (ids, str(depth), str(direction), str(members_flag), str(steps_flag), str(agent_flag), str(model))})
+            {'url': reverse('prov_vo:provdal') + "?%sDEPTH=%s&DIRECTION=%s&MEMBERS=%s&STEPS=%s&AGENT=%s&RESPONSEFORMAT=GRAPH-JSON&MODEL=%s&COMPACT=TRUE&LAYOUT=LAYERED" % (ids, str(depth), str(direction), str(members_flag), str(steps_flag), str(agent_flag), str(model))})
 
     # check flags
     countdown = -1
@@ -419,7 +549,50 @@ def provdal(request):
     members_flag = set_true_false('MEMBERS', members_flag)
     steps_flag = set_true_false('STEPS', steps_flag)
     agent_flag = set_true_false('AGENT', agent_flag)
+    pretty = set_true_false('PRETTY', pretty)
+    compact = set_true_false('COMPACT', compact)
+    if compact and format != 'GRAPH-JSON':
+        return HttpResponseBadRequest("Bad request: COMPACT=TRUE is only supported for RESPONSEFORMAT=GRAPH-JSON")
+    if layout is not None:
+        layout = layout.upper()
+        if layout not in graphjson.LAYOUTS:
+            return HttpResponseBadRequest("Bad request: the value '%s' is not supported for parameter LAYOUT" % (layout))
+        if not compact:
+            return HttpResponseBadRequest("Bad request: LAYOUT is only supported with COMPACT=TRUE")
+
+    flags = {
+        'direction': direction,
+        'members_flag': members_flag,
+        'steps_flag': steps_flag,
+        'agent_flag': agent_flag
+    }
+
+    if nodes_only:
+        node_sets = rows.track_node_sets(id_list, countdown, **flags)
+        return JsonResponse(dict(
+            (obj_id, dict((kind, sorted(ids)) for kind, ids in node_ids.iteritems()))
+            for obj_id, node_ids in node_sets.iteritems()
+        ))
+
+    # identical requests are answered from the response cache, if enabled
+    stats = requeststats.get_request_stats()
+    options = {'pretty': pretty, 'compact': compact, 'layout': layout}
+    digest = responsecache.get_params_digest(id_list, countdown, model, format, flags, **options)
+    response = responsecache.cached_response(request, digest,
+        lambda: get_provdal_response(id_list, countdown, model, format, flags, stats=stats, **options))
+    return stats.finish(request, response)
+
 
+def get_provdal_response(id_list, countdown, model, format, flags, pretty=False, compact=False, layout=None,
+        stats=requeststats.NO_STATS):
+    """
+    Find the provenance of the nodes with the given ids and return the
+    response with the provenance record, serialized according to model
+    and rendered in the given format (PROV-JSON indented if pretty is
+    set, otherwise compact). With compact, the GRAPH-JSON is built from
+    the traversal result directly, see graphjson.py. The phases are
+    measured in stats, see requeststats.py.
+    """
     prefix = {
         "voprov": "http://www.ivoa.net/documents/ProvenanceDM/ns/voprov/",
         "custom": "http://www.ivoa.net/documents/ProvenanceDM/ns/custom/",  # some extra keywords
@@ -458,57 +631,42 @@ def provdal(request):
         'wasGeneratedByDescription': {}
     }
 
-    # Note: even if collection class is used, Entity.objects.all() still contains all entities
-    for obj_id in id_list:
-        #print 'obj_id: ', obj_id
-        try:
-            entity = Entity.objects.get(id=obj_id)
-            # store current entity in dict and search for provenance:
-            prov['entity'][entity.id] = entity
-            prov = utils.track_entity(entity, prov, countdown,
-                direction=direction,
-                members_flag=members_flag,
-                steps_flag=steps_flag,
-                agent_flag=agent_flag)
-        except Entity.DoesNotExist:
-            pass
-            # do not return, just continue with other ids
-            # (and if none of them exists, return empty provenance record)
-
-
-        try:
-            activity = Activity.objects.get(id=obj_id)
-            # or store current activity and search for its provenance
-            activity_type = utils.get_activity_type(obj_id)
-
-            prov[activity_type][activity.id] = activity
-            prov = utils.track_activity(activity, prov, countdown,
-                direction=direction,
-                members_flag=members_flag,
-                steps_flag=steps_flag,
-                agent_flag=agent_flag)
-        except Activity.DoesNotExist:
-            pass
-        try:
-            agent = Agent.objects.get(id=obj_id)
-            prov['agent'][agent.id] = agent
-            if agent_flag:
-                prov = utils.track_agent(agent, prov, countdown,
-                    direction=direction,
-                    members_flag=members_flag,
-                    steps_flag=steps_flag,
-                    agent_flag=agent_flag)
-        except Agent.DoesNotExist:
-            pass
-
-
-    # now add all linked descriptions
-    for key in ['entity', 'activity', 'used', 'wasGeneratedBy', 'parameter']:
-        if key in prov:
-            for id, o in prov[key].iteritems():
-                if o.description:
-                    prov[key + 'Description'][o.description.id] = o.description
-
+    if model == "IVOA" and rows.row_traversal_enabled():
+        # load everything as values() rows, without model instances
+        with stats.phase('resolve'):
+            entity_ids, activity_ids, agent_ids = utils.resolve_ids(id_list)
+        with stats.phase('traversal'):
+            node_ids, relation_ids = rows.find_provenance_ids(
+                entity_ids, activity_ids, agent_ids, countdown, **flags)
+            prov = rows.add_graph_rows(prov, node_ids, relation_ids)
+        with stats.phase('descriptions'):
+            prov = rows.add_description_rows(prov)
+    else:
+        # Note: even if collection class is used, Entity.objects.all() still contains all entities
+        # (unknown ids are skipped; if none of them exists, return empty provenance record)
+        with stats.phase('resolve'):
+            entity_ids, activity_ids, agent_ids = utils.add_start_nodes(prov, id_list)
+
+        # search for the provenance of all given nodes at once
+        with stats.phase('traversal'):
+            prov = find_provenance(prov, entity_ids, activity_ids, agent_ids, countdown, **flags)
+
+
+        # now add all linked descriptions
+        with stats.phase('descriptions'):
+            for key in ['entity', 'activity', 'used', 'wasGeneratedBy', 'parameter']:
+                if key in prov:
+                    for id, o in prov[key].iteritems():
+                        if o.description:
+                            prov[key + 'Description'][o.description.id] = o.description
+    stats.count(prov)
+
+    # the compact graph needs only the nodes and relations, not serialized
+    if compact:
+        with stats.phase('serialization'):
+            graph = graphjson.get_compact_graph(prov, layout=layout)
+        with stats.phase('rendering'):
+            return JsonResponse(graph)
 
     # The prov dictionary now contains the complete provenance information,
     # for all given entity ids,
@@ -521,29 +679,52 @@ def provdal(request):
     else:
         return HttpResponseBadRequest("Bad request: the value '%s' is not supported for parameter MODEL" % (model))
 
-    data = serializer.data
+    # Large records are streamed section by section,
+    # without building the complete document in memory
+    if count_records(prov) >= utils.get_config('stream_min_records', 10000):
+        if format == 'PROV-JSON':
+            return StreamingHttpResponse(get_json_renderer(pretty).render_stream(serializer),
+                content_type='application/json; charset=utf-8')
+        elif format == 'PROV-N':
+            return StreamingHttpResponse(PROVNRenderer().render_stream(serializer),
+                content_type='text/plain; charset=utf-8')
+        elif format == 'PROV-XML':
+            if model == "W3C":
+                renderer = W3CPROVXMLRenderer()
+            else:
+                renderer = PROVXMLRenderer()
+            return StreamingHttpResponse(renderer.render_stream(serializer),
+                content_type='application/xml; charset=utf-8')
+
+    with stats.phase('serialization'):
+        data = serializer.data
 
     # Render provenance information in desired format:
     if format == 'PROV-N':
-        provstr = PROVNRenderer().render(data)
+        with stats.phase('rendering'):
+            provstr = PROVNRenderer().render(data)
         return HttpResponse(provstr, content_type='text/plain; charset=utf-8')
 
     elif format == 'PROV-JSON':
-        json_str = PROVJSONRenderer().render(data)
+        with stats.phase('rendering'):
+            json_str = get_json_renderer(pretty).render(data)
         return HttpResponse(json_str, content_type='application/json; charset=utf-8')
 
     elif format == 'PROV-XML':
-        if model == "W3C":
-            xml_str = W3CPROVXMLRenderer().render(data)
-        else:
-            xml_str = PROVXMLRenderer().render(data)
+        with stats.phase('rendering'):
+            if model == "W3C":
+                xml_str = W3CPROVXMLRenderer().render(data)
+            else:
+                xml_str = PROVXMLRenderer().render(data)
         return HttpResponse(xml_str, content_type='application/xml; charset=utf-8')
 
     elif format == "GRAPH-JSON":
         # need to re-structure the serialized data
-        serializer = ProvenanceGraphSerializer(data, model=model)
-        prov_dict = serializer.data
-        return JsonResponse(prov_dict)
+        with stats.phase('serialization'):
+            serializer = ProvenanceGraphSerializer(data, model=model)
+            prov_dict = serializer.data
+        with stats.phase('rendering'):
+            return JsonResponse(prov_dict)
 
     else:
         # format is not known, return error
@@ -552,6 +733,35 @@ def provdal(request):
         return HttpResponse(provstr, status=415, content_type='text/plain; charset=utf-8')
 
 
+def get_json_renderer(pretty):
+    # PROV-JSON renderer, indented only if requested
+    return PROVJSONRenderer(indent=4 if pretty else None)
+
+
+def count_records(prov):
+    # number of nodes, relations, parameters and descriptions
+    return sum(len(value) for key, value in prov.iteritems() if key != 'prefix')
+
+
+def find_provenance(prov, entity_ids, activity_ids, agent_ids, countdown, **flags):
+    # The way of finding the provenance is chosen by rows.choose_traversal.
+    # The recursive query and the level-by-level traversal load the model
+    # instances directly, the other ways find the ids, whose objects are
+    # loaded afterwards.
+    num_start_nodes = len(entity_ids) + len(activity_ids) + len(agent_ids)
+    traversal = rows.choose_traversal(num_start_nodes, countdown)
+
+    if traversal == rows.RECURSIVE_CTE:
+        return cte.track_provenance_cte(prov, entity_ids, activity_ids, agent_ids, **flags)
+
+    if traversal == rows.BREADTH_FIRST:
+        return utils.track_provenance(prov, entity_ids, activity_ids, agent_ids, countdown, **flags)
+
+    node_ids, relation_ids = rows.find_provenance_ids(
+        entity_ids, activity_ids, agent_ids, countdown, **flags)
+    return utils.fill_provenance(prov, node_ids, relation_ids)
+
+
 def check_accept_header_reponseformat(request, format):
 
     if 'HTTP_ACCEPT' in request.META:
@@ -1,26 +1,46 @@
 import datetime
+import gzip
+import hashlib
+import os
 import re
 import json
+import logging
+import shutil
+import tempfile
+from collections import OrderedDict
 
 from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.utils import timezone
 from django.test import TestCase
-
-from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command, CommandError
+from django.utils.six import StringIO
+
+from django.test import Client, RequestFactory
 from django.test.utils import setup_test_environment
 
 from prov_vo.models import Activity, ActivityFlow, HadStep
 from prov_vo.models import Entity, Collection, WasGeneratedBy, Used, WasDerivedFrom, WasInformedBy, HadMember
-from prov_vo.models import Agent, WasAssociatedWith, WasAttributedTo
+from prov_vo.models import Agent, WasAssociatedWith, WasAttributedTo, Lineage
 from prov_vo.models import Parameter, ParameterDescription
 from prov_vo.models import ActivityDescription, EntityDescription, UsedDescription, WasGeneratedByDescription
 
 from prov_vo.forms import ProvDalForm
+from prov_vo.serializers import VOProvenanceSerializer, W3CProvenanceSerializer
+from prov_vo import serializers
+from prov_vo.renderers import PROVJSONRenderer, PROVNRenderer, EntityPROVNRenderer
+from prov_vo.renderers import PROVXMLRenderer, W3CPROVXMLRenderer
+from lxml import etree
+from prov_vo import utils, cte, graphindex, rows, closurecache, responsecache, views, bulkload, export, compression, graphjson, fullgraph, graphsummary, lineage, requeststats
+from prov_vo.management.commands import prov_explain
 
 
 def get_content(response):
-    content = re.sub(r'document.*\n', '', response.content)
+    content = re.sub(r'document.*\n', '', response.getvalue())
     content = re.sub(r'endDocument', '', content)
     content = re.sub(r'prefix.*\n', '', content)
 
@@ -1347,6 +1367,1878 @@ class ProvDAL_Graph_TestCase(TestCase):
 """ "links": [{"source": 2, "type": "hadStep", "target": 0, "value": 0.2}, {"source": 0, "type": "wasInformedBy", "target": 1, "value": 0.2}]}"""
         self.assertEqual(response.content, expected)
 
+class ProvDAL_Traversal_TestCase(TestCase):
+
+    def setUp(self):
+        # same graph as in ProvDAL_Graph_TestCase
+        e = Entity.objects.create(id="rave:dr4", name="RAVE DR4")
+        e0 = Entity.objects.create(id="rave:obs", name="RAVE observations")
+        WasDerivedFrom.objects.create(generatedEntity=e, usedEntity=e0)
+
+        a1 = Activity.objects.create(id="rave:act1", name="Activity step 1")
+        a2 = Activity.objects.create(id="rave:act2", name="Activity step 2")
+        af = ActivityFlow.objects.create(id="rave:actflow", name="Activity flow")
+        HadStep.objects.create(activityFlow=af, activity=a1)
+        HadStep.objects.create(activityFlow=af, activity=a2)
+        WasInformedBy.objects.create(informed=a2, informant=a1)
+        Used.objects.create(activity=a1, entity=e0)
+        WasGeneratedBy.objects.create(entity=e, activity=a1)
+
+        c = Collection.objects.create(id="rave:raw", name="RAVE raw data files")
+        HadMember.objects.create(collection=c, entity=e0)
+
+        ag = Agent.objects.create(id="org:rave", name="RAVE project")
+        WasAssociatedWith.objects.create(activity=a1, agent=ag)
+        WasAttributedTo.objects.create(entity=e, agent=ag)
+
+    def get_empty_prov(self):
+        keys = ['activity', 'activityFlow', 'entity', 'collection', 'agent',
+            'used', 'wasGeneratedBy', 'wasAssociatedWith', 'wasAttributedTo',
+            'hadMember', 'wasDerivedFrom', 'wasInfluencedBy', 'hadStep', 'wasInformedBy',
+            'parameter', 'parameterDescription', 'activityDescription', 'entityDescription',
+            'usedDescription', 'wasGeneratedByDescription']
+        return dict((key, {}) for key in keys)
+
+    def get_ids(self, prov):
+        return dict((key, set(value.keys())) for key, value in prov.iteritems())
+
+    def track_recursive(self, obj_id, countdown, **flags):
+        prov = self.get_empty_prov()
+        if Entity.objects.filter(id=obj_id).exists():
+            entity = Entity.objects.get(id=obj_id)
+            prov['entity'][entity.id] = entity
+            prov = utils.track_entity(entity, prov, countdown, **flags)
+        if Activity.objects.filter(id=obj_id).exists():
+            activity = Activity.objects.get(id=obj_id)
+            prov[utils.get_activity_type(obj_id)][activity.id] = activity
+            prov = utils.track_activity(activity, prov, countdown, **flags)
+        if Agent.objects.filter(id=obj_id).exists():
+            agent = Agent.objects.get(id=obj_id)
+            prov['agent'][agent.id] = agent
+            if flags['agent_flag']:
+                prov = utils.track_agent(agent, prov, countdown, **flags)
+        return prov
+
+    def get_start_nodes(self, obj_id):
+        prov = self.get_empty_prov()
+        entity_ids = []
+        activity_ids = []
+        agent_ids = []
+        for entity in Entity.objects.filter(id=obj_id):
+            prov['entity'][entity.id] = entity
+            entity_ids.append(entity.id)
+        for activity in Activity.objects.filter(id=obj_id):
+            prov[utils.get_activity_type(obj_id)][activity.id] = activity
+            activity_ids.append(activity.id)
+        for agent in Agent.objects.filter(id=obj_id):
+            prov['agent'][agent.id] = agent
+            agent_ids.append(agent.id)
+        return prov, entity_ids, activity_ids, agent_ids
+
+    def track_breadth_first(self, obj_id, countdown, **flags):
+        prov, entity_ids, activity_ids, agent_ids = self.get_start_nodes(obj_id)
+        return utils.track_provenance(prov, entity_ids, activity_ids, agent_ids, countdown, **flags)
+
+    def track_cte(self, obj_id, **flags):
+        prov, entity_ids, activity_ids, agent_ids = self.get_start_nodes(obj_id)
+        return cte.track_provenance_cte(prov, entity_ids, activity_ids, agent_ids, **flags)
+
+    def track_index(self, index, obj_id, countdown, **flags):
+        prov, entity_ids, activity_ids, agent_ids = self.get_start_nodes(obj_id)
+        node_ids, relation_ids = index.track(entity_ids, activity_ids, agent_ids, countdown, **flags)
+        return utils.fill_provenance(prov, node_ids, relation_ids)
+
+    def test_sameAsRecursive(self):
+        # without agents, this graph has no shortcuts that are found later
+        # than a longer path, so both traversals must find exactly the same
+        # nodes and relations; with agents, e.g. rave:dr4 is reached from
+        # rave:act1 via org:rave first, one relation further than directly
+        for obj_id in ['rave:dr4', 'rave:obs', 'rave:act1', 'rave:actflow', 'org:rave']:
+            for countdown in [0, 1, 2, 3, -1]:
+                for direction in ['BACK', 'FORTH']:
+                    for members_flag in [False, True]:
+                        for steps_flag in [False, True]:
+                            for agent_flag in [False, True]:
+                                flags = {
+                                    'direction': direction,
+                                    'members_flag': members_flag,
+                                    'steps_flag': steps_flag,
+                                    'agent_flag': agent_flag
+                                }
+                                if agent_flag and countdown != -1:
+                                    continue
+                                expected = self.get_ids(self.track_recursive(obj_id, countdown, **flags))
+                                found = self.get_ids(self.track_breadth_first(obj_id, countdown, **flags))
+                                self.assertEqual(found, expected, msg="%s, %s, %s" % (obj_id, countdown, flags))
+
+    def test_depthShortcutFoundLater(self):
+        # rave:obs is reached from rave:s0 via rave:l1 first (depth-first),
+        # but its shortest distance is 1 via the shortcut relation; the
+        # relations of rave:s0 are read in the order of their ids or, using
+        # the index, of the used entities, rave:l1 comes first in both cases
+        Entity.objects.create(id="rave:s0", name="Shortcut start")
+        Entity.objects.create(id="rave:l1", name="Long path")
+        WasDerivedFrom.objects.create(generatedEntity_id="rave:s0", usedEntity_id="rave:l1")
+        WasDerivedFrom.objects.create(generatedEntity_id="rave:l1", usedEntity_id="rave:obs")
+        WasDerivedFrom.objects.create(generatedEntity_id="rave:s0", usedEntity_id="rave:obs")
+
+        expected = set(['rave:s0', 'rave:l1', 'rave:obs', 'rave:raw'])
+        prov = self.track_breadth_first('rave:s0', 2)
+        self.assertEqual(set(prov['entity'].keys()), expected)
+        # the recursive traversal stops at rave:obs, since it was visited before
+        prov = self.track_recursive('rave:s0', 2, agent_flag=False)
+        self.assertNotIn('rave:raw', prov['entity'])
+
+        client = Client()
+        response = client.get(reverse('prov_vo:provdal')+'?ID=rave:s0&DEPTH=2&RESPONSEFORMAT=PROV-JSON')
+        content = json.loads(response.content)
+        self.assertEqual(set(content['entity'].keys()), expected)
+
+    def test_depthDiamond(self):
+        # two paths of the same length to rave:obs: the entity is found once,
+        # with both wasDerivedFrom relations
+        Entity.objects.create(id="rave:d0", name="Diamond start")
+        for side in ['left', 'right']:
+            Entity.objects.create(id="rave:" + side, name=side)
+            WasDerivedFrom.objects.create(generatedEntity_id="rave:d0", usedEntity_id="rave:" + side)
+            WasDerivedFrom.objects.create(generatedEntity_id="rave:" + side, usedEntity_id="rave:obs")
+
+        for depth, entities, relations in [(1, 3, 2), (2, 4, 4), (3, 5, 5)]:
+            prov = self.track_breadth_first('rave:d0', depth)
+            self.assertEqual(len(prov['entity']), entities)
+            self.assertEqual(len(prov['wasDerivedFrom']) + len(prov['hadMember']), relations)
+
+    def test_getProvdalDepthAllLongChain(self):
+        # a chain longer than the recursion limit
+        num = 1100
+        Entity.objects.bulk_create([Entity(id="ex:e%d" % i, name="Entity %d" % i) for i in range(num)])
+        WasDerivedFrom.objects.bulk_create([
+            WasDerivedFrom(generatedEntity_id="ex:e%d" % i, usedEntity_id="ex:e%d" % (i+1)) for i in range(num-1)
+        ])
+        client = Client()
+        response = client.get(reverse('prov_vo:provdal')+'?ID=ex:e0&DEPTH=ALL&RESPONSEFORMAT=PROV-JSON')
+        self.assertEqual(response.status_code, 200)
+        content = json.loads(response.content)
+        self.assertEqual(len(content['entity']), num)
+        self.assertEqual(len(content['wasDerivedFrom']), num-1)
+
+    def test_recursiveCTESameAsBreadthFirst(self):
+        self.assertTrue(cte.supports_recursive_cte())
+        for obj_id in ['rave:dr4', 'rave:obs', 'rave:act1', 'rave:actflow', 'org:rave']:
+            for direction in ['BACK', 'FORTH']:
+                for members_flag in [False, True]:
+                    for steps_flag in [False, True]:
+                        for agent_flag in [False, True]:
+                            flags = {
+                                'direction': direction,
+                                'members_flag': members_flag,
+                                'steps_flag': steps_flag,
+                                'agent_flag': agent_flag
+                            }
+                            expected = self.get_ids(self.track_breadth_first(obj_id, -1, **flags))
+                            found = self.get_ids(self.track_cte(obj_id, **flags))
+                            self.assertEqual(found, expected, msg="%s, %s" % (obj_id, flags))
+
+    def test_recursiveCTERelationIdTypes(self):
+        # relation ids are returned as primary keys, like for the other traversals
+        flags = {'members_flag': True, 'steps_flag': True, 'agent_flag': True}
+        node_ids, relation_ids = cte.get_provenance_ids_cte(['rave:dr4'], **flags)
+        expected_nodes, expected_relations = rows.track_provenance_ids(['rave:dr4'], countdown=-1, **flags)
+        self.assertEqual(relation_ids, dict((k, v) for k, v in expected_relations.items() if v))
+        self.assertIn('wasDerivedFrom', relation_ids)
+        for key, ids in relation_ids.items():
+            for obj_id in ids:
+                self.assertIsInstance(obj_id, (int, long), msg=key)
+
+    def test_recursiveCTEStepTermsSameAsEdgesUnion(self):
+        if not cte.supports_step_terms():
+            self.skipTest("database does not support several recursive terms")
+        for obj_id, kind in [('rave:dr4', 'entity'), ('rave:act1', 'activity'), ('org:rave', 'agent')]:
+            for direction in ['BACK', 'FORTH']:
+                steps = utils.get_traversal_steps(direction=direction,
+                    members_flag=True, steps_flag=True, agent_flag=True)
+                rows_found = []
+                for step_terms in [False, True]:
+                    sql, params = cte.get_closure_sql(steps, [(kind, obj_id)], connection.ops.quote_name,
+                        step_terms=step_terms)
+                    with connection.cursor() as cursor:
+                        cursor.execute(sql, params)
+                        rows_found.append(sorted(cursor.fetchall()))
+                self.assertEqual(rows_found[1], rows_found[0], msg="%s, %s" % (obj_id, direction))
+
+    def test_explainTraversalQueries(self):
+        # all traversal lookups use the composite indexes, none reads a whole table;
+        # only the union form of the recursive query (without step terms) may
+        # read all relations, which does not fail the check
+        out = StringIO()
+        call_command('prov_explain', check=True, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertIn("index only  used: activity -> entity (ids)", lines)
+        self.assertTrue(lines[-1].endswith("0 with full scans"))
+        for line in lines:
+            self.assertFalse(line.startswith("full scan"), msg=line)
+            if line.startswith("known scan"):
+                self.assertFalse(cte.supports_step_terms(), msg=line)
+                self.assertIn("recursive query", line)
+
+    def test_explainClosureQueriesKnownFullScan(self):
+        queries = prov_explain.get_closure_queries(connection)
+        self.assertEqual([label for label, sql, known in queries],
+            ["recursive query (BACK)", "recursive query (FORTH)"])
+        for label, sql, known in queries:
+            self.assertEqual(known, not cte.supports_step_terms())
+
+    def test_getProvdalDepthAllWithoutCTE(self):
+        url = reverse('prov_vo:provdal')+'?ID=rave:dr4&DEPTH=ALL&MEMBERS=true&RESPONSEFORMAT=PROV-JSON'
+        client = Client()
+        expected = json.loads(client.get(url).content)
+        config = dict(settings.PROV_VO_CONFIG, recursive_cte=False)
+        with self.settings(PROV_VO_CONFIG=config):
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), expected)
+
+    def test_graphIndexSameAsBreadthFirst(self):
+        index = graphindex.ProvGraphIndex().load()
+        for obj_id in ['rave:dr4', 'rave:obs', 'rave:act1', 'rave:actflow', 'org:rave']:
+            for countdown in [0, 1, 2, 3, -1]:
+                for direction in ['BACK', 'FORTH']:
+                    for members_flag in [False, True]:
+                        for steps_flag in [False, True]:
+                            for agent_flag in [False, True]:
+                                flags = {
+                                    'direction': direction,
+                                    'members_flag': members_flag,
+                                    'steps_flag': steps_flag,
+                                    'agent_flag': agent_flag
+                                }
+                                expected = self.get_ids(self.track_breadth_first(obj_id, countdown, **flags))
+                                found = self.get_ids(self.track_index(index, obj_id, countdown, **flags))
+                                self.assertEqual(found, expected, msg="%s, %s, %s" % (obj_id, countdown, flags))
+
+    def test_graphIndexNoQueries(self):
+        index = graphindex.ProvGraphIndex().load()
+        with self.assertNumQueries(0):
+            node_ids, relation_ids = index.track(['rave:dr4'], countdown=-1, members_flag=True)
+        self.assertEqual(node_ids['entity'], set(['rave:dr4', 'rave:obs', 'rave:raw']))
+        self.assertEqual(node_ids['activity'], set(['rave:act1', 'rave:actflow']))
+        self.assertTrue(index.memory_footprint()['total'] > 0)
+
+    def test_graphIndexUpdates(self):
+        self.addCleanup(graphindex.reset_graph_index)
+        index = graphindex.get_graph_index()
+
+        e = Entity.objects.create(id="rave:new", name="new entity")
+        wdf = WasDerivedFrom.objects.create(generatedEntity_id="rave:obs", usedEntity=e)
+        node_ids, relation_ids = index.track(['rave:dr4'])
+        self.assertIn('rave:new', node_ids['entity'])
+        self.assertIn(wdf.id, relation_ids['wasDerivedFrom'])
+
+        # relation to a deleted node is kept, but not followed any further
+        Entity.objects.get(id="rave:obs").delete()
+        node_ids, relation_ids = index.track(['rave:dr4'])
+        self.assertNotIn('rave:new', node_ids['entity'])
+        self.assertEqual(len(relation_ids['wasDerivedFrom']), 1)
+
+        WasDerivedFrom.objects.filter(generatedEntity="rave:dr4").get().delete()
+        node_ids, relation_ids = index.track(['rave:dr4'])
+        self.assertEqual(relation_ids['wasDerivedFrom'], set())
+
+    def test_graphIndexOtherProcess(self):
+        self.addCleanup(graphindex.reset_graph_index)
+        self.addCleanup(caches['default'].clear)
+        config = dict(settings.PROV_VO_CONFIG, response_cache='default')
+        with self.settings(PROV_VO_CONFIG=config):
+            index = graphindex.get_graph_index()
+            # changes in this process are applied to the index
+            Entity.objects.create(id="rave:new", name="new entity")
+            self.assertIs(graphindex.get_graph_index(), index)
+
+            # changes by another process: no signal in this one
+            WasDerivedFrom.objects.bulk_create([
+                WasDerivedFrom(generatedEntity_id="rave:obs", usedEntity_id="rave:new")])
+            responsecache.bump_generation()
+            reloaded = graphindex.get_graph_index()
+            self.assertIsNot(reloaded, index)
+            self.assertIn('rave:new', reloaded.track(['rave:dr4'])[0]['entity'])
+
+        # without a shared generation, the index expires
+        config = dict(settings.PROV_VO_CONFIG, graph_index_timeout=0)
+        with self.settings(PROV_VO_CONFIG=config):
+            index = graphindex.get_graph_index()
+            self.assertIsNot(graphindex.get_graph_index(), index)
+
+    def test_getProvdalWithGraphIndex(self):
+        self.addCleanup(graphindex.reset_graph_index)
+        client = Client()
+        for depth in ['1', 'ALL']:
+            url = reverse('prov_vo:provdal')+'?ID=rave:dr4&DEPTH=%s&MEMBERS=true&RESPONSEFORMAT=PROV-JSON' % depth
+            expected = json.loads(client.get(url).content)
+            config = dict(settings.PROV_VO_CONFIG, graph_index=True)
+            with self.settings(PROV_VO_CONFIG=config):
+                response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.content), expected)
+
+    def test_streamingPROVJSONSameAsBuffered(self):
+        prov = self.track_breadth_first('rave:dr4', -1, members_flag=True, agent_flag=True)
+        prov['prefix'] = {'voprov': "http://www.ivoa.net/documents/ProvenanceDM/ns/voprov/"}
+        for serializer_class in [VOProvenanceSerializer, W3CProvenanceSerializer]:
+            expected = PROVJSONRenderer().render(serializer_class(prov).data)
+            chunks = list(PROVJSONRenderer().render_stream(serializer_class(prov), chunk_size=100))
+            self.assertTrue(len(chunks) > 1)
+            self.assertEqual(''.join(chunks), expected)
+
+    def test_getProvdalStreaming(self):
+        url = reverse('prov_vo:provdal')+'?ID=rave:dr4&DEPTH=ALL&RESPONSEFORMAT=PROV-JSON'
+        client = Client()
+        expected = client.get(url).content
+        config = dict(settings.PROV_VO_CONFIG, stream_min_records=0)
+        with self.settings(PROV_VO_CONFIG=config):
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(''.join(response.streaming_content), expected)
+
+    def test_streamingPROVNSameAsBuffered(self):
+        prov = self.track_breadth_first('rave:dr4', -1, members_flag=True, agent_flag=True)
+        prov['prefix'] = {'voprov': "http://www.ivoa.net/documents/ProvenanceDM/ns/voprov/"}
+        for serializer_class in [VOProvenanceSerializer, W3CProvenanceSerializer]:
+            expected = PROVNRenderer().render(serializer_class(prov).data)
+            chunks = list(PROVNRenderer().render_stream(serializer_class(prov), chunk_size=100))
+            self.assertTrue(len(chunks) > 1)
+            self.assertEqual(''.join(chunks), expected)
+
+    def test_streamingPROVXMLSameAsBuffered(self):
+        # empty elements are written as <a></a> when streaming,
+        # thus compare the canonical form
+        prov = self.track_breadth_first('rave:dr4', -1, members_flag=True, agent_flag=True)
+        prov['prefix'] = {
+            'voprov': "http://www.ivoa.net/documents/ProvenanceDM/ns/voprov/",
+            'prov': "http://www.w3.org/ns/prov#",
+            'rave': "http://www.rave-survey.org/prov/"
+        }
+        for serializer_class, renderer_class in [(VOProvenanceSerializer, PROVXMLRenderer),
+                                                 (W3CProvenanceSerializer, W3CPROVXMLRenderer)]:
+            expected = renderer_class().render(serializer_class(prov).data)
+            chunks = list(renderer_class().render_stream(serializer_class(prov), chunk_size=100))
+            self.assertTrue(len(chunks) > 1)
+            self.assertEqual(etree.tostring(etree.fromstring(''.join(chunks)), method='c14n'),
+                etree.tostring(etree.fromstring(expected), method='c14n'))
+
+    def test_PROVNAttributeWithBracket(self):
+        string = EntityPROVNRenderer().render({'voprov:id': "rave:dr4", 'voprov:name': "RAVE (DR4)"})
+        self.assertEqual(string, 'entity(rave:dr4, [voprov:name="RAVE (DR4)"])')
+
+    def track_rows(self, obj_id, countdown, **flags):
+        prov, entity_ids, activity_ids, agent_ids = self.get_start_nodes(obj_id)
+        node_ids, relation_ids = rows.track_provenance_ids(entity_ids, activity_ids, agent_ids, countdown, **flags)
+        return rows.fill_provenance_rows(self.get_empty_prov(), node_ids, relation_ids)
+
+    def test_rowTraversalSameAsBreadthFirst(self):
+        for obj_id in ['rave:dr4', 'rave:obs', 'rave:act1', 'rave:actflow', 'org:rave']:
+            for countdown in [0, 1, 2, 3, -1]:
+                for direction in ['BACK', 'FORTH']:
+                    for members_flag in [False, True]:
+                        for steps_flag in [False, True]:
+                            for agent_flag in [False, True]:
+                                flags = {
+                                    'direction': direction,
+                                    'members_flag': members_flag,
+                                    'steps_flag': steps_flag,
+                                    'agent_flag': agent_flag
+                                }
+                                expected = self.get_ids(self.track_breadth_first(obj_id, countdown, **flags))
+                                found = self.get_ids(self.track_rows(obj_id, countdown, **flags))
+                                self.assertEqual(found, expected, msg="%s, %s, %s" % (obj_id, countdown, flags))
+
+    def test_getProvdalRowTraversal(self):
+        self.add_derived_entities(3)
+        client = Client()
+        for depth in ['1', '2', 'ALL']:
+            for model in ['IVOA', 'W3C']:
+                for format in ['PROV-JSON', 'PROV-N']:
+                    url = reverse('prov_vo:provdal')+'?ID=rave:dr4&ID=rave:act2&DEPTH=%s&MEMBERS=true&STEPS=true&MODEL=%s&RESPONSEFORMAT=%s' % (depth, model, format)
+                    expected = client.get(url).content
+                    config = dict(settings.PROV_VO_CONFIG, row_traversal=True)
+                    with self.settings(PROV_VO_CONFIG=config):
+                        response = client.get(url)
+                    self.assertEqual(response.status_code, 200)
+                    if format == 'PROV-JSON':
+                        self.assertEqual(json.loads(response.content), json.loads(expected), msg=url)
+                    else:
+                        self.assertEqual(sorted(response.content.split('\n')), sorted(expected.split('\n')), msg=url)
+
+    def test_closureCacheSameAsBreadthFirst(self):
+        self.addCleanup(closurecache.closure_cache.clear)
+        config = dict(settings.PROV_VO_CONFIG, closure_cache_size=1000)
+        with self.settings(PROV_VO_CONFIG=config):
+            for obj_ids in [['rave:dr4'], ['rave:obs', 'rave:act2'], ['rave:actflow', 'org:rave']]:
+                for direction in ['BACK', 'FORTH']:
+                    for agent_flag in [False, True]:
+                        flags = {
+                            'direction': direction,
+                            'members_flag': True,
+                            'steps_flag': True,
+                            'agent_flag': agent_flag
+                        }
+                        expected = self.get_empty_prov()
+                        for obj_id in obj_ids:
+                            for key, value in self.track_breadth_first(obj_id, -1, **flags).iteritems():
+                                expected[key].update(value)
+                        # twice, with and without cached closures
+                        for i in range(2):
+                            prov, entity_ids, activity_ids, agent_ids = self.get_start_nodes(obj_ids[0])
+                            for obj_id in obj_ids[1:]:
+                                more = self.get_start_nodes(obj_id)
+                                for key, value in more[0].iteritems():
+                                    prov[key].update(value)
+                                entity_ids += more[1]
+                                activity_ids += more[2]
+                                agent_ids += more[3]
+                            found = views.find_provenance(prov, entity_ids, activity_ids, agent_ids, -1, **flags)
+                            self.assertEqual(self.get_ids(found), self.get_ids(expected), msg="%s, %s" % (obj_ids, flags))
+
+    def test_chooseTraversal(self):
+        # the same choice is used for the rows and for the model instances
+        self.assertEqual(rows.choose_traversal(1, -1), rows.RECURSIVE_CTE)
+        self.assertEqual(rows.choose_traversal(1, 2), rows.BREADTH_FIRST)
+        self.assertEqual(rows.choose_traversal(utils.CHUNK_SIZE + 1, -1), rows.BREADTH_FIRST)
+        for name, traversal in [('closure_cache_size', rows.CLOSURE_CACHE),
+                ('graph_index', rows.GRAPH_INDEX), ('lineage_table', rows.LINEAGE_TABLE)]:
+            config = dict(settings.PROV_VO_CONFIG, **{name: 1000})
+            with self.settings(PROV_VO_CONFIG=config):
+                self.assertEqual(rows.choose_traversal(1, -1), traversal)
+        config = dict(settings.PROV_VO_CONFIG, closure_cache_size=1000, graph_index=True)
+        with self.settings(PROV_VO_CONFIG=config):
+            self.assertEqual(rows.choose_traversal(1, 2), rows.GRAPH_INDEX)
+            self.assertEqual(rows.choose_traversal(1, -1, closure_cache=False), rows.GRAPH_INDEX)
+
+    def test_closureCacheStats(self):
+        self.addCleanup(closurecache.closure_cache.clear)
+        cache = closurecache.closure_cache
+        cache.clear()
+        config = dict(settings.PROV_VO_CONFIG, closure_cache_size=1000)
+        with self.settings(PROV_VO_CONFIG=config):
+            stats = cache.stats()
+            rows.find_provenance_ids(['rave:dr4'], [], [], -1)
+            with self.assertNumQueries(0):
+                node_ids, relation_ids = rows.find_provenance_ids(['rave:dr4'], [], [], -1)
+            self.assertEqual(node_ids['activity'], set(['rave:act1', 'rave:actflow']))
+            self.assertEqual(cache.stats()['hits'], stats['hits'] + 1)
+            self.assertEqual(cache.stats()['misses'], stats['misses'] + 1)
+            self.assertEqual(cache.stats()['entries'], 1)
+
+            # any change clears the cache
+            Activity.objects.create(id="rave:act0", name="Activity step 0")
+            self.assertEqual(cache.stats()['entries'], 0)
+
+        # closures larger than the cache are not stored, older ones are evicted
+        config = dict(settings.PROV_VO_CONFIG, closure_cache_size=5)
+        with self.settings(PROV_VO_CONFIG=config):
+            rows.find_provenance_ids(['rave:dr4'], [], [], -1)
+            self.assertEqual(cache.stats()['entries'], 0)
+            rows.find_provenance_ids(['rave:obs'], [], [], -1)
+            rows.find_provenance_ids([], [], ['org:rave'], -1)
+            self.assertEqual(cache.stats()['entries'], 2)
+            rows.find_provenance_ids(['rave:raw'], [], [], -1)
+            rows.find_provenance_ids(['rave:raw'], [], [], -1, agent_flag=True)
+            self.assertTrue(cache.stats()['size'] <= 5)
+            self.assertTrue(cache.stats()['evictions'] > 0)
+
+    def test_closureCacheOtherProcess(self):
+        # changes by other processes are noticed through the shared generation
+        self.addCleanup(closurecache.closure_cache.clear)
+        self.addCleanup(caches['default'].clear)
+        cache = closurecache.closure_cache
+        config = dict(settings.PROV_VO_CONFIG, closure_cache_size=1000, response_cache='default')
+        with self.settings(PROV_VO_CONFIG=config):
+            rows.find_provenance_ids(['rave:dr4'], [], [], -1)
+            with self.assertNumQueries(0):
+                rows.find_provenance_ids(['rave:dr4'], [], [], -1)
+            # as by another process: no signal in this one
+            Entity.objects.filter(id="rave:obs").update(name="Changed")
+            responsecache.bump_generation()
+            self.assertEqual(cache.stats()['entries'], 1)
+            misses = cache.stats()['misses']
+            rows.find_provenance_ids(['rave:dr4'], [], [], -1)
+            self.assertEqual(cache.stats()['misses'], misses + 1)
+            self.assertEqual(cache.stats()['entries'], 1)
+
+        # without a shared generation, the closures expire
+        config = dict(settings.PROV_VO_CONFIG, closure_cache_size=1000, closure_cache_timeout=0)
+        with self.settings(PROV_VO_CONFIG=config):
+            rows.find_provenance_ids(['rave:dr4'], [], [], -1)
+            misses = cache.stats()['misses']
+            rows.find_provenance_ids(['rave:dr4'], [], [], -1)
+            self.assertEqual(cache.stats()['misses'], misses + 1)
+
+    def add_derived_entities(self, num):
+        # add num entities with descriptions to the provenance of rave:dr4
+        d = EntityDescription.objects.create(id="rave:desc", name="Entity description")
+        for i in range(num):
+            e = Entity.objects.create(id="rave:e%d" % i, name="Entity %d" % i, description=d)
+            WasDerivedFrom.objects.create(generatedEntity_id="rave:dr4", usedEntity=e)
+
+    def count_provdal_queries(self, url):
+        client = Client()
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_trackProvenanceNumQueries(self):
+        self.add_derived_entities(20)
+        prov, entity_ids, activity_ids, agent_ids = self.get_start_nodes("rave:dr4")
+        # one query per relation type, next nodes and descriptions are
+        # loaded with the relations
+        with self.assertNumQueries(4):
+            prov = utils.track_provenance(prov, entity_ids, activity_ids, agent_ids, 1)
+        self.assertEqual(len(prov['entity']), 22)
+        with self.assertNumQueries(0):
+            for e in prov['entity'].values():
+                e.description
+
+    def test_provdalNumQueriesIndependentOfSize(self):
+        urls = [reverse('prov_vo:provdal')+'?ID=rave:dr4&DEPTH=%s&RESPONSEFORMAT=PROV-JSON' % depth
+            for depth in ['1', '2', 'ALL']]
+        num_small = [self.count_provdal_queries(url) for url in urls]
+        self.add_derived_entities(20)
+        num_large = [self.count_provdal_queries(url) for url in urls]
+        self.assertEqual(num_large, num_small)
+
+
+class ActivityKindCache_TestCase(TestCase):
+
+    def setUp(self):
+        Activity.objects.create(id="rave:act", name="myactivity")
+        ActivityFlow.objects.create(id="rave:flow", name="myflow")
+        utils.activity_kind_cache.clear()
+
+    def tearDown(self):
+        utils.activity_kind_cache.clear()
+
+    def test_getActivityType(self):
+        self.assertEqual(utils.get_activity_type("rave:act"), 'activity')
+        self.assertEqual(utils.get_activity_type("rave:flow"), 'activityFlow')
+
+    def test_addNodesOneQuery(self):
+        prov = {'activity': {}, 'activityFlow': {}}
+        with self.assertNumQueries(1):
+            prov = utils.add_nodes(prov, 'activity', ["rave:act", "rave:flow"])
+        self.assertEqual(prov['activity'].keys(), ["rave:act"])
+        self.assertEqual(prov['activityFlow'].keys(), ["rave:flow"])
+
+    def test_cacheInvalidation(self):
+        config = dict(settings.PROV_VO_CONFIG, activity_kind_cache_size=10)
+        with self.settings(PROV_VO_CONFIG=config):
+            self.assertEqual(utils.get_activity_type("rave:new"), 'activity')
+            with self.assertNumQueries(0):
+                self.assertEqual(utils.get_activity_type("rave:new"), 'activity')
+            ActivityFlow.objects.create(id="rave:new", name="new flow")
+            self.assertEqual(utils.get_activity_type("rave:new"), 'activityFlow')
+
+    def test_cacheSize(self):
+        config = dict(settings.PROV_VO_CONFIG, activity_kind_cache_size=1)
+        with self.settings(PROV_VO_CONFIG=config):
+            utils.get_activity_type("rave:act")
+            utils.get_activity_type("rave:flow")
+            self.assertEqual(utils.activity_kind_cache.entries.keys(), ["rave:flow"])
+
+
+class CompiledSerializer_TestCase(TestCase):
+
+    def setUp(self):
+        ed = EntityDescription.objects.create(id="ex:entdesc1", name="Entity Description 1", category="image")
+        Entity.objects.create(id="ex:ent1", name="Entity 1", type="prov:collection", description=ed)
+        Entity.objects.create(id="ex:ent2", name="Entity 2")
+
+        ad = ActivityDescription.objects.create(id="ex:actdesc1", name="Activity Description 1", type="processing")
+        a = Activity.objects.create(id="ex:act1", name="Activity 1", description=ad)
+        ActivityFlow.objects.create(id="ex:flow1", name="Flow 1")
+
+        ud = UsedDescription.objects.create(id="ex:udesc1", activityDescription=ad, entityDescription=ed, role="input image")
+        Used.objects.create(id=1, activity=a, entity_id="ex:ent1", description=ud)
+        Used.objects.create(id=2, activity=a, entity_id="ex:ent2")
+
+        pd = ParameterDescription.objects.create(id="ex:pardesc1", name="Parameter Description 1")
+        Parameter.objects.create(id="ex:par1", activity=a, value="1.0", description=pd)
+
+    def assertSameData(self, serializer_class, objects):
+        for obj in objects:
+            self.assertEqual(serializers.serialize(serializer_class, obj), serializer_class(obj).data)
+
+    def test_serializeVO(self):
+        self.assertSameData(serializers.VOEntitySerializer, Entity.objects.all())
+        self.assertSameData(serializers.VOEntityDescriptionSerializer, EntityDescription.objects.all())
+        self.assertSameData(serializers.VOActivitySerializer, Activity.objects.all())
+        self.assertSameData(serializers.VOActivityFlowSerializer, ActivityFlow.objects.all())
+        self.assertSameData(serializers.VOUsedSerializer, Used.objects.all())
+        self.assertSameData(serializers.VOUsedDescriptionSerializer, UsedDescription.objects.all())
+        self.assertSameData(serializers.VOParameterSerializer, Parameter.objects.all())
+
+    def test_serializeW3C(self):
+        self.assertSameData(serializers.W3CEntitySerializer, Entity.objects.all())
+        self.assertSameData(serializers.W3CActivitySerializer, Activity.objects.all())
+        self.assertSameData(serializers.W3CActivityFlowSerializer, ActivityFlow.objects.all())
+        self.assertSameData(serializers.W3CUsedSerializer, Used.objects.all())
+        self.assertSameData(serializers.W3CUsedDescriptionSerializer, UsedDescription.objects.all())
+        self.assertSameData(serializers.W3CParameterSerializer, Parameter.objects.all())
+
+    def test_serializeRows(self):
+        compiled = serializers.get_compiled_serializer(serializers.VOUsedSerializer)
+        self.assertTrue(compiled.supports_rows)
+        for row in Used.objects.values('id', *compiled.values_fields()):
+            used = Used.objects.get(id=row['id'])
+            self.assertEqual(compiled.row_to_representation(row), serializers.VOUsedSerializer(used).data)
+
+    def test_methodFieldsNoRows(self):
+        compiled = serializers.get_compiled_serializer(serializers.W3CEntitySerializer)
+        self.assertFalse(compiled.supports_rows)
+        with self.assertRaises(TypeError):
+            compiled.row_to_representation({'id': "ex:ent1", 'name': "Entity 1"})
+
+        # the row traversal is not used with such serializers
+        config = dict(settings.PROV_VO_CONFIG, row_traversal=True)
+        with self.settings(PROV_VO_CONFIG=config):
+            self.assertTrue(rows.row_traversal_enabled())
+            self.addCleanup(rows.ROW_SERIALIZERS.__setitem__, 'entity', rows.ROW_SERIALIZERS['entity'])
+            rows.ROW_SERIALIZERS['entity'] = serializers.W3CEntitySerializer
+            self.assertFalse(rows.row_traversal_enabled())
+            response = Client().get(reverse('prov_vo:provdal') + '?ID=ex:ent1')
+            self.assertEqual(response.status_code, 200)
+
+
+class ProvDAL_Batch_TestCase(TestCase):
+
+    def setUp(self):
+        e = Entity.objects.create(id="rave:dr4", name="RAVE DR4")
+        e0 = Entity.objects.create(id="rave:obs", name="RAVE observations")
+        WasDerivedFrom.objects.create(generatedEntity=e, usedEntity=e0)
+        a1 = Activity.objects.create(id="rave:act1", name="Activity step 1")
+        a2 = Activity.objects.create(id="rave:act2", name="Activity step 2")
+        WasInformedBy.objects.create(informed=a2, informant=a1)
+        Used.objects.create(activity=a1, entity=e0)
+        WasGeneratedBy.objects.create(entity=e, activity=a1)
+        ag = Agent.objects.create(id="org:rave", name="RAVE project")
+        WasAssociatedWith.objects.create(activity=a1, agent=ag)
+
+    def test_addStartNodes(self):
+        prov = {'entity': {}, 'activity': {}, 'activityFlow': {}, 'agent': {}}
+        with self.assertNumQueries(3):
+            entity_ids, activity_ids, agent_ids = utils.add_start_nodes(prov,
+                ["rave:dr4", "rave:act1", "org:rave", "rave:unknown"])
+        self.assertEqual(entity_ids, ["rave:dr4"])
+        self.assertEqual(activity_ids, ["rave:act1"])
+        self.assertEqual(agent_ids, ["org:rave"])
+        self.assertEqual(prov['activity'].keys(), ["rave:act1"])
+
+    def test_batchJSON(self):
+        client = Client()
+        expected = client.get(reverse('prov_vo:provdal')+'?ID=rave:dr4&ID=rave:act2&DEPTH=ALL&AGENT=true').content
+        data = {'ID': ["rave:dr4", "rave:act2"], 'depth': "ALL", 'AGENT': True}
+        response = client.post(reverse('prov_vo:provdal_batch'), json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), json.loads(expected))
+
+    def test_batchFileUpload(self):
+        client = Client()
+        expected = client.get(reverse('prov_vo:provdal')+'?ID=rave:dr4&ID=rave:act2&ID=org:rave&RESPONSEFORMAT=PROV-N').content
+        ids = SimpleUploadedFile("ids.txt", "rave:dr4\nrave:act2\n\n")
+        response = client.post(reverse('prov_vo:provdal_batch'),
+            {'ID': "org:rave", 'RESPONSEFORMAT': "PROV-N", 'file': ids})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(response.content.split('\n')), sorted(expected.split('\n')))
+
+    def test_batchNodes(self):
+        client = Client()
+        data = {'ID': ["rave:dr4", "rave:act2", "rave:unknown"], 'DEPTH': "ALL", 'MODE': "nodes"}
+        response = client.post(reverse('prov_vo:provdal_batch'), json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        content = json.loads(response.content)
+        self.assertEqual(content['rave:dr4'], {
+            'entity': ["rave:dr4", "rave:obs"], 'activity': ["rave:act1"], 'agent': ["org:rave"]
+        })
+        self.assertEqual(content['rave:act2'], {
+            'entity': ["rave:obs"], 'activity': ["rave:act1", "rave:act2"], 'agent': ["org:rave"]
+        })
+        self.assertEqual(content['rave:unknown'], {'entity': [], 'activity': [], 'agent': []})
+
+    def test_batchClosureCacheNumQueries(self):
+        # with many uncached ids, the closure cache searches them in one traversal
+        self.addCleanup(closurecache.closure_cache.clear)
+        e0 = Entity.objects.get(id="rave:obs")
+        for i in range(60):
+            e = Entity.objects.create(id="rave:e%d" % i, name="Entity %d" % i)
+            WasDerivedFrom.objects.create(generatedEntity=e, usedEntity=e0)
+        client = Client()
+        config = dict(settings.PROV_VO_CONFIG, closure_cache_size=10000, closure_cache_max_misses=5)
+        with self.settings(PROV_VO_CONFIG=config):
+            counts = []
+            for ids in [range(0, 20), range(20, 60)]:
+                data = {'ID': ["rave:e%d" % i for i in ids], 'DEPTH': "ALL"}
+                with CaptureQueriesContext(connection) as context:
+                    response = client.post(reverse('prov_vo:provdal_batch'), json.dumps(data), content_type='application/json')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(json.loads(response.content)['entity']), len(ids) + 1)
+                counts.append(len(context.captured_queries))
+            self.assertEqual(counts[0], counts[1])
+            self.assertEqual(closurecache.closure_cache.stats()['entries'], 0)
+
+            # few missing ids are still cached one by one
+            data = {'ID': ["rave:dr4", "rave:e0"], 'DEPTH': "ALL"}
+            response = client.post(reverse('prov_vo:provdal_batch'), json.dumps(data), content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(closurecache.closure_cache.stats()['entries'], 2)
+
+    def test_nodeSetsSameAsSingleTraversals(self):
+        ids = ["rave:dr4", "rave:obs", "rave:act1", "rave:act2", "org:rave"]
+        for countdown in [0, 1, 2, -1]:
+            for direction in ['BACK', 'FORTH']:
+                for agent_flag in [False, True]:
+                    flags = {'direction': direction, 'agent_flag': agent_flag}
+                    node_sets = rows.track_node_sets(ids, countdown, **flags)
+                    for obj_id in ids:
+                        expected, relation_ids = rows.track_provenance_ids(*utils.resolve_ids([obj_id]),
+                            countdown=countdown, **flags)
+                        self.assertEqual(node_sets[obj_id], expected, msg="%s, %s, %s" % (obj_id, countdown, flags))
+
+    def test_batchErrors(self):
+        client = Client()
+        url = reverse('prov_vo:provdal_batch')
+        self.assertEqual(client.get(url + '?ID=rave:dr4').status_code, 405)
+        response = client.post(url, json.dumps({'ID': "rave:dr4", 'MODE': "other"}), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = client.post(url, "no json", content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        config = dict(settings.PROV_VO_CONFIG, batch_max_ids=2)
+        with self.settings(PROV_VO_CONFIG=config):
+            response = client.post(url, json.dumps({'ID': ["rave:dr4", "rave:obs", "rave:act1"]}), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ProvDAL_ResponseCache_TestCase(TestCase):
+
+    def setUp(self):
+        e = Entity.objects.create(id="rave:dr4", name="RAVE DR4")
+        a = Activity.objects.create(id="rave:act", name="myactivity")
+        WasGeneratedBy.objects.create(entity=e, activity=a)
+        caches['default'].clear()
+        self.config = dict(settings.PROV_VO_CONFIG, response_cache='default')
+
+    def tearDown(self):
+        caches['default'].clear()
+
+    def test_noCacheByDefault(self):
+        client = Client()
+        response = client.get(reverse('prov_vo:provdal')+'?ID=rave:dr4')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_cachedResponse(self):
+        url = reverse('prov_vo:provdal')+'?ID=rave:dr4&DEPTH=ALL&RESPONSEFORMAT=PROV-N'
+        client = Client()
+        with self.settings(PROV_VO_CONFIG=self.config):
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.has_header('ETag'))
+            self.assertTrue(response.has_header('Last-Modified'))
+            with self.assertNumQueries(0):
+                cached = client.get(url)
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['Content-Type'], response['Content-Type'])
+        self.assertEqual(cached['ETag'], response['ETag'])
+
+    def test_normalisedParameters(self):
+        client = Client()
+        with self.settings(PROV_VO_CONFIG=self.config):
+            response1 = client.get(reverse('prov_vo:provdal')+'?ID=rave:dr4&ID=rave:act&DEPTH=ALL&MEMBERS=true')
+            response2 = client.get(reverse('prov_vo:provdal')+'?id=rave:act&id=rave:dr4&depth=all&members=1&agent=0')
+            response3 = client.get(reverse('prov_vo:provdal')+'?ID=rave:act&ID=rave:dr4&DEPTH=ALL')
+        self.assertEqual(response1['ETag'], response2['ETag'])
+        self.assertNotEqual(response1['ETag'], response3['ETag'])
+
+    def test_notModified(self):
+        url = reverse('prov_vo:provdal')+'?ID=rave:dr4'
+        client = Client()
+        with self.settings(PROV_VO_CONFIG=self.config):
+            etag = client.get(url)['ETag']
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+            response = client.get(url, HTTP_IF_NONE_MATCH='"other"')
+            self.assertEqual(response.status_code, 200)
+
+    def test_invalidation(self):
+        url = reverse('prov_vo:provdal')+'?ID=rave:dr4&RESPONSEFORMAT=PROV-N'
+        client = Client()
+        with self.settings(PROV_VO_CONFIG=self.config):
+            response = client.get(url)
+            Entity.objects.filter(id="rave:dr4").get().save()
+            a = Activity.objects.create(id="rave:act2", name="other activity")
+            WasGeneratedBy.objects.create(entity_id="rave:dr4", activity=a)
+            changed = client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+        self.assertIn('rave:act2', changed.content)
+
+    def test_errorsNotCached(self):
+        client = Client()
+        with self.settings(PROV_VO_CONFIG=self.config):
+            response = client.get(reverse('prov_vo:provdal')+'?ID=rave:dr4&MODEL=OTHER')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header('ETag'))
+
+
+def create_example_provenance():
+    # one object of each kind, with descriptions
+    ed = EntityDescription.objects.create(id="rave:ed", name="Catalogue", category="catalog")
+    ad = ActivityDescription.objects.create(id="rave:ad", name="Pipeline", type="reduction")
+    pd = ParameterDescription.objects.create(id="rave:pd", name="threshold", datatype="float")
+    ud = UsedDescription.objects.create(id="rave:ud", activityDescription=ad, entityDescription=ed, role="input")
+    gd = WasGeneratedByDescription.objects.create(id="rave:gd", activityDescription=ad, entityDescription=ed, role="output")
+
+    e = Entity.objects.create(id="rave:dr4", name="RAVE DR4", description=ed)
+    e0 = Entity.objects.create(id="rave:obs", name=u"RAVE observations \u00e9")
+    WasDerivedFrom.objects.create(generatedEntity=e, usedEntity=e0)
+    a1 = Activity.objects.create(id="rave:act1", name="Activity step 1", description=ad,
+        startTime=timezone.now())
+    a2 = Activity.objects.create(id="rave:act2", name="Activity step 2")
+    af = ActivityFlow.objects.create(id="rave:actflow", name="Activity flow")
+    HadStep.objects.create(activityFlow=af, activity=a1)
+    HadStep.objects.create(activityFlow=af, activity=a2)
+    WasInformedBy.objects.create(informed=a2, informant=a1)
+    Used.objects.create(activity=a1, entity=e0, description=ud, time=timezone.now())
+    WasGeneratedBy.objects.create(entity=e, activity=a1, description=gd)
+    Parameter.objects.create(id="rave:p1", activity=a1, value="0.5", description=pd)
+
+    c = Collection.objects.create(id="rave:raw", name="RAVE raw data files")
+    HadMember.objects.create(collection=c, entity=e0)
+
+    ag = Agent.objects.create(id="org:rave", name="RAVE project")
+    WasAssociatedWith.objects.create(activity=a1, agent=ag, role="pi")
+    WasAttributedTo.objects.create(entity=e, agent=ag)
+
+
+class ProvLoad_TestCase(TestCase):
+
+    def setUp(self):
+        create_example_provenance()
+        self.url = reverse('prov_vo:provdal') + '?ID=rave:dr4&ID=rave:actflow&ID=rave:raw&DEPTH=ALL'\
+            + '&MEMBERS=true&STEPS=true&AGENT=true&RESPONSEFORMAT=PROV-JSON'
+
+    def get_document(self):
+        return Client().get(self.url).content
+
+    def normalise(self, document):
+        # the ids of relations are not kept when loading
+        content = json.loads(document)
+        for key in bulkload.RELATION_KEYS:
+            if key in content:
+                content[key] = sorted(json.dumps(record, sort_keys=True) for record in content[key].values())
+        return content
+
+    def delete_all(self):
+        for model in [Parameter, Used, WasGeneratedBy, WasDerivedFrom, WasInformedBy, WasAssociatedWith,
+                WasAttributedTo, HadMember, HadStep, Collection, ActivityFlow, Entity, Activity, Agent,
+                UsedDescription, WasGeneratedByDescription, ParameterDescription, EntityDescription, ActivityDescription]:
+            model.objects.all().delete()
+
+    def test_loadRoundTrip(self):
+        document = self.get_document()
+        self.delete_all()
+        loader = bulkload.ProvLoader(batch_size=3)
+        stats = loader.load(StringIO(document))
+        self.assertEqual(stats['collection']['created'], 1)
+        self.assertEqual(loader.get_totals()['created'], loader.get_totals()['read'])
+        self.assertEqual(loader.unresolved, [])
+        self.assertEqual(self.normalise(self.get_document()), self.normalise(document))
+        self.assertTrue(Collection.objects.filter(id="rave:raw").exists())
+        self.assertEqual(ActivityFlow.objects.count(), 1)
+
+    def test_loadDuplicates(self):
+        document = self.get_document()
+        loader = bulkload.ProvLoader()
+        loader.load(StringIO(document))
+        totals = loader.get_totals()
+        self.assertEqual(totals['created'], 0)
+        self.assertEqual(totals['duplicates'], totals['read'])
+        self.assertEqual(Used.objects.count(), 1)
+
+    def test_loadUnresolved(self):
+        document = json.dumps({
+            'entity': {'rave:new': {'voprov:id': "rave:new", 'voprov:name': "New entity"}},
+            'used': {
+                '_:1': {'voprov:activity': "rave:act2", 'voprov:entity': "rave:new"},
+                '_:2': {'voprov:activity': "rave:unknown", 'voprov:entity': "rave:new"},
+            },
+        })
+        loader = bulkload.ProvLoader()
+        stats = loader.load(StringIO(document))
+        self.assertEqual(stats['entity']['created'], 1)
+        self.assertEqual(stats['used']['created'], 1)
+        self.assertEqual(stats['used']['unresolved'], 1)
+        self.assertEqual(loader.unresolved, [('used', None, [('activity', "rave:unknown")])])
+        self.assertTrue(Used.objects.filter(activity_id="rave:act2", entity_id="rave:new").exists())
+
+    def test_loadReferencedBeforeCreated(self):
+        # the first document refers to an entity created by the second one
+        first = json.dumps({
+            'used': {'_:1': {'voprov:activity': "rave:act2", 'voprov:entity': "rave:new"}},
+        })
+        second = json.dumps({
+            'entity': {'rave:new': {'voprov:id': "rave:new", 'voprov:name': "New entity"}},
+            'used': {
+                '_:1': {'voprov:activity': "rave:act1", 'voprov:entity': "rave:new"},
+                '_:2': {'voprov:activity': "rave:act2", 'voprov:entity': "rave:new"},
+            },
+        })
+        loader = bulkload.ProvLoader()
+        stats = loader.load(StringIO(first))
+        self.assertEqual(stats['used']['unresolved'], 1)
+        stats = loader.load(StringIO(second))
+        self.assertEqual(stats['entity']['created'], 1)
+        self.assertEqual(stats['used']['created'], 2)
+        self.assertEqual(stats['used']['unresolved'], 1)
+        self.assertEqual(Used.objects.filter(entity_id="rave:new").count(), 2)
+
+    def test_loadInvalid(self):
+        for document in ['{"entity": {"rave:x": ', '{"other": {}}', '{"entity": {"rave:x": {"voprov:size": 1}}}']:
+            with self.assertRaises(utils.InvalidDataError):
+                bulkload.ProvLoader().load(StringIO(document))
+
+    def test_loadCommand(self):
+        document = self.get_document()
+        self.delete_all()
+        path = os.path.join(tempfile.mkdtemp(), 'prov.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(document)
+        out = StringIO()
+        call_command('prov_load', path, batch_size=5, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertIn('collection', [line.split()[0] for line in lines])
+        self.assertTrue(re.match(r"(\d+) records read, \1 created in ", lines[-1]), msg=lines[-1])
+        self.assertEqual(self.normalise(self.get_document()), self.normalise(document))
+
+    def test_loadEndpoint(self):
+        document = self.get_document()
+        self.delete_all()
+        client = Client()
+        url = reverse('prov_vo:provload')
+        response = client.post(url, document, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        config = dict(settings.PROV_VO_CONFIG, load_endpoint=True)
+        with self.settings(PROV_VO_CONFIG=config):
+            self.assertEqual(client.get(url).status_code, 405)
+            response = client.post(url, document, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            content = json.loads(response.content)
+            self.assertEqual(content['totals']['created'], content['totals']['read'])
+            self.assertEqual(content['sections']['wasGeneratedBy']['created'], 1)
+
+            upload = SimpleUploadedFile("prov.json", document)
+            content = json.loads(client.post(url, {'file': upload}).content)
+            self.assertEqual(content['totals']['created'], 0)
+
+            response = client.post(url, '{"entity": [', content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.normalise(self.get_document()), self.normalise(document))
+
+
+class API_Bulk_TestCase(TestCase):
+
+    def setUp(self):
+        Activity.objects.create(id="rave:act1", name="Activity step 1")
+        Entity.objects.create(id="rave:obs", name="RAVE observations")
+        self.client = Client()
+
+    def post(self, url, data, method='post'):
+        return getattr(self.client, method)(url, json.dumps(data), content_type='application/json')
+
+    def test_bulkCreate(self):
+        url = reverse('prov_vo:activity-list')
+        response = self.post(url, [
+            {'prov:id': "rave:act2", 'prov:label': "Activity step 2", 'prov:type': "calibration"},
+            {'prov_id': "rave:act3"},
+        ])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.content)[0]['prov:label'], "Activity step 2")
+        self.assertEqual(Activity.objects.get(id="rave:act2").type, "calibration")
+        self.assertTrue(Activity.objects.filter(id="rave:act3").exists())
+
+        response = self.post(reverse('prov_vo:collection-list'), [{'prov:id': "rave:raw", 'prov:label': "RAVE raw data files"}])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Collection.objects.get(id="rave:raw").name, "RAVE raw data files")
+
+    def test_bulkCreateNumQueries(self):
+        # the foreign keys are checked with one query per referenced model
+        Entity.objects.bulk_create([Entity(id="rave:e%d" % i) for i in range(50)])
+        url = reverse('prov_vo:used-list')
+        counts = []
+        for num in [5, 50]:
+            data = [{'prov:activity': "rave:act1", 'prov:entity': "rave:e%d" % i} for i in range(num)]
+            with CaptureQueriesContext(connection) as context:
+                response = self.post(url, data)
+            self.assertEqual(response.status_code, 201)
+            counts.append(len(context.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(Used.objects.filter(activity_id="rave:act1").count(), 55)
+
+        url = reverse('prov_vo:wasderivedfrom-list')
+        data = [{'generatedEntity': "rave:e%d" % i, 'usedEntity': "rave:obs"} for i in range(50)]
+        with CaptureQueriesContext(connection) as context:
+            response = self.post(url, data)
+        self.assertEqual(response.status_code, 201)
+        # both foreign keys reference entities: one query less than for used
+        self.assertEqual(len(context.captured_queries), counts[0] - 1)
+
+    def test_singleCreateRequiresId(self):
+        # only the attributes are optional, single objects still need their id
+        url = reverse('prov_vo:activity-list')
+        for data in [{}, {'prov:id': None}, {'prov:label': "no id"}]:
+            response = self.post(url, data)
+            self.assertEqual(response.status_code, 400, msg=data)
+            self.assertIn('prov:id', json.loads(response.content))
+        self.assertEqual(Activity.objects.count(), 1)
+
+        response = self.post(url, {'prov:id': "rave:act2"})
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(Activity.objects.get(id="rave:act2").name)
+
+    def test_bulkErrors(self):
+        url = reverse('prov_vo:entity-list')
+        response = self.post(url, [
+            {'prov:id': "rave:dr4", 'voprov:description': "rave:unknown"},
+            {'prov:id': "rave:obs"},
+            {'prov:id': "rave:dr5"},
+            {'prov:id': "rave:dr5"},
+            {'prov:label': "no id"},
+        ])
+        self.assertEqual(response.status_code, 400)
+        errors = json.loads(response.content)
+        self.assertEqual(errors[0].keys(), ['voprov:description'])
+        self.assertEqual(errors[1].keys(), ['prov:id'])
+        self.assertEqual(errors[2], {})
+        self.assertEqual(errors[3].keys(), ['prov:id'])
+        self.assertEqual(errors[4].keys(), ['prov:id'])
+        self.assertFalse(Entity.objects.filter(id__in=["rave:dr4", "rave:dr5"]).exists())
+
+        response = self.post(reverse('prov_vo:used-list'), [
+            {'prov:activity': "rave:act1", 'prov:entity': "rave:obs"},
+            {'prov:activity': "rave:unknown", 'prov:entity': "rave:obs"},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content)[1].keys(), ['prov:activity'])
+        self.assertEqual(Used.objects.count(), 0)
+
+        config = dict(settings.PROV_VO_CONFIG, bulk_max_items=1)
+        with self.settings(PROV_VO_CONFIG=config):
+            response = self.post(url, [{'prov:id': "rave:dr4"}, {'prov:id': "rave:dr5"}])
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulkUpdate(self):
+        Activity.objects.create(id="rave:act2", name="Activity step 2", type="calibration")
+        url = reverse('prov_vo:activity-list')
+        response = self.post(url, [
+            {'prov:id': "rave:act1", 'prov:label': "First step"},
+            {'prov:id': "rave:act2", 'prov:startTime': "2017-01-01T10:00:00Z"},
+        ], method='patch')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Activity.objects.get(id="rave:act1").name, "First step")
+        act2 = Activity.objects.get(id="rave:act2")
+        self.assertEqual((act2.name, act2.type, act2.startTime.year), ("Activity step 2", "calibration", 2017))
+
+        response = self.post(url, [{'prov:id': "rave:unknown", 'prov:label': "Unknown"}], method='put')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content)[0].keys(), ['prov:id'])
+        # relations have no ids in the API, so they cannot be updated
+        response = self.post(reverse('prov_vo:used-list'), [{'prov:activity': "rave:act1"}], method='put')
+        self.assertEqual(response.status_code, 400)
+
+
+class API_Pagination_TestCase(TestCase):
+
+    def setUp(self):
+        ed = EntityDescription.objects.create(id="rave:ed", name="Spectrum")
+        Entity.objects.bulk_create([
+            Entity(id="rave:e%02d" % i, name="Entity %d" % i, rights="public", description=ed) for i in range(25)
+        ])
+        Activity.objects.create(id="rave:act1", name="Activity step 1")
+        Used.objects.bulk_create([Used(activity_id="rave:act1", entity_id="rave:e%02d" % i) for i in range(25)])
+        self.client = Client()
+
+    def get_all(self, url):
+        # follow the next links, return the results and the number of pages
+        results = []
+        pages = 0
+        while url:
+            with self.assertNumQueries(1):
+                response = self.client.get(url, HTTP_ACCEPT='application/json')
+            self.assertEqual(response.status_code, 200)
+            content = json.loads(response.content)
+            results += content['results']
+            url = content['next']
+            pages += 1
+        return results, pages
+
+    def test_keysetPagination(self):
+        results, pages = self.get_all(reverse('prov_vo:entity-list') + '?page_size=10')
+        self.assertEqual(pages, 3)
+        self.assertEqual([r['prov:id'] for r in results], ["rave:e%02d" % i for i in range(25)])
+        self.assertEqual(results[0]['voprov:description'], "rave:ed")
+
+        results, pages = self.get_all(reverse('prov_vo:used-list') + '?page_size=20')
+        self.assertEqual(pages, 2)
+        self.assertEqual(sorted(r['prov:entity'] for r in results), ["rave:e%02d" % i for i in range(25)])
+
+        config = dict(settings.PROV_VO_CONFIG, api_page_size=5, api_max_page_size=8)
+        with self.settings(PROV_VO_CONFIG=config):
+            results, pages = self.get_all(reverse('prov_vo:entity-list'))
+            self.assertEqual(pages, 5)
+            results, pages = self.get_all(reverse('prov_vo:entity-list') + '?page_size=100')
+            self.assertEqual(pages, 4)
+
+    def test_keysetPaginationNewObjects(self):
+        # objects added between the pages are found, if their ids come later
+        url = reverse('prov_vo:entity-list') + '?page_size=10'
+        content = json.loads(self.client.get(url, HTTP_ACCEPT='application/json').content)
+        Entity.objects.create(id="rave:a00", name="Before the cursor")
+        Entity.objects.create(id="rave:f00", name="After the cursor")
+        results, pages = self.get_all(content['next'])
+        self.assertEqual([r['prov:id'] for r in results], ["rave:e%02d" % i for i in range(10, 25)] + ["rave:f00"])
+
+    def test_selectFields(self):
+        url = reverse('prov_vo:entity-list') + '?page_size=10&fields=prov:id,prov_label'
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, HTTP_ACCEPT='application/json')
+        results = json.loads(response.content)['results']
+        self.assertEqual(results[0], {'prov:id': "rave:e00", 'prov:label': "Entity 0"})
+        self.assertNotIn('rights', context.captured_queries[0]['sql'])
+
+        url = reverse('prov_vo:entity-detail', args=["rave:e01"]) + '?fields=voprov:rights'
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(json.loads(response.content), {'voprov:rights': "public"})
+
+        url = reverse('prov_vo:entity-list') + '?fields=prov:id,voprov:unknown'
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class Export_TestCase(TestCase):
+
+    def setUp(self):
+        create_example_provenance()
+        Parameter.objects.create(id="rave:p2", activity_id="rave:act2", value="1")
+
+    def render(self, renderer, model='W3C', chunk_size=None):
+        sections = export.get_export_sections(model=model, chunk_size=chunk_size)
+        return ''.join(renderer.render_sections(sections))
+
+    def get_allprov(self, format, **extra):
+        response = Client().get(reverse('prov_vo:allprov', kwargs={'format': format}), **extra)
+        self.assertTrue(response.streaming)
+        return response
+
+    def test_exportChunks(self):
+        for model in ['W3C', 'IVOA']:
+            for renderer in [PROVJSONRenderer(), PROVNRenderer()]:
+                self.assertEqual(self.render(renderer, model, chunk_size=1),
+                    self.render(renderer, model, chunk_size=1000))
+
+    def test_exportQueries(self):
+        # one query per table (parameters are read twice for W3C: as entity and used)
+        with self.assertNumQueries(15):
+            self.render(PROVJSONRenderer(), 'W3C')
+        with self.assertNumQueries(19):
+            self.render(PROVJSONRenderer(), 'IVOA')
+
+    def test_exportW3C(self):
+        content = json.loads(self.get_allprov('PROV-JSON').getvalue())
+        self.assertEqual(sorted(content['activity']), ['rave:act1', 'rave:act2', 'rave:actflow'])
+        self.assertEqual(sorted(content['entity']), ['rave:dr4', 'rave:obs', 'rave:p1', 'rave:p2', 'rave:raw'])
+        self.assertEqual(content['entity']['rave:raw']['prov:label'], 'RAVE raw data files')
+        self.assertEqual(content['entity']['rave:dr4']['voprov:description']['prov:label'], 'Catalogue')
+        # the used-relationships of the parameters have different ids
+        parameters = sorted((key, value['prov:entity']) for key, value in content['used'].items()
+            if value.get('prov:role') == 'voprov:parameter')
+        self.assertEqual(parameters, [('_:p0', 'rave:p1'), ('_:p1', 'rave:p2')])
+
+        lines = get_content(self.get_allprov('PROV-N')).splitlines()
+        self.assertEqual(len([line for line in lines if line.startswith('entity(rave:raw,')]), 1)
+        self.assertEqual(len([line for line in lines if line.startswith('activity(rave:actflow,')]), 1)
+
+    def test_exportIVOA(self):
+        # same as the provenance of all nodes from provdal
+        url = reverse('prov_vo:provdal') + '?ID=rave:dr4&ID=rave:actflow&ID=rave:raw&DEPTH=ALL'\
+            + '&MEMBERS=true&STEPS=true&AGENT=true&RESPONSEFORMAT=PROV-JSON'
+        expected = json.loads(Client().get(url).content)
+        content = json.loads(self.get_allprov('PROV-JSON', data={'MODEL': 'IVOA'}).getvalue())
+        for document in [expected, content]:
+            document.pop('prefix')
+            for key in bulkload.RELATION_KEYS:
+                if key in document:
+                    document[key] = sorted(json.dumps(record, sort_keys=True) for record in document[key].values())
+        self.assertEqual(content, expected)
+
+        response = Client().get(reverse('prov_vo:allprov', kwargs={'format': 'PROV-JSON'}), {'MODEL': 'other'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_allprovGzip(self):
+        expected = self.get_allprov('PROV-JSON').getvalue()
+        response = self.get_allprov('PROV-JSON', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        content = gzip.GzipFile(fileobj=StringIO(response.getvalue())).read()
+        self.assertEqual(content, expected)
+
+    def test_dumpCommand(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'prov.json')
+        out = StringIO()
+        call_command('prov_dump', path, model='IVOA', chunk_size=2, stdout=out)
+        self.assertTrue(out.getvalue().startswith("%d bytes written to %s" % (os.path.getsize(path), path)))
+        with open(path, 'rb') as f:
+            document = f.read()
+        self.assertEqual(document, self.render(PROVJSONRenderer(), 'IVOA').encode('utf-8'))
+
+        call_command('prov_dump', path + '.gz', model='IVOA', verbosity=0)
+        with gzip.open(path + '.gz', 'rb') as f:
+            self.assertEqual(f.read(), document)
+
+        # the dump can be loaded again
+        Parameter.objects.all().delete()
+        HadMember.objects.all().delete()
+        Collection.objects.all().delete()
+        loader = bulkload.ProvLoader()
+        with open(path, 'rb') as f:
+            loader.load(f)
+        self.assertEqual(loader.get_totals()['created'], 4)
+        self.assertEqual(loader.unresolved, [])
+        self.assertTrue(Collection.objects.filter(id="rave:raw").exists())
+
+
+class Compression_TestCase(TestCase):
+
+    def setUp(self):
+        e = Entity.objects.create(id="rave:dr4", name="RAVE DR4")
+        for i in range(10):
+            a = Activity.objects.create(id="rave:act%d" % i, name="Activity step %d" % i)
+            WasGeneratedBy.objects.create(entity=e, activity=a)
+        self.url = reverse('prov_vo:provdal') + '?ID=rave:dr4&RESPONSEFORMAT=PROV-JSON'
+        caches['default'].clear()
+
+    def tearDown(self):
+        caches['default'].clear()
+
+    def test_getEncoding(self):
+        request = RequestFactory().get('/')
+        for header, encoding in [
+                ('', 'identity'),
+                ('gzip, deflate', 'gzip'),
+                ('deflate, gzip;q=0.5', 'deflate'),
+                ('gzip;q=0, deflate;q=0', 'identity'),
+                ('*', 'zstd' if compression.zstandard else 'gzip'),
+                ('identity, br', 'identity'),
+                ('GZIP; q=0.8, deflate;q=bad', 'gzip')]:
+            request.META['HTTP_ACCEPT_ENCODING'] = header
+            self.assertEqual(compression.get_encoding(request), encoding, msg=header)
+
+        request.META['HTTP_ACCEPT_ENCODING'] = 'gzip'
+        with self.settings(PROV_VO_CONFIG=dict(settings.PROV_VO_CONFIG, response_compression=False)):
+            self.assertEqual(compression.get_encoding(request), 'identity')
+
+    def test_compressedResponse(self):
+        client = Client()
+        expected = client.get(self.url)
+        self.assertFalse(expected.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', expected['Vary'])
+        for encoding in compression.get_available_encodings():
+            response = client.get(self.url, HTTP_ACCEPT_ENCODING=encoding)
+            self.assertEqual(response['Content-Encoding'], encoding)
+            self.assertEqual(int(response['Content-Length']), len(response.content))
+            self.assertTrue(len(response.content) < len(expected.content))
+            self.assertEqual(compression.decompress(response.content, encoding), expected.content)
+
+        # small responses are not compressed
+        config = dict(settings.PROV_VO_CONFIG, compression_min_size=len(expected.content) + 1)
+        with self.settings(PROV_VO_CONFIG=config):
+            response = client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, expected.content)
+
+    def test_compressedStreaming(self):
+        client = Client()
+        expected = client.get(self.url).content
+        config = dict(settings.PROV_VO_CONFIG, stream_min_records=0)
+        with self.settings(PROV_VO_CONFIG=config):
+            for encoding in compression.get_available_encodings():
+                response = client.get(self.url, HTTP_ACCEPT_ENCODING=encoding)
+                self.assertTrue(response.streaming)
+                self.assertEqual(response['Content-Encoding'], encoding)
+                content = ''.join(response.streaming_content)
+                self.assertEqual(compression.decompress(content, encoding), expected)
+
+    def test_compactJSON(self):
+        client = Client()
+        compact = client.get(self.url).content
+        self.assertNotIn('\n', compact)
+        self.assertNotIn(': ', compact)
+        pretty = client.get(self.url + '&PRETTY=true').content
+        self.assertIn('\n    "wasGeneratedBy": {', pretty)
+        self.assertEqual(json.loads(pretty), json.loads(compact))
+        self.assertEqual(client.get(self.url + '&PRETTY=maybe').status_code, 400)
+        with self.settings(PROV_VO_CONFIG=dict(settings.PROV_VO_CONFIG, pretty_json=True)):
+            self.assertEqual(client.get(self.url).content, pretty)
+
+        # streamed compact documents are the same as the buffered ones
+        prov = {
+            'prefix': {'rave': "http://www.rave-survey.org/prov/"},
+            'entity': {'rave:dr4': Entity.objects.get(id="rave:dr4")},
+            'activity': dict((a.id, a) for a in Activity.objects.all()),
+        }
+        for key in ['activityFlow', 'collection', 'agent', 'parameter', 'used', 'wasGeneratedBy', 'wasAssociatedWith',
+                'wasAttributedTo', 'hadMember', 'wasDerivedFrom', 'hadStep', 'wasInformedBy']:
+            prov[key] = {}
+        renderer = PROVJSONRenderer(indent=None)
+        self.assertEqual(''.join(renderer.render_stream(W3CProvenanceSerializer(prov), chunk_size=10)),
+            renderer.render(W3CProvenanceSerializer(prov).data))
+        allprov = reverse('prov_vo:allprov', kwargs={'format': 'PROV-JSON'})
+        compact = client.get(allprov).getvalue()
+        pretty = client.get(allprov, {'PRETTY': 'true'}).getvalue()
+        self.assertEqual(json.loads(compact), json.loads(pretty))
+        self.assertEqual(compact, json.dumps(json.loads(pretty, object_pairs_hook=OrderedDict), separators=(',', ':')))
+
+    def test_cachedCompressed(self):
+        client = Client()
+        config = dict(settings.PROV_VO_CONFIG, response_cache='default')
+        with self.settings(PROV_VO_CONFIG=config):
+            expected = client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(expected['Content-Encoding'], 'gzip')
+            with self.assertNumQueries(0):
+                response = client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+                plain = client.get(self.url)
+                deflated = client.get(self.url, HTTP_ACCEPT_ENCODING='deflate')
+            # the stored body is returned, without compressing again
+            self.assertEqual(response.content, expected.content)
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertFalse(plain.has_header('Content-Encoding'))
+            self.assertEqual(plain.content, compression.decompress(expected.content, 'gzip'))
+            self.assertEqual(compression.decompress(deflated.content, 'deflate'), plain.content)
+            self.assertEqual(len(set([expected['ETag'], plain['ETag'], deflated['ETag']])), 3)
+            self.assertEqual(client.get(self.url, HTTP_IF_NONE_MATCH=plain['ETag']).status_code, 304)
+            self.assertEqual(client.get(self.url, HTTP_IF_NONE_MATCH=plain['ETag'],
+                HTTP_ACCEPT_ENCODING='gzip').status_code, 200)
+
+    def test_allprovCompressed(self):
+        client = Client()
+        url = reverse('prov_vo:allprov', kwargs={'format': 'PROV-N'})
+        expected = client.get(url).getvalue()
+        response = client.get(url, HTTP_ACCEPT_ENCODING='deflate')
+        self.assertEqual(response['Content-Encoding'], 'deflate')
+        self.assertEqual(compression.decompress(response.getvalue(), 'deflate'), expected)
+
+
+class ProvDAL_CompactGraph_TestCase(TestCase):
+
+    def setUp(self):
+        create_example_provenance()
+        self.url = reverse('prov_vo:provdal') + '?ID=rave:dr4&ID=rave:actflow&ID=rave:raw&DEPTH=ALL'\
+            + '&MEMBERS=true&STEPS=true&AGENT=true&RESPONSEFORMAT=GRAPH-JSON'
+        caches['default'].clear()
+
+    def tearDown(self):
+        caches['default'].clear()
+
+    def get_links(self, nodes, links):
+        return sorted((nodes[link['source']], nodes[link['target']], link['type']) for link in links)
+
+    def test_compactGraph(self):
+        client = Client()
+        expected = json.loads(client.get(self.url).content)
+        content = json.loads(client.get(self.url + '&COMPACT=true').content)
+        self.assertNotIn('layout', content)
+
+        nodes = content['nodes']
+        self.assertEqual(len(nodes['id']), len(nodes['name']))
+        self.assertEqual(sorted(zip(nodes['name'], [content['nodeTypes'][t] for t in nodes['type']])),
+            sorted((node['name'], node['type']) for node in expected['nodes']))
+
+        links = content['links']
+        names = [node['name'] for node in expected['nodes']]
+        compact_links = [{'source': source, 'target': target, 'type': content['linkTypes'][t]}
+            for source, target, t in zip(links['source'], links['target'], links['type'])]
+        self.assertEqual(self.get_links(nodes['name'], compact_links), self.get_links(names, expected['links']))
+
+        # the same graph from values() rows
+        config = dict(settings.PROV_VO_CONFIG, row_traversal=True)
+        with self.settings(PROV_VO_CONFIG=config):
+            self.assertEqual(json.loads(client.get(self.url + '&COMPACT=true').content), content)
+
+    def test_layeredLayout(self):
+        content = json.loads(Client().get(self.url + '&COMPACT=true&LAYOUT=layered').content)
+        layout = content['layout']
+        links = content['links']
+        for source, target in zip(links['source'], links['target']):
+            self.assertTrue(layout['layer'][source] < layout['layer'][target])
+            self.assertTrue(layout['x'][source] < layout['x'][target])
+        for value in layout['x'] + layout['y']:
+            self.assertTrue(0 <= value <= 1)
+
+        # nodes on cycles get layers as well
+        layers = graphjson.get_layers(4, [0, 1, 2, 2], [1, 2, 1, 3])
+        self.assertEqual(layers[0], 0)
+        self.assertEqual(len(set(layers[1:3])), 2)
+        self.assertEqual(layers[3], layers[2] + 1)
+
+        # nodes in one layer are sorted by the positions of their neighbours
+        layout = graphjson.get_layered_layout(6, [0, 1, 0, 1], [3, 2, 4, 5])
+        self.assertTrue(layout['y'][0] < layout['y'][1])
+        self.assertTrue(max(layout['y'][3], layout['y'][4]) < min(layout['y'][2], layout['y'][5]))
+
+    def test_layoutCached(self):
+        config = dict(settings.PROV_VO_CONFIG, layout_cache='default')
+        with self.settings(PROV_VO_CONFIG=config):
+            layout = graphjson.get_cached_layout(3, [0, 1], [1, 2])
+            key = graphjson.LAYOUT_KEY % hashlib.md5(json.dumps([3, [0, 1], [1, 2]])).hexdigest()
+            self.assertEqual(caches['default'].get(key), layout)
+            caches['default'].set(key, {'x': 'cached'})
+            self.assertEqual(graphjson.get_cached_layout(3, [0, 1], [1, 2]), {'x': 'cached'})
+
+    def test_invalidParameters(self):
+        client = Client()
+        url = reverse('prov_vo:provdal') + '?ID=rave:dr4'
+        self.assertEqual(client.get(url + '&COMPACT=true').status_code, 400)
+        self.assertEqual(client.get(url + '&RESPONSEFORMAT=GRAPH-JSON&LAYOUT=LAYERED').status_code, 400)
+        self.assertEqual(client.get(url + '&RESPONSEFORMAT=GRAPH-JSON&COMPACT=true&LAYOUT=circle').status_code, 400)
+        self.assertEqual(client.get(url + '&RESPONSEFORMAT=GRAPH-JSON&COMPACT=true&LAYOUT=layered').status_code, 200)
+
+
+class FullGraph_TestCase(TestCase):
+
+    def setUp(self):
+        create_example_provenance()
+
+    def get_graph(self, params=''):
+        response = Client().get(reverse('prov_vo:graphjson') + params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.getvalue())
+
+    def get_links(self, graph):
+        # links as (source name, target name, type)
+        names = [node['name'] for node in graph['nodes']]
+        return sorted((names[l['source']], names[l['target']], l['type']) for l in graph['links'])
+
+    def test_fullgraphRelations(self):
+        graph = self.get_graph()
+        self.assertEqual([node['name'] for node in graph['nodes']], ['Activity step 1', 'Activity step 2',
+            'Activity flow', 'RAVE DR4', u'RAVE observations \u00e9', 'RAVE raw data files', 'RAVE project'])
+        links = self.get_links(graph)
+        self.assertEqual(len(links), 9)
+        self.assertEqual(sorted(set(link[2] for link in links)), sorted(l[0] for l in fullgraph.FULLGRAPH_LINKS))
+        self.assertIn(('RAVE DR4', u'RAVE observations \u00e9', 'wasDerivedFrom'), links)
+        self.assertIn(('Activity step 2', 'Activity step 1', 'wasInformedBy'), links)
+        self.assertIn(('Activity flow', 'Activity step 2', 'hadStep'), links)
+        self.assertIn(('Activity step 1', 'RAVE project', 'wasAssociatedWith'), links)
+
+    def test_fullgraphQueries(self):
+        # one query per table, independent of the number of relations
+        Used.objects.create(activity_id="rave:act2", entity_id="rave:dr4")
+        with self.assertNumQueries(11):
+            content = ''.join(fullgraph.FullGraph().iter_json())
+        self.assertEqual(len(json.loads(content)['links']), 10)
+        self.assertEqual(''.join(fullgraph.FullGraph(chunk_size=1).iter_json()), content)
+
+    def test_fullgraphCollapse(self):
+        graph = self.get_graph('?collapse=collections')
+        entities = [node for node in graph['nodes'] if node['type'] == 'entity']
+        self.assertEqual(entities, [
+            {'name': 'RAVE DR4', 'type': 'entity', 'count': 1},
+            {'name': 'RAVE raw data files', 'type': 'entity', 'count': 2},
+        ])
+        links = self.get_links(graph)
+        self.assertIn(('Activity step 1', 'RAVE raw data files', 'used'), links)
+        self.assertIn(('RAVE DR4', 'RAVE raw data files', 'wasDerivedFrom'), links)
+        self.assertNotIn('hadMember', [link[2] for link in links])
+
+    def test_fullgraphCluster(self):
+        Activity.objects.filter(id__in=["rave:act1", "rave:act2"]).update(type="obs:Reduction")
+        graph = self.get_graph('?cluster=type')
+        activities = [node for node in graph['nodes'] if node['type'] == 'activity']
+        self.assertEqual(activities, [
+            {'name': 'obs:Reduction', 'type': 'activity', 'count': 2},
+            {'name': 'Activity flow', 'type': 'activity', 'count': 1},
+        ])
+        steps = [l for l in graph['links'] if l['type'] == 'hadStep']
+        self.assertEqual(steps, [{'source': 1, 'target': 0, 'type': 'hadStep', 'value': 0.4, 'count': 2}])
+        self.assertNotIn('wasInformedBy', [l['type'] for l in graph['links']])
+
+    def test_fullgraphSample(self):
+        graph = self.get_graph('?max_nodes=3')
+        self.assertLess(len(graph['nodes']), 7)
+        self.assertEqual(self.get_graph('?max_nodes=3'), graph)
+        for link in graph['links']:
+            self.assertLess(max(link['source'], link['target']), len(graph['nodes']))
+        self.assertEqual(self.get_graph('?sample=1'), self.get_graph())
+        self.assertEqual(self.get_graph('?sample=0.000001')['nodes'], [])
+
+    def test_fullgraphInvalid(self):
+        url = reverse('prov_vo:graphjson')
+        for params in ['?collapse=members', '?cluster=name', '?sample=2', '?sample=x', '?max_nodes=0']:
+            self.assertEqual(Client().get(url + params).status_code, 400)
+
+
+class GraphSummary_TestCase(TestCase):
+
+    def setUp(self):
+        create_example_provenance()
+        caches['default'].clear()
+        self.config = dict(settings.PROV_VO_CONFIG, response_cache='default')
+
+    def tearDown(self):
+        caches['default'].clear()
+
+    def get_summary(self, node=None, status_code=200):
+        url = reverse('prov_vo:graphsummary') + ('?node=' + node if node else '')
+        response = Client().get(url)
+        self.assertEqual(response.status_code, status_code)
+        if status_code == 200:
+            return json.loads(response.content)
+
+    def get_links(self, summary):
+        return sorted((l['source'], l['target'], l['type'], l['count']) for l in summary['links'])
+
+    def test_summaryTopLevel(self):
+        summary = self.get_summary()
+        self.assertEqual(summary['node'], None)
+        self.assertEqual(summary['nodes'], [
+            {'id': 'rave:actflow', 'name': 'Activity flow', 'type': 'activityFlow', 'members': 2, 'count': 2},
+            {'id': 'rave:dr4', 'name': 'RAVE DR4', 'type': 'entity'},
+            {'id': 'rave:raw', 'name': 'RAVE raw data files', 'type': 'collection', 'members': 1, 'count': 1},
+            {'id': 'org:rave', 'name': 'RAVE project', 'type': 'agent'},
+        ])
+        self.assertEqual(self.get_links(summary), [
+            ('rave:actflow', 'org:rave', 'wasAssociatedWith', 1),
+            ('rave:actflow', 'rave:raw', 'used', 1),
+            ('rave:dr4', 'org:rave', 'wasAttributedTo', 1),
+            ('rave:dr4', 'rave:actflow', 'wasGeneratedBy', 1),
+            ('rave:dr4', 'rave:raw', 'wasDerivedFrom', 1),
+        ])
+
+    def test_summaryExpand(self):
+        summary = self.get_summary('rave:actflow')
+        self.assertEqual(summary['node'], 'rave:actflow')
+        self.assertEqual([node['id'] for node in summary['nodes']], ['rave:act1', 'rave:act2'])
+        self.assertEqual(self.get_links(summary), [
+            ('rave:act1', 'org:rave', 'wasAssociatedWith', 1),
+            ('rave:act1', 'rave:raw', 'used', 1),
+            ('rave:act2', 'rave:act1', 'wasInformedBy', 1),
+            ('rave:dr4', 'rave:act1', 'wasGeneratedBy', 1),
+        ])
+        summary = self.get_summary('rave:raw')
+        self.assertEqual([node['id'] for node in summary['nodes']], ['rave:obs'])
+        self.assertEqual(self.get_links(summary), [
+            ('rave:actflow', 'rave:obs', 'used', 1),
+            ('rave:dr4', 'rave:obs', 'wasDerivedFrom', 1),
+        ])
+        self.get_summary('rave:dr4', status_code=400)
+
+    def test_summaryNested(self):
+        c = Collection.objects.create(id="rave:all", name="All RAVE data")
+        HadMember.objects.create(collection=c, entity_id="rave:raw")
+        # would form a cycle
+        HadMember.objects.create(collection_id="rave:raw", entity=c)
+        Used.objects.create(activity_id="rave:act2", entity_id="rave:obs")
+
+        summary = self.get_summary()
+        self.assertEqual([node['id'] for node in summary['nodes']], ['rave:actflow', 'rave:all', 'rave:dr4', 'org:rave'])
+        self.assertEqual(summary['nodes'][1]['members'], 1)
+        self.assertEqual(summary['nodes'][1]['count'], 2)
+        self.assertIn(('rave:actflow', 'rave:all', 'used', 2), self.get_links(summary))
+
+        summary = self.get_summary('rave:all')
+        self.assertEqual([node['id'] for node in summary['nodes']], ['rave:raw'])
+        self.assertIn(('rave:actflow', 'rave:raw', 'used', 2), self.get_links(summary))
+
+        summary = self.get_summary('rave:raw')
+        self.assertEqual(self.get_links(summary), [
+            ('rave:actflow', 'rave:obs', 'used', 2),
+            ('rave:dr4', 'rave:obs', 'wasDerivedFrom', 1),
+        ])
+
+    def test_summaryHierarchy(self):
+        c = Collection.objects.create(id="rave:all", name="All RAVE data")
+        HadMember.objects.create(collection=c, entity_id="rave:raw")
+        graph = graphsummary.GraphSummary(chunk_size=2)
+        graph.load()
+        self.assertEqual(graph.get_chain(('entity', 'rave:obs')),
+            [('entity', 'rave:all'), ('entity', 'rave:raw'), ('entity', 'rave:obs')])
+        self.assertEqual(graph.get_chain(('activity', 'rave:act2')),
+            [('activity', 'rave:actflow'), ('activity', 'rave:act2')])
+        self.assertEqual(graph.size, {('entity', 'rave:all'): 2, ('entity', 'rave:raw'): 1,
+            ('activity', 'rave:actflow'): 2})
+        self.assertEqual(graph.get_node(('entity', 'rave:all')),
+            {'id': 'rave:all', 'name': 'All RAVE data', 'type': 'collection', 'members': 1, 'count': 2})
+
+        summaries = graphsummary.GraphSummary().get_summaries()
+        self.assertEqual(sorted(summaries), [None, 'rave:actflow', 'rave:all', 'rave:raw'])
+        self.assertEqual(summaries, graph.get_summaries())
+
+    def test_summaryShown(self):
+        # the node shown for the last node of a chain, with the super-nodes
+        # of the other chain expanded
+        chain = ['all', 'raw', 'obs']
+        self.assertEqual(graphsummary.get_shown(chain, ['all']), 'raw')
+        self.assertEqual(graphsummary.get_shown(chain, ['all', 'raw']), 'obs')
+        self.assertEqual(graphsummary.get_shown(chain, ['actflow']), 'all')
+        self.assertEqual(graphsummary.get_shown(['dr4'], ['all', 'raw']), 'dr4')
+
+    def test_summaryResponse(self):
+        response = graphsummary.get_summary_response('rave:raw')
+        self.assertEqual(json.loads(response.content)['node'], 'rave:raw')
+        with self.assertRaises(utils.InvalidDataError):
+            graphsummary.get_summary_response('rave:obs')
+
+        # stored for the current generation, unknown nodes without computing
+        with self.settings(PROV_VO_CONFIG=self.config):
+            cache = responsecache.get_response_cache()
+            generation, modified = responsecache.get_generation(cache)
+            graphsummary.store_summaries(cache, generation)
+            with self.assertNumQueries(0):
+                with self.assertRaises(utils.InvalidDataError):
+                    graphsummary.get_summary_response('rave:obs')
+
+    def test_summaryCached(self):
+        with self.settings(PROV_VO_CONFIG=self.config):
+            summary = self.get_summary()
+            # all summaries were stored with the first one
+            with self.assertNumQueries(0):
+                self.assertEqual(self.get_summary('rave:raw')['nodes'][0]['id'], 'rave:obs')
+                self.assertEqual(self.get_summary(), summary)
+                self.get_summary('rave:dr4', status_code=400)
+
+            Entity.objects.filter(id="rave:obs").first().save()
+            Entity.objects.create(id="rave:new", name="New entity")
+            self.assertEqual(len(self.get_summary()['nodes']), 5)
+
+    def test_summarizeCommand(self):
+        with self.assertRaises(CommandError):
+            call_command('prov_summarize', stdout=StringIO())
+        with self.settings(PROV_VO_CONFIG=self.config):
+            out = StringIO()
+            call_command('prov_summarize', chunk_size=2, stdout=out)
+            self.assertIn("3 summaries (4 top-level nodes)", out.getvalue())
+            with self.assertNumQueries(0):
+                self.get_summary('rave:actflow')
+
+
+class Lineage_TestCase(TestCase):
+
+    def setUp(self):
+        self.config = dict(settings.PROV_VO_CONFIG, lineage_table=True)
+        with self.settings(PROV_VO_CONFIG=self.config):
+            create_example_provenance()
+            # a second path from rave:dr4 to rave:obs, and a chain
+            a3 = Activity.objects.create(id="rave:act3", name="Activity step 3")
+            Used.objects.create(activity=a3, entity_id="rave:raw")
+            WasGeneratedBy.objects.create(entity_id="rave:obs", activity=a3)
+            for i in range(5):
+                Entity.objects.create(id="rave:e%d" % i, name="Entity %d" % i)
+                WasDerivedFrom.objects.create(generatedEntity_id="rave:e%d" % i,
+                    usedEntity_id="rave:e%d" % (i - 1) if i else "rave:dr4")
+
+    def get_rows(self):
+        return set(Lineage.objects.values_list('ancestor_kind', 'ancestor_id',
+            'descendant_kind', 'descendant_id', 'min_distance'))
+
+    def assertRebuilt(self):
+        # the incrementally maintained table equals a complete rebuild
+        rows = self.get_rows()
+        lineage.rebuild_lineage()
+        self.assertEqual(rows, self.get_rows())
+
+    def test_lineageRows(self):
+        rows = self.get_rows()
+        self.assertIn(('entity', 'rave:obs', 'entity', 'rave:dr4', 1), rows)
+        self.assertIn(('activity', 'rave:act1', 'activity', 'rave:act2', 1), rows)
+        self.assertIn(('entity', 'rave:raw', 'entity', 'rave:e4', 8), rows)
+        self.assertIn(('activity', 'rave:act3', 'entity', 'rave:dr4', 2), rows)
+        self.assertNotIn('agent', [row[0] for row in rows])
+        self.assertRebuilt()
+
+    def test_lineageDelete(self):
+        with self.settings(PROV_VO_CONFIG=self.config):
+            WasDerivedFrom.objects.get(generatedEntity_id="rave:dr4").delete()
+            rows = self.get_rows()
+            self.assertIn(('entity', 'rave:obs', 'entity', 'rave:dr4', 2), rows)
+            self.assertRebuilt()
+
+            WasGeneratedBy.objects.get(entity_id="rave:dr4").delete()
+            self.assertNotIn('rave:obs', [row[1] for row in self.get_rows() if row[3] == 'rave:e0'])
+            self.assertRebuilt()
+
+    def test_lineageUpdate(self):
+        with self.settings(PROV_VO_CONFIG=self.config):
+            relation = WasDerivedFrom.objects.get(generatedEntity_id="rave:e3")
+            relation.usedEntity_id = "rave:obs"
+            relation.save()
+            self.assertIn(('entity', 'rave:obs', 'entity', 'rave:e4', 2), self.get_rows())
+            self.assertRebuilt()
+
+    def test_lineageDeleteNode(self):
+        with self.settings(PROV_VO_CONFIG=self.config):
+            Entity.objects.get(id="rave:e2").delete()
+            rows = self.get_rows()
+            self.assertNotIn('rave:e2', [row[1] for row in rows] + [row[3] for row in rows])
+            self.assertNotIn('rave:e3', [row[3] for row in rows])
+            self.assertRebuilt()
+
+    def test_lineageTraversal(self):
+        # same result as without the lineage table
+        urls = []
+        for params in ['ID=rave:e4', 'ID=rave:e4&DEPTH=ALL', 'ID=rave:e4&DEPTH=3', 'ID=rave:e4&DEPTH=7',
+                'ID=rave:dr4&ID=rave:act2&DEPTH=ALL&MEMBERS=TRUE&STEPS=TRUE',
+                'ID=rave:obs&DEPTH=ALL&DIRECTION=FORTH&AGENT=TRUE', 'ID=rave:raw&DEPTH=2&DIRECTION=FORTH',
+                'ID=org:rave&DEPTH=ALL&AGENT=TRUE', 'ID=rave:actflow&DEPTH=ALL&STEPS=TRUE']:
+            for model in ['W3C', 'IVOA']:
+                urls.append(reverse('prov_vo:provdal') + '?RESPONSEFORMAT=PROV-JSON&MODEL=%s&%s' % (model, params))
+        expected = [json.loads(Client().get(url).content) for url in urls]
+        for row_traversal in [False, True]:
+            config = dict(self.config, row_traversal=row_traversal)
+            with self.settings(PROV_VO_CONFIG=config):
+                for url, content in zip(urls, expected):
+                    self.assertEqual(json.loads(Client().get(url).content), content, url)
+
+    def test_lineageQueries(self):
+        # the chain of derivations is found with one lookup in the table,
+        # a second one is needed for the collection of rave:obs
+        with self.settings(PROV_VO_CONFIG=self.config):
+            with CaptureQueriesContext(connection) as context:
+                node_ids, relation_ids = lineage.track_provenance_ids(['rave:e4'], countdown=-1)
+        self.assertEqual(len([q for q in context.captured_queries if 'prov_vo_lineage' in q['sql']]), 2)
+        self.assertIn('rave:raw', node_ids['entity'])
+        with CaptureQueriesContext(connection) as level_context:
+            self.assertEqual((node_ids, relation_ids), rows.track_provenance_ids(['rave:e4'], countdown=-1))
+        self.assertLess(2 * len(context.captured_queries), len(level_context.captured_queries))
+
+    def test_lineageBulkLoad(self):
+        document = Client().get(reverse('prov_vo:provdal') + '?ID=rave:e4&DEPTH=ALL&MODEL=IVOA&RESPONSEFORMAT=PROV-JSON').content
+        rows = self.get_rows()
+        Lineage.objects.all().delete()
+        for model in [Used, WasGeneratedBy, WasDerivedFrom, WasInformedBy]:
+            model.objects.all().delete()
+        self.assertEqual(self.get_rows(), set())
+        with self.settings(PROV_VO_CONFIG=self.config):
+            bulkload.ProvLoader().load(StringIO(document))
+        self.assertTrue(self.get_rows())
+        self.assertTrue(self.get_rows() <= rows)
+
+    def test_lineageBulkCreate(self):
+        # relations created through the API are added, without a rebuild
+        pks = set(Lineage.objects.values_list('pk', flat=True))
+        Entity.objects.create(id="rave:input", name="Input")
+        data = [{'prov:activity': "rave:act3", 'prov:entity': "rave:input"}]
+        with self.settings(PROV_VO_CONFIG=self.config):
+            response = Client().post(reverse('prov_vo:used-list'), json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(pks < set(Lineage.objects.values_list('pk', flat=True)))
+        self.assertIn(('entity', 'rave:input', 'entity', 'rave:e4', 8), self.get_rows())
+        self.assertRebuilt()
+
+    def test_lineageCommand(self):
+        Lineage.objects.all().delete()
+        out = StringIO()
+        call_command('prov_lineage', batch_size=3, stdout=out)
+        self.assertIn("%d lineage rows written" % Lineage.objects.count(), out.getvalue())
+        self.assertIn(('entity', 'rave:obs', 'entity', 'rave:dr4', 1), self.get_rows())
+
+
+class RequestStats_TestCase(TestCase):
+
+    def setUp(self):
+        create_example_provenance()
+        self.url = reverse('prov_vo:provdal') + '?ID=rave:dr4&DEPTH=ALL'
+        self.records = []
+        handler = logging.Handler()
+        handler.emit = self.records.append
+        logger = logging.getLogger('prov_vo.stats')
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        self.addCleanup(logger.removeHandler, handler)
+
+    def get_stats(self, url, **config):
+        config = dict(settings.PROV_VO_CONFIG, request_stats=True, request_stats_header=True, **config)
+        with self.settings(PROV_VO_CONFIG=config):
+            with CaptureQueriesContext(connection) as context:
+                response = Client().get(url)
+        self.assertEqual(response.status_code, 200)
+        stats = json.loads(response['X-Prov-Stats'])
+        self.assertEqual(stats['queries'], len(context.captured_queries))
+        return response, stats
+
+    def test_statsDisabled(self):
+        self.assertIs(requeststats.get_request_stats(), requeststats.NO_STATS)
+        response = Client().get(self.url)
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertFalse(response.has_header('X-Prov-Stats'))
+        self.assertEqual(self.records, [])
+
+    def test_statsPhases(self):
+        response, stats = self.get_stats(self.url)
+        phases = ['resolve', 'traversal', 'descriptions', 'serialization', 'rendering']
+        self.assertEqual([phase['name'] for phase in stats['phases']], phases)
+        self.assertEqual(stats['queries'], sum(phase['queries'] for phase in stats['phases']))
+        self.assertGreater(stats['phases'][1]['queries'], 0)
+        self.assertEqual(stats['nodes'], {'entity': 3, 'activity': 1, 'activityFlow': 1, 'agent': 1})
+        self.assertEqual(stats['relations'], {'used': 1, 'wasGeneratedBy': 1, 'hadMember': 1, 'hadStep': 1,
+            'wasDerivedFrom': 1, 'wasAssociatedWith': 1, 'wasAttributedTo': 1})
+
+        metrics = [metric.split(';')[0] for metric in response['Server-Timing'].split(', ')]
+        self.assertEqual(metrics, phases + ['total'])
+        self.assertIn('resolve;dur=', response['Server-Timing'])
+
+    def test_statsRowTraversal(self):
+        response, stats = self.get_stats(self.url + '&RESPONSEFORMAT=GRAPH-JSON&COMPACT=TRUE', row_traversal=True)
+        self.assertEqual([phase['name'] for phase in stats['phases']],
+            ['resolve', 'traversal', 'descriptions', 'serialization', 'rendering'])
+        response, row_stats = self.get_stats(self.url, row_traversal=True)
+        self.assertEqual(row_stats['relations'], self.get_stats(self.url)[1]['relations'])
+
+    def test_statsStreamed(self):
+        # serialization and rendering happen while streaming, logged at the end
+        config = dict(settings.PROV_VO_CONFIG, request_stats=True, request_stats_header=True, stream_min_records=0)
+        with self.settings(PROV_VO_CONFIG=config):
+            with CaptureQueriesContext(connection) as context:
+                response = Client().get(self.url + '&MODEL=W3C')
+                self.assertTrue(response.streaming)
+                self.assertIn('streaming;desc="measured in the log"', response['Server-Timing'])
+                self.assertEqual(json.loads(response['X-Prov-Stats'])['streaming'], "measured in the log")
+                self.assertEqual(self.records, [])
+                content = response.getvalue()
+        self.assertIn('rave:dr4', json.loads(content)['entity'])
+        self.assertEqual(len(self.records), 1)
+        stats = self.records[0].prov_stats
+        self.assertEqual([phase['name'] for phase in stats['phases']],
+            ['resolve', 'traversal', 'descriptions', 'streaming'])
+        self.assertEqual(stats['queries'], len(context.captured_queries))
+        self.assertGreaterEqual(stats['total'], stats['phases'][-1]['wall_time'])
+
+    def test_statsLog(self):
+        config = dict(settings.PROV_VO_CONFIG, request_stats=True)
+        with self.settings(PROV_VO_CONFIG=config):
+            response = Client().get(self.url + '&RESPONSEFORMAT=PROV-N')
+        self.assertTrue(response.has_header('Server-Timing'))
+        self.assertFalse(response.has_header('X-Prov-Stats'))
+        self.assertEqual(len(self.records), 1)
+        stats = self.records[0].prov_stats
+        self.assertEqual(stats['path'], self.url + '&RESPONSEFORMAT=PROV-N')
+        self.assertEqual(stats['status'], 200)
+        self.assertEqual(json.loads(self.records[0].getMessage().split(' ', 1)[1]), json.loads(json.dumps(stats)))
+        # the queries are not kept in the connection without DEBUG
+        self.assertEqual(len(connection.queries_log), 0)
+
+
 class ProvDALForm_TestCase(TestCase):
 
     def setUp(self):
@@ -1444,7 +3336,7 @@ entity(ex:ent1, [prov:label="Entity 1"])
         client = Client()
         response = client.get(reverse('prov_vo:allprov', kwargs={'format':'PROV-JSON'}))
         self.assertEqual(response.status_code, 200)
-        content = json.loads(response.content)
+        content = json.loads(response.getvalue())
 
         self.assertEqual(content['activity'],
             {'ex:act1': {'prov:id': 'ex:act1', 'prov:label': 'Activity 1'},
@@ -1480,8 +3372,8 @@ class View_Fullgraph_TestCase(TestCase):
         client = Client()
         response = client.get(reverse('prov_vo:graphjson'))
         self.assertEqual(response.status_code, 200)
-        #print 'content: ', response.content
+        #print 'content: ', response.getvalue()
 
-        content = json.loads(response.content)
+        content = json.loads(response.getvalue())
         expected={u'nodes': [{u'type': u'activity', u'name': u'Activity 1'}, {u'type': u'activity', u'name': u'Activity 2'}, {u'type': u'entity', u'name': u'Entity 1'}], u'links': []}
         self.assertEqual(content, expected)